@@ -0,0 +1,346 @@
+'''Load generation benchmark for the streak and log cogs.
+
+Seeds a local storage backend with a synthetic population, then drives the
+daily, leaderboard, pb, rank, log, logboard and logbook commands through fake
+contexts and reports throughput, p50/p95/p99 latency, SQL statements and
+storage calls per command as JSON. Every storage call takes one pooled
+connection on the MySQL backend, so storage calls per command is the number
+of pool checkouts that command would cost there.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.bench_cogs --backend sqlite --users 1000,100000 --output bench.json
+
+With --guilds above 1 the bot runs with PerGuild and users are spread evenly
+across that many guilds. With --fast the bot runs in the same fast mode as
+[Runtime] Fast. Each command also reports how late the event loop woke from
+the loop monitor's 10ms sleeps while it ran.
+'''
+from datetime import datetime, timedelta
+import argparse
+import asyncio
+import configparser
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import discord
+from discord.ext import commands
+from streakbot import Streakbot
+from storage import LOG_TYPES
+from cogs.streak import Streak_Commands
+from cogs.log import Log_Commands
+from runtime import fast_mode, runtime_json
+
+COMMANDS = ['daily', 'leaderboard', 'pb', 'rank', 'log', 'logboard', 'logbook']
+
+
+class BenchBot(Streakbot):
+    '''Streakbot that is never connected to Discord, so every user resolves to
+    a placeholder name rather than being missing from the member cache'''
+    def get_user(self, user_id):
+        return f'user{user_id}'
+
+    def get_guild(self, guild_id):
+        return FakeGuild()
+
+
+class FakeGuild:
+    '''Every user is treated as a member, as the seeded data only puts each
+    user in their own guild's partition'''
+    def get_member(self, user_id):
+        return f'user{user_id}'
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f'user{user_id}'
+        self.discriminator = '0'
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+    async def edit(self, **kwargs):
+        pass
+
+
+class FakeContext:
+    '''Just enough of commands.Context for the cogs'''
+    def __init__(self, bot, user_id, channel_id, guild_id):
+        self.bot = bot
+        self.author = FakeUser(user_id)
+        self.message = discord.Object(id=0)
+        self.message.author = self.author
+        self.channel = discord.Object(id=channel_id)
+        self.guild = discord.Object(id=guild_id)
+        self.guild.icon = None
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        return FakeMessage()
+
+    async def defer(self, **kwargs):
+        pass
+
+
+class Counters:
+    '''Counts SQL statements and outermost storage calls. Nesting is tracked
+    per task so that concurrent commands are each counted'''
+    def __init__(self):
+        self.queries = 0
+        self.storage_calls = 0
+        self.depth = contextvars.ContextVar('depth', default=0)
+
+    def trace(self, statement):
+        self.queries += 1
+
+    def wrap(self, method):
+        @functools.wraps(method)
+        async def counted(*args, **kwargs):
+            depth = self.depth.get()
+            if depth == 0:
+                self.storage_calls += 1
+            token = self.depth.set(depth + 1)
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self.depth.reset(token)
+        return counted
+
+
+def last_claim(rng, now):
+    '''Samples a last claim time. Most users claim in an evening rush around
+    20:00, over half have already claimed today, some are due and a tail has
+    let their streak time out'''
+    roll = rng.random()
+    if roll < 0.55:
+        days_ago = 0
+    elif roll < 0.85:
+        days_ago = 1
+    else:
+        days_ago = rng.randint(2, 30)
+    hour = min(max(rng.gauss(20, 2.5), 0), 23.99)
+    claimed = (now - timedelta(days=days_ago)).replace(hour=int(hour), minute=int(hour % 1 * 60),
+                                                       second=rng.randint(0, 59), microsecond=0)
+    if claimed > now:
+        claimed -= timedelta(days=1)
+    return claimed
+
+
+def guild_of(user_id, guilds):
+    '''Every user belongs to one guild, numbered from 1'''
+    return user_id % guilds + 1
+
+
+def partition(user_id, guilds):
+    return guild_of(user_id, guilds) if guilds > 1 else 0
+
+
+def population(size, guilds, seed, now):
+    '''Yields (users, logs) rows for a synthetic population. Streak lengths
+    are roughly exponential and about a third of users log each month'''
+    rng = random.Random(seed)
+    month = now.strftime('%Y-%m')
+    for user_id in range(1, size + 1):
+        guild_id = partition(user_id, guilds)
+        claimed = last_claim(rng, now)
+        streak = int(rng.expovariate(1 / 15)) + 1
+        personal_best = streak + int(rng.expovariate(1 / 10))
+        year_streak = min(streak, now.timetuple().tm_yday)
+        user = (guild_id, user_id, f'user{user_id}', 0, claimed, streak, personal_best,
+                max(year_streak, 1), year_streak)
+        log = None
+        if rng.random() < 0.33:
+            log = (guild_id, user_id, month, rng.randint(0, 200), rng.randint(0, 3000))
+        yield user, log
+
+
+async def seed(storage, size, guilds, now, seed_value):
+    '''Loads the synthetic population through the bulk import path in
+    batches. Logs go through add_logs so their rollups are seeded with them'''
+    users, logs = [], []
+    for user, log in population(size, guilds, seed_value, now):
+        users.append(user)
+        if log is not None:
+            logs.append(log)
+        if len(users) >= 10000:
+            await storage.import_rows('users', users)
+            users = []
+        if len(logs) >= 10000:
+            await storage.add_logs(logs)
+            logs = []
+    if users:
+        await storage.import_rows('users', users)
+    if logs:
+        await storage.add_logs(logs)
+    await storage.mark_rollover(now.year, now)
+
+
+async def invoke(command, cog, ctx, *args):
+    '''Runs a command callback and its error handler the way the command
+    framework would, without parsing a message'''
+    try:
+        await command.callback(cog, ctx, *args)
+    except commands.CommandError as error:
+        if command.has_error_handler():
+            await command.on_error(cog, ctx, error)
+
+
+def command_args(name, rng, size, now):
+    user_id = rng.randint(1, int(size * 1.05))
+    # Mostly the current month, then the year, quarter and all-time boards
+    period = rng.choice([now.strftime('%m-%Y')] * 4 + [str(now.year), f'Q{(now.month + 2) // 3}-{now.year}', 'all'])
+    if name == 'daily':
+        return user_id, ()
+    if name == 'leaderboard':
+        return user_id, (rng.choice(['overall', 'current']),)
+    if name == 'pb':
+        if rng.random() < 0.5:
+            return user_id, (rng.choice([0, now.year, now.year - 1]),)
+        return user_id, (0, FakeUser(rng.randint(1, size)))
+    if name == 'rank':
+        return user_id, (FakeUser(rng.randint(1, size)), rng.choice(['overall', 'current', 'pb']))
+    if name == 'log':
+        return user_id, (rng.choice(LOG_TYPES), rng.randint(1, 120))
+    if name == 'logboard':
+        return user_id, (rng.choice(LOG_TYPES), period)
+    return user_id, (rng.choice(LOG_TYPES), FakeUser(rng.randint(1, size)), period)
+
+
+async def run_command(bot, cogs, name, ops, concurrency, size, guilds, now, counters, seed_value):
+    cog = cogs['log'] if name in ('log', 'logboard', 'logbook') else cogs['streak']
+    command = getattr(cog, name)
+    rng = random.Random(f'{seed_value}-{name}')
+    latencies = []
+
+    async def one():
+        user_id, args = command_args(name, rng, size, now)
+        ctx = FakeContext(bot, user_id, rng.randint(1, 20), guild_of(user_id, guilds))
+        start = time.perf_counter()
+        await invoke(command, cog, ctx, *args)
+        latencies.append(time.perf_counter() - start)
+
+    queries, storage_calls = counters.queries, counters.storage_calls
+    bot.loop_monitor.summary()
+    started = time.perf_counter()
+    for done in range(0, ops, concurrency):
+        await asyncio.gather(*(one() for _ in range(min(concurrency, ops - done))))
+    elapsed = time.perf_counter() - started
+
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'ops': ops,
+        'seconds': round(elapsed, 4),
+        'throughput': round(ops / elapsed, 2),
+        'p50_ms': round(quantiles[49] * 1000, 4),
+        'p95_ms': round(quantiles[94] * 1000, 4),
+        'p99_ms': round(quantiles[98] * 1000, 4),
+        'queries_per_op': round((counters.queries - queries) / ops, 3),
+        'storage_calls_per_op': round((counters.storage_calls - storage_calls) / ops, 3),
+        'loop_lag': bot.loop_monitor.summary(),
+    }
+
+
+def bench_config(backend, path, guilds):
+    config = configparser.ConfigParser()
+    config['Database'] = {'Backend': backend, 'Path': path}
+    config['Streaks'] = {'Cooldown': '82800', 'Timeout': '172800', 'Reminder': '3600',
+                         'PerGuild': str(guilds > 1)}
+    config['Runtime'] = {'LoopCheckInterval': '0.01'}
+    return config
+
+
+async def bench_population(bot, backend, size, args):
+    now = datetime.now()
+    counters = Counters()
+    await bot.setup_hook()
+    started = time.perf_counter()
+    await seed(bot.storage, size, args.guilds, now, args.seed)
+    seeded = time.perf_counter() - started
+
+    for method in bot.storage.METHODS:
+        setattr(bot.storage, method, counters.wrap(getattr(bot.storage, method)))
+    if backend == 'sqlite':
+        await bot.storage.conn.set_trace_callback(counters.trace)
+
+    cogs = {'streak': Streak_Commands(bot), 'log': Log_Commands(bot)}
+    await bot.add_cog(cogs['streak'])
+    await bot.add_cog(cogs['log'])
+    try:
+        results = {}
+        for name in args.commands:
+            results[name] = await run_command(bot, cogs, name, args.ops, args.concurrency,
+                                              size, args.guilds, now, counters, args.seed)
+            logging.info(f'{size} users {name}: {results[name]}')
+    finally:
+        await bot.remove_cog(cogs['streak'].qualified_name)
+        await bot.remove_cog(cogs['log'].qualified_name)
+    return {'users': size, 'seed_seconds': round(seeded, 2), 'commands': results}
+
+
+def run(args):
+    report = {'backend': args.backend, 'ops': args.ops, 'concurrency': args.concurrency,
+              'guilds': args.guilds, 'json': runtime_json(),
+              'python': sys.version.split()[0], 'started': datetime.now().isoformat(),
+              'populations': []}
+    for size in args.users:
+        with tempfile.TemporaryDirectory() as tmp:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            report['loop'] = type(loop).__module__.split('.')[0]
+            try:
+                bot = BenchBot(bench_config(args.backend, os.path.join(tmp, 'bench.db'), args.guilds),
+                               command_prefix='$', intents=discord.Intents.default())
+                try:
+                    report['populations'].append(
+                        loop.run_until_complete(bench_population(bot, args.backend, size, args)))
+                finally:
+                    pending = asyncio.all_tasks(loop)
+                    for task in pending:
+                        task.cancel()
+                    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+                    bot.loop_monitor.stop()
+                    loop.run_until_complete(bot.storage.close())
+            finally:
+                loop.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the streak and log cogs against a local backend')
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='sqlite')
+    parser.add_argument('--users', type=lambda value: [int(size) for size in value.split(',')],
+                        default=[1000, 100000], help='comma separated population sizes, e.g. 1000,100000,1000000')
+    parser.add_argument('--ops', type=int, default=1000, help='invocations per command')
+    parser.add_argument('--guilds', type=int, default=1, help='guilds to spread users across')
+    parser.add_argument('--concurrency', type=int, default=1, help='invocations in flight at once')
+    parser.add_argument('--commands', type=lambda value: value.split(','), default=COMMANDS)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--fast', action='store_true', help='use uvloop and orjson where installed')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', stream=sys.stderr, level=logging.WARNING)
+    if args.fast:
+        fast_mode()
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
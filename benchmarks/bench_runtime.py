@@ -0,0 +1,137 @@
+'''Micro-benchmark for the pieces fast mode swaps out - the gateway JSON
+codec and the event loop. Gateway-shaped payloads are decoded and encoded
+with the json module and with orjson, and task switching, callbacks and
+task creation are timed on the asyncio loop and on uvloop. Anything not
+installed is left out of the report.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.bench_runtime --output runtime.json
+'''
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+
+def message_create(number):
+    author = {'id': str(10 ** 17 + number), 'username': f'user{number}', 'global_name': None,
+              'discriminator': '0', 'avatar': 'a' * 32, 'public_flags': 0}
+    return {'op': 0, 's': number, 't': 'MESSAGE_CREATE', 'd': {
+        'id': str(10 ** 18 + number), 'channel_id': '1' * 18, 'guild_id': '2' * 18,
+        'author': author, 'member': {'roles': ['3' * 18, '4' * 18], 'nick': None,
+                                     'joined_at': '2024-01-01T00:00:00.000000+00:00'},
+        'content': '$daily', 'timestamp': '2026-01-01T20:00:00.000000+00:00', 'edited_timestamp': None,
+        'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [],
+        'attachments': [], 'embeds': [], 'pinned': False, 'type': 0, 'flags': 0}}
+
+
+def guild_create(members):
+    return {'op': 0, 's': 1, 't': 'GUILD_CREATE', 'd': {
+        'id': '2' * 18, 'name': 'Guild', 'member_count': members,
+        'members': [message_create(number)['d']['member'] | {'user': message_create(number)['d']['author']}
+                    for number in range(members)]}}
+
+
+def codecs():
+    found = {'json': (lambda obj: json.dumps(obj, separators=(',', ':'), ensure_ascii=True), json.loads)}
+    try:
+        import orjson
+    except ImportError:
+        pass
+    else:
+        found['orjson'] = (lambda obj: orjson.dumps(obj).decode('utf-8'), orjson.loads)
+    return found
+
+
+def bench_codec(dumps, loads, payload, repeat):
+    text = dumps(payload)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        loads(text)
+    decoded = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(repeat):
+        dumps(payload)
+    encoded = time.perf_counter() - started
+    return {'bytes': len(text), 'decode_us': round(decoded / repeat * 1e6, 3),
+            'encode_us': round(encoded / repeat * 1e6, 3)}
+
+
+def loops():
+    found = {'asyncio': asyncio.new_event_loop}
+    try:
+        import uvloop
+    except ImportError:
+        pass
+    else:
+        found['uvloop'] = uvloop.new_event_loop
+    return found
+
+
+async def bench_loop(count):
+    loop = asyncio.get_running_loop()
+    results = {}
+
+    started = time.perf_counter()
+    for _ in range(count):
+        await asyncio.sleep(0)
+    results['switch_us'] = (time.perf_counter() - started) / count
+
+    done = loop.create_future()
+    remaining = [count]
+
+    def callback():
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            done.set_result(None)
+    started = time.perf_counter()
+    for _ in range(count):
+        loop.call_soon(callback)
+    await done
+    results['call_soon_us'] = (time.perf_counter() - started) / count
+
+    async def noop():
+        pass
+    started = time.perf_counter()
+    await asyncio.gather(*(noop() for _ in range(count)))
+    results['task_us'] = (time.perf_counter() - started) / count
+    return {name: round(seconds * 1e6, 3) for name, seconds in results.items()}
+
+
+def run(args):
+    payloads = {'message_create': message_create(1), 'guild_create': guild_create(args.members)}
+    report = {'python': sys.version.split()[0], 'codecs': {}, 'loops': {}}
+    for name, (dumps, loads) in codecs().items():
+        report['codecs'][name] = {payload: bench_codec(dumps, loads, value, args.repeat if payload == 'message_create'
+                                                       else max(args.repeat // args.members, 1))
+                                  for payload, value in payloads.items()}
+    for name, new_loop in loops().items():
+        loop = new_loop()
+        try:
+            report['loops'][name] = loop.run_until_complete(bench_loop(args.tasks))
+        finally:
+            loop.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the JSON codecs and event loops fast mode chooses between')
+    parser.add_argument('--repeat', type=int, default=20000, help='message payloads coded per codec')
+    parser.add_argument('--members', type=int, default=1000, help='members in the guild payload')
+    parser.add_argument('--tasks', type=int, default=100000, help='switches, callbacks and tasks per loop')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -9,9 +9,12 @@ import asyncio
 import configparser
 import re
 from datetime import datetime
-from db import Database
+from streakbot import Streakbot, ShardedStreakbot
+from runtime import fast_mode
+import metrics
 
 logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', stream=sys.stderr,level=logging.INFO)
+logging.getLogger().addHandler(metrics.ErrorCounter())
 
 config = configparser.ConfigParser()
 try:
@@ -19,44 +22,20 @@ try:
 except Exception as e:
     sys.exit(f'Could not load configuration file {e}')
 creds = config['Credentials']
-db = config['Database']
-streakcfg = config['Streaks']
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True # Intent allows us to get users that haven't been seen yet
 
-class Streakbot(commands.Bot):
-    def __init__(self, **kwargs):
-        super(Streakbot, self).__init__(**kwargs)
-        self.database = Database(db['Host'], creds['DatabaseUser'], creds['DatabasePass'], db['Name'], int(db['PoolSize']))
-        asyncio.get_event_loop().run_until_complete(self.database.bootstrap_db())
-        self.db_pool = asyncio.get_event_loop().run_until_complete(self.database.create_pool())
+# Load Modules #
+extensions = ['cogs.streak', 'cogs.log', 'cogs.fun', 'cogs.utility', 'cogs.admin']
 
-    async def generate_leaderboard(self, title, stats, colour, thumbnail, footer):
-        '''Helper function to generate embeds for leaderboards - gracefully handles
-        users no longer being on the server.'''
-        counter = 1
-        leaderboard_text = ''
-        for user, stat in stats:
-            username = self.get_user(int(user))
-            if username is not None:
-                leaderboard_text += f'**{counter}.** {username}  -  {stat}\n'
-                counter += 1
-        embed = discord.Embed(color=colour)
-        embed.set_thumbnail(url=thumbnail)
-        embed.add_field(name=title, value=leaderboard_text, inline=True)
-        embed.set_footer(text=footer)
-        return embed
+if config.getboolean('Runtime', 'Fast', fallback=False): # uvloop and orjson where installed
+    loop, codec = fast_mode()
+    logging.info(f'Fast mode using the {loop} event loop and {codec} gateway codec')
 
-bot = Streakbot(command_prefix='$', case_insensitive=True, intents=intents)
-bot.CMD_COOLDOWN = int(streakcfg['Cooldown']) # Cooldown is 23 hours (82800)
-bot.STREAK_TIMEOUT = int(streakcfg['Timeout']) # Timeout after 48 hours (172800)
-bot.REMINDER_THRESHOLD = int(streakcfg['Reminder']) # Threshold for reminders
-
-if not db['Name'].isalnum():
-    logging.exception('Invalid characters in SQL database name')
-    sys.exit(1)
+bot_class = ShardedStreakbot if config.getboolean('Streaks', 'PerGuild', fallback=False) else Streakbot
+bot = bot_class(config, extensions, command_prefix='$', case_insensitive=True, intents=intents)
 
 @atexit.register
 def cleanup():
@@ -64,10 +43,6 @@ def cleanup():
 
 @bot.event
 async def on_ready():
-    # Load Modules #
-    extensions = ['cogs.streak', 'cogs.log', 'cogs.fun', 'cogs.utility']
-    for extension in extensions:
-        await bot.load_extension(extension)
     logging.info(f'Logged on as {bot.user}!')
 
 
@@ -0,0 +1,207 @@
+from collections import OrderedDict
+import asyncio
+import time
+from functools import partial
+import metrics
+
+
+class LeaderboardCache:
+    '''Keeps the top N rows of each leaderboard in memory so that repeated
+    leaderboard commands do not hit the database. Boards are keyed by tuples
+    such as (0, 'overall'), (0, 'pb', 2021) or (0, 'log', 'pages', '2021-01') and are
+    kept up to date by the cogs as they write, falling back to a bounded
+    LIMIT query on a miss.'''
+    def __init__(self, size):
+        self.size = size
+        self.boards = {}
+        self.versions = {}
+        self.generation = 0
+
+    def version(self, key):
+        '''Returns the write version of a board. Taken before a fill query so
+        that a fill racing with a write does not store stale rows'''
+        return (self.generation, self.versions.get(key, 0))
+
+    def get(self, key, now=None):
+        '''Returns the cached (user_id, value) rows for a board, or None on a
+        miss. Rows can carry an expiry time (streaks past the timeout) - once
+        one lapses a full board can no longer vouch for its last places and is
+        treated as a miss'''
+        board = self.boards.get(key)
+        if board is None:
+            return None
+        now = time.time() if now is None else now
+        if any(expires is not None and expires <= now for _, _, expires in board['rows']):
+            if not board['complete']:
+                self.invalidate(key)
+                return None
+            board['rows'] = [row for row in board['rows']
+                             if row[2] is None or row[2] > now]
+        return [(user_id, value) for user_id, value, _ in board['rows']]
+
+    def fill(self, key, rows, version):
+        '''Stores rows fetched with LIMIT size, as (user_id, value) or
+        (user_id, value, expires). A short result means the board holds every
+        row there is. User IDs are kept as ints whatever the column type'''
+        if self.version(key) != version:
+            return
+        rows = [(int(row[0]), row[1], row[2] if len(row) > 2 else None) for row in rows]
+        rows.sort(key=lambda row: (-row[1], row[0]))
+        self.boards[key] = {'rows': rows, 'complete': len(rows) < self.size}
+
+    def page(self, key, after, count):
+        '''Returns up to count (user_id, value, expires) rows of a board that
+        come after the keyset cursor after, a (value, user_id) pair or None for
+        the top. Returns None when the cached rows cannot answer the whole
+        page'''
+        if self.get(key) is None:
+            return None
+        rows = self.boards[key]['rows']
+        start = 0
+        if after is not None:
+            cursor = (-after[0], int(after[1]))
+            start = next((i for i, row in enumerate(rows)
+                          if (-row[1], row[0]) > cursor), len(rows))
+        page = rows[start:start + count]
+        if len(page) < count and not self.boards[key]['complete']:
+            return None
+        return page
+
+    def update(self, key, user_id, value, expires=None):
+        '''Applies a single user's new value to a cached board'''
+        self.versions[key] = self.versions.get(key, 0) + 1
+        board = self.boards.get(key)
+        if board is None:
+            return
+        user_id = int(user_id)
+        rows = board['rows']
+        old = next((row for row in rows if row[0] == user_id), None)
+        if old is not None:
+            rows.remove(old)
+        if not board['complete'] and (not rows or (-value, user_id) > (-rows[-1][1], rows[-1][0])):
+            # Below the last cached place - if the user was on the board they
+            # may now be behind rows that were never fetched
+            if old is not None:
+                self.invalidate(key)
+            return
+        rows.append((user_id, value, expires))
+        rows.sort(key=lambda row: (-row[1], row[0]))
+        if len(rows) > self.size:
+            del rows[self.size:]
+            board['complete'] = False
+
+    def invalidate(self, key=None):
+        '''Drops one board, or every board when no key is given'''
+        if key is None:
+            self.generation += 1
+            self.boards.clear()
+        else:
+            self.versions[key] = self.versions.get(key, 0) + 1
+            self.boards.pop(key, None)
+
+
+class ClaimCache:
+    '''LRU cache of each recently seen user's (daily_claimed, streak) so that
+    repeated $daily attempts while on cooldown are answered without a
+    transaction. Only claims move daily_claimed, and always forwards, so a
+    cached claim time can lag the database but never run ahead of it - if the
+    cache says a user is on cooldown they are. Anything else goes through to
+    the database.'''
+    def __init__(self, size):
+        self.size = size
+        self.users = OrderedDict()
+
+    def get(self, user_id):
+        entry = self.users.get(user_id)
+        if entry is not None:
+            self.users.move_to_end(user_id)
+        return entry
+
+    def set(self, user_id, daily_claimed, streak):
+        if self.size <= 0:
+            return
+        self.users[user_id] = (daily_claimed, streak)
+        self.users.move_to_end(user_id)
+        if len(self.users) > self.size:
+            self.users.popitem(last=False)
+
+    def cooldown(self, user_id, curr_time, cooldown):
+        '''Returns an on_cooldown response like apply_claim's if the cache
+        shows the user is still on cooldown, otherwise None'''
+        entry = self.get(user_id)
+        if entry is None:
+            return None
+        daily_claimed, streak = entry
+        remaining = cooldown - (curr_time - daily_claimed).total_seconds()
+        if remaining <= 0:
+            return None
+        return {'status': 'on_cooldown', 'cooldown': remaining,
+                'daily_claimed': daily_claimed, 'streak': streak}
+
+    def invalidate(self, user_id=None):
+        '''Drops one user, or everyone when no user is given'''
+        if user_id is None:
+            self.users.clear()
+        else:
+            self.users.pop(user_id, None)
+
+
+class EmbedCache:
+    '''LRU cache of rendered leaderboard pages, so an unchanged page is sent
+    again without fetching names or building a new embed. Entries carry the
+    version of the data they were built from and are only returned while it
+    still matches. They also expire when the first streak on the page times
+    out, or after ttl seconds so that renamed users catch up.'''
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.pages = OrderedDict()
+
+    def get(self, key, version, now=None):
+        entry = self.pages.get(key)
+        if entry is None:
+            return None
+        now = time.time() if now is None else now
+        if entry[0] != version or entry[1] <= now:
+            del self.pages[key]
+            return None
+        self.pages.move_to_end(key)
+        return entry[2]
+
+    def set(self, key, version, value, expires=None, now=None):
+        if self.size <= 0:
+            return
+        now = time.time() if now is None else now
+        expires = now + self.ttl if expires is None else min(expires, now + self.ttl)
+        self.pages[key] = (version, expires, value)
+        self.pages.move_to_end(key)
+        if len(self.pages) > self.size:
+            self.pages.popitem(last=False)
+
+
+class SingleFlight:
+    '''Coalesces identical concurrent calls. The first caller for a key
+    starts the call and everyone who asks for the same key while it is in
+    flight awaits that same call and shares its result, or its exception.
+    Each caller waits through a shield, so one of them being cancelled does
+    not cancel the call for the rest. Results are shared, so callers must
+    not modify them.'''
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}
+
+    async def run(self, key, function, *args):
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(function(*args))
+            task.add_done_callback(partial(self.done, key))
+        else:
+            metrics.COALESCED_CALLS.inc(self.name)
+        return await asyncio.shield(task)
+
+    def done(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # Marks the exception as retrieved should every caller have gone
+            task.exception()
@@ -0,0 +1,126 @@
+import discord
+from discord.ext import commands
+import logging
+import os
+import tempfile
+from storage import EXPORT_TABLES
+from transfer import FORMATS, format_of, export_table, import_table
+
+class Admin_Commands(commands.Cog, name='Admin Commands'):
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def cog_check(self, ctx):
+        return await self.bot.is_owner(ctx.author)
+
+    ####################################
+    ####      Commands Section      ####
+    ####################################
+    @commands.command(help=f'''Exports one of the {", ".join(EXPORT_TABLES)} tables as
+    a jsonl or csv attachment. Bigger tables than Discord will take can be exported
+    with transfer.py instead''', brief='Export a table', hidden=True)
+    async def export(self, ctx, table, format = 'jsonl'):
+        if table not in EXPORT_TABLES or format not in FORMATS:
+            raise commands.BadArgument()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f'{table}.{format}')
+            count = await self.export_file(table, path, format)
+            if count is None:
+                await ctx.send(f'Unable to export {table}')
+                return False
+            limit = ctx.guild.filesize_limit if ctx.guild is not None else discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES
+            if os.path.getsize(path) > limit:
+                await ctx.send(f'The {table} export is too big to upload, use transfer.py instead')
+                return False
+            await ctx.send(f'Exported {count} {table} rows', file=discord.File(path))
+            return True
+
+    @export.error
+    async def export_error(self, ctx, error):
+        if isinstance(error, commands.BadArgument):
+            await ctx.send(f'Invalid arguments \n Usage: `{ctx.bot.command_prefix}export <{"|".join(EXPORT_TABLES)}> <{"|".join(FORMATS)}>`')
+        else:
+            raise error
+
+    @commands.command(name='import', help=f'''Imports an attached jsonl or csv file into
+    one of the {", ".join(EXPORT_TABLES)} tables, replacing any rows already there for
+    the same users''', brief='Import a table', hidden=True)
+    async def import_rows(self, ctx, table):
+        if table not in EXPORT_TABLES or not ctx.message.attachments:
+            raise commands.BadArgument()
+        attachment = ctx.message.attachments[0]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'import')
+            await attachment.save(path)
+            count = await self.import_file(table, path, format_of(attachment.filename))
+        if count is None:
+            await ctx.send(f'Unable to import {table} from {attachment.filename}')
+            return False
+        await ctx.send(f'Imported {count} {table} rows')
+        return True
+
+    @import_rows.error
+    async def import_error(self, ctx, error):
+        if isinstance(error, commands.BadArgument):
+            await ctx.send(f'Invalid arguments \n Usage: `{ctx.bot.command_prefix}import <{"|".join(EXPORT_TABLES)}>` with a jsonl or csv file attached')
+        else:
+            raise error
+
+    @commands.command(help='''Registers the slash commands with Discord. Run it
+    with `guild` to register them on this server only, which takes effect at once,
+    or with no argument to register them everywhere, which can take up to an hour.
+    Only needed after the commands change''', brief='Register slash commands', hidden=True)
+    async def sync(self, ctx, scope = 'global'):
+        if scope not in ('global', 'guild') or (scope == 'guild' and ctx.guild is None):
+            raise commands.BadArgument()
+        guild = ctx.guild if scope == 'guild' else None
+        try:
+            if guild is not None:
+                self.bot.tree.copy_global_to(guild=guild)
+            synced = await self.bot.tree.sync(guild=guild)
+        except discord.HTTPException as e:
+            logging.exception(f'Unable to sync slash commands - {e}')
+            await ctx.send('Unable to sync slash commands')
+            return False
+        await ctx.send(f'Synced {len(synced)} slash commands {"to this server" if guild is not None else "globally"}')
+        return True
+
+    @sync.error
+    async def sync_error(self, ctx, error):
+        if isinstance(error, commands.BadArgument):
+            await ctx.send(f'Invalid arguments \n Usage: `{ctx.bot.command_prefix}sync <global|guild>`')
+        else:
+            raise error
+
+
+    ####################################
+    #### Logic and Database Section ####
+    ####################################
+
+    async def export_file(self, table, path, format):
+        '''Streams a table into a file, returning the number of rows or None'''
+        try:
+            with open(path, 'w', newline='') as f:
+                return await export_table(self.bot.storage, table, f, format)
+        except Exception as e:
+            logging.exception(f'Unable to export {table} - {e}')
+            return None
+
+    async def import_file(self, table, path, format):
+        '''Streams a file into a table, returning the number of rows or None.
+        Every cached board and claim may now be out of date, so they are
+        dropped whether or not the import finished'''
+        try:
+            with open(path, newline='') as f:
+                return await import_table(self.bot.storage, table, f, format)
+        except Exception as e:
+            logging.exception(f'Unable to import {table} - {e}')
+            return None
+        finally:
+            self.bot.leaderboards.invalidate()
+            self.bot.ranks.invalidate()
+            self.bot.claims.invalidate()
+            self.bot.periods.invalidate()
+
+async def setup(bot):
+    await bot.add_cog(Admin_Commands(bot))
@@ -1,25 +1,45 @@
 from datetime import datetime
 import discord
 from discord.ext import commands
+from discord import app_commands
 import logging
-import aiomysql
 import asyncio
 import sys
 import re
+from views import LeaderboardView
+from logbuffer import LogBuffer
+from storage import ALL_TIME, EVENT_LOG, log_periods, is_month
+
+LOG_TYPE_CHOICES = [app_commands.Choice(name='pages', value='pages'),
+                    app_commands.Choice(name='time', value='time')]
 
 class Log_Commands(commands.Cog, name='Log Commands'):
     def __init__(self, bot):
         self.bot = bot
         self.log_types = ['pages', 'time']
+        self.log_buffer = None
+        if self.bot.LOG_FLUSH_INTERVAL > 0:
+            self.log_buffer = LogBuffer(bot, self.bot.LOG_FLUSH_INTERVAL, self.bot.LOG_BUFFER_SIZE)
+
+    async def cog_load(self):
+        if self.log_buffer is not None:
+            self.log_buffer.start()
+
+    async def cog_unload(self):
+        if self.log_buffer is not None:
+            await self.log_buffer.stop()
 
 
     ####################################
     ####      Commands Section      ####
     ####################################
 
-    @commands.command(help='''This command will allow you to log time or pages
+    @commands.hybrid_command(help='''This command will allow you to log time or pages
     drawn.''', brief='Log time or pages for this month')
+    @app_commands.choices(log_type=LOG_TYPE_CHOICES)
+    @app_commands.describe(amount='Pages, or minutes of time')
     async def log(self, ctx, log_type, amount: int):
+        await ctx.defer()
         log_type = log_type.lower()
         if log_type not in self.log_types:
             raise commands.errors.BadArgument('log')
@@ -27,7 +47,7 @@ class Log_Commands(commands.Cog, name='Log Commands'):
             if amount == 0:
                 raise commands.errors.BadArgument()
             else:
-                current_amount = await self.set_log(ctx.message.author.id, log_type, amount)
+                current_amount = await self.set_log(ctx.bot.guild_key(ctx.guild), ctx.message.author.id, log_type, amount)
                 if current_amount == False:
                     await ctx.send(f'Unable to update logs for user {ctx.message.author}')
                 else:
@@ -45,24 +65,28 @@ class Log_Commands(commands.Cog, name='Log Commands'):
         else:
             raise error
 
-    @commands.command(help='''This command will allow you to get a current or
-    historical leaderboard for logs.''', brief='Get a leaderboard output for logs')
-    async def logboard(self, ctx, log_type, month = None):
-        curr_month = datetime.now()
+    @commands.hybrid_command(help='''This command will allow you to get a current or
+    historical leaderboard for logs. The period can be a month (MM-YYYY), a
+    year (YYYY), a quarter (Q1-YYYY) or `all` for all time.''', brief='Get a leaderboard output for logs')
+    @app_commands.choices(log_type=LOG_TYPE_CHOICES)
+    @app_commands.describe(period='Month, quarter or year, or all time - this month if left out')
+    async def logboard(self, ctx, log_type, period = None):
+        await ctx.defer()
         if log_type not in self.log_types:
             raise commands.errors.BadArgument('log')
-        if month == None:
-            month = curr_month.strftime('%m-%Y')
-        elif not re.match('\d{2}-\d{4}', month):
+        period = self.parse_period(period)
+        if period is None:
             raise commands.errors.BadArgument('month_format')
-        logboard = await self.get_logboard(log_type, month)
-        if logboard:
-            embed = await ctx.bot.generate_leaderboard(f'{month} {log_type.capitalize()} Logboard', logboard, 0x00bfff, ctx.guild.icon_url, f'Log your time or pages using {ctx.bot.command_prefix}log!')
-            await ctx.send(embed=embed)
-        else:
-            await ctx.send(f'Unable to fetch {month} {log_type} logboard')
+        label = self.describe_period(period)
+        logboard = LeaderboardView(ctx.bot, (ctx.bot.guild_key(ctx.guild), 'log', log_type, period), f'{label} {log_type.capitalize()} Logboard', 0x00bfff, ctx.guild.icon, f'Log your time or pages using {ctx.bot.command_prefix}log!')
+        if not await logboard.send(ctx):
+            await ctx.send(f'Unable to fetch {label} {log_type} logboard')
             return False
 
+    @logboard.autocomplete('period')
+    async def logboard_period_autocomplete(self, interaction, current):
+        return await self.period_choices(interaction, current)
+
     @logboard.error
     async def logboard_error(self, ctx, error):
         if isinstance(error, commands.errors.MissingRequiredArgument):
@@ -71,24 +95,28 @@ class Log_Commands(commands.Cog, name='Log Commands'):
             if str(error) == 'log':
                 await ctx.send(f'Invalid log type, valid log types are `pages` and `time`. See `{ctx.bot.command_prefix}help logboard` for more info.')
             elif str(error) == 'month_format':
-                await ctx.send(f'Invalid date format, valid format is MM-YYYY. See `{ctx.bot.command_prefix}help logboard` for more info.')
+                await ctx.send(f'Invalid period, valid formats are MM-YYYY, YYYY, Q1-YYYY and all. See `{ctx.bot.command_prefix}help logboard` for more info.')
         else:
             raise error
 
-    @commands.command(help='''This command will allow you to get a current or
-    historical log for a user.''', brief='Get user logs')
-    async def logbook(self, ctx, log_type, user: discord.Member, month = None):
-        curr_month = datetime.now()
+    @commands.hybrid_command(help='''This command will allow you to get a current or
+    historical log for a user. The period can be a month (MM-YYYY), a year
+    (YYYY), a quarter (Q1-YYYY) or `all` for all time.''', brief='Get user logs')
+    @app_commands.choices(log_type=LOG_TYPE_CHOICES)
+    @app_commands.describe(user='Member whose logs to show',
+                           period='Month, quarter or year, or all time - this month if left out')
+    async def logbook(self, ctx, log_type, user: discord.Member, period = None):
+        await ctx.defer()
         if log_type not in self.log_types:
             raise commands.errors.BadArgument('log')
-        if month == None:
-            month = curr_month.strftime('%m-%Y')
-        elif not re.match('\d{2}-\d{4}', month):
+        period = self.parse_period(period)
+        if period is None:
             raise commands.errors.BadArgument('month_format')
+        label = self.describe_period(period)
 
-        user_log = await self.get_user_logs(user.id, month, log_type)
+        user_log = await self.get_user_logs(ctx.bot.guild_key(ctx.guild), user.id, period, log_type)
         if user_log is False:
-            await ctx.send(f'Unable to retrieve {log_type} stats for {user} for {month}')
+            await ctx.send(f'Unable to retrieve {log_type} stats for {user} for {label}')
             return False
         if log_type == 'time':
             if user_log > 60:
@@ -96,10 +124,14 @@ class Log_Commands(commands.Cog, name='Log Commands'):
                 user_log = f'{hours} hours, {mins} minutes'
             else:
                 user_log = f'{user_log} minutes'
-        if curr_month.strftime('%m-%Y') == month:
+        if period == datetime.now().strftime('%Y-%m'):
             await ctx.send(f'Current month {log_type} logging stats for {user}: {user_log}')
         else:
-            await ctx.send(f'{month} {log_type} logging stats for {user}: {user_log}')
+            await ctx.send(f'{label} {log_type} logging stats for {user}: {user_log}')
+
+    @logbook.autocomplete('period')
+    async def logbook_period_autocomplete(self, interaction, current):
+        return await self.period_choices(interaction, current)
 
     @logbook.error
     async def logbook_error(self, ctx, error):
@@ -109,7 +141,7 @@ class Log_Commands(commands.Cog, name='Log Commands'):
             if str(error) == 'log':
                 await ctx.send(f'Invalid log type, valid log types are `pages` and `time`. See `{ctx.bot.command_prefix}help logbook` for more info.')
             elif str(error) == 'month_format':
-                await ctx.send(f'Invalid date format, valid format is MM-YYYY. See `{ctx.bot.command_prefix}help logbook` for more info.')
+                await ctx.send(f'Invalid period, valid formats are MM-YYYY, YYYY, Q1-YYYY and all. See `{ctx.bot.command_prefix}help logbook` for more info.')
         else:
             raise error
 
@@ -118,66 +150,101 @@ class Log_Commands(commands.Cog, name='Log Commands'):
     #### Logic and Database Section ####
     ####################################
 
-    async def get_logboard(self, log_type, month):
-        '''Get the specified month logboard.'''
+    def parse_period(self, period):
+        '''Turns a period argument into a storage period - 'YYYY-MM' for a
+        month, 'YYYY' for a year, 'YYYY-Qn' for a quarter or 'all'. No
+        argument means the current month, and None is returned if the
+        argument is not a valid period'''
+        if period is None:
+            return datetime.now().strftime('%Y-%m')
+        period = period.lower()
+        if period in ('all', 'alltime'):
+            return ALL_TIME
+        if match := re.fullmatch(r'(\d{2})-(\d{4})', period):
+            month, year = match.groups()
+            return f'{year}-{month}' if 1 <= int(month) <= 12 else None
+        if re.fullmatch(r'\d{4}', period):
+            return period
+        if match := re.fullmatch(r'q([1-4])-(\d{4})|(\d{4})-q([1-4])', period):
+            quarter, year = match.group(1) or match.group(4), match.group(2) or match.group(3)
+            return f'{year}-Q{quarter}'
+        return None
+
+    async def period_choices(self, interaction, current):
+        '''Offers every month with logs in the guild, the quarters and years
+        they fall in and all time, newest first, from the period index rather
+        than the database'''
+        periods = await self.bot.get_periods(self.bot.guild_key(interaction.guild))
+        months = set(periods.months) if periods is not None else set()
+        months.add(datetime.now().strftime('%Y-%m'))
+        choices = []
+        for year in sorted({month[:4] for month in months}, reverse=True):
+            year_months = sorted((month for month in months if month[:4] == year), reverse=True)
+            choices.extend(self.describe_period(month) for month in year_months)
+            choices.extend(f'Q{quarter}-{year}' for quarter in
+                           sorted({log_periods(month)[1][-1] for month in year_months}, reverse=True))
+            choices.append(year)
+        choices.append(ALL_TIME)
+        current = current.lower()
+        return [app_commands.Choice(name=choice, value=choice) for choice in choices if current in choice.lower()][:25]
+
+    def describe_period(self, period):
+        if period == ALL_TIME:
+            return 'All Time'
+        if is_month(period):
+            year, month = period.split('-')
+            return f'{month}-{year}'
+        if '-Q' in period:
+            year, quarter = period.split('-')
+            return f'{quarter} {year}'
+        return period
+
+    async def set_log(self, guild_id, user_id, type, amount):
+        '''Adds to the user's log for this month and returns the new total.
+        With write-behind enabled the increment is buffered and written in the
+        next batch, otherwise it is upserted and read back straight away.
+        The cached boards for the month and each period it rolls up into are
+        updated with the new totals.'''
+        now = datetime.now()
+        curr_month = now.strftime('%Y-%m')
         try:
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    query = f'''SELECT user_id, {log_type} from logs
-                            WHERE month = %s ORDER BY {log_type} DESC'''
-                    await cur.execute(query, (month,))
-                    results = await cur.fetchall()
-                    result_dict = {}
-                    for result in results:
-                        hours, mins = divmod(result[1], 60)
-                        if hours > 0:
-                            result_dict[result[0]] = f'{hours} hours, {mins} minutes'
-                        else:
-                            result_dict[result[0]] = f'{result[1]} minutes'
-                    return results
-        except Exception as e:
-            logging.exception(f'Unable to get logboard - {e}')
-            return False
-
-    async def set_log(self, user_id, type, amount):
-        curr_datetime = datetime.now()
-        curr_month = curr_datetime.strftime('%m-%Y')
-        query = f'''INSERT INTO logs (user_id, month, {type})
-                VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE {type} = {type} + %s'''
-        try:
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute(query, (user_id, curr_month, amount, amount,))
-                    await conn.commit()
-                    current_logs = await self.get_user_logs(user_id, curr_month, type)
-                    if type == 'time' and current_logs:
-                        hours, mins = divmod(current_logs, 60)
-                        if hours > 0:
-                            return f'{hours} hours, {mins} minutes'
-                        else:
-                            return f'{current_logs} minutes'
-                    elif current_logs:
-                        return f'{current_logs} pages'
-                    else:
-                        raise Exception('No logs retrievable for users')
+            if self.log_buffer is not None:
+                self.log_buffer.add(guild_id, user_id, curr_month, type, amount)
+                totals = await self.log_buffer.totals(guild_id, user_id, curr_month, type)
+            else:
+                totals = await self.bot.storage.add_log(guild_id, user_id, curr_month, type, amount)
+            self.bot.periods.add_month(guild_id, curr_month)
+            if self.bot.events is not None:
+                self.bot.events.add(guild_id, user_id, now, EVENT_LOG[type], amount)
+            for period, total in totals.items():
+                self.bot.leaderboards.update((guild_id, 'log', type, period), user_id, total)
+            current_logs = totals.get(curr_month)
+            if type == 'time' and current_logs:
+                hours, mins = divmod(current_logs, 60)
+                if hours > 0:
+                    return f'{hours} hours, {mins} minutes'
+                else:
+                    return f'{current_logs} minutes'
+            elif current_logs:
+                return f'{current_logs} pages'
+            else:
+                raise Exception('No logs retrievable for users')
         except Exception as e:
             logging.exception(f'Could not update page logs - {e}')
             return False
 
-    async def get_user_logs(self, user_id, month, type):
-        query = f'SELECT {type} from logs WHERE user_id = %s and month = %s'
+    async def get_user_logs(self, guild_id, user_id, period, type):
+        '''Gets the user's stored log total for a period plus anything still
+        waiting in the write-behind buffer'''
         try:
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    await conn.commit()
-                    await cur.execute(query, (user_id, month,))
-                    results = await cur.fetchone()
-                    if results is None:
-                        return False
-                    else:
-                        return results[0]
+            if self.log_buffer is not None:
+                results = await self.log_buffer.total(guild_id, user_id, period, type)
+            else:
+                results = await self.bot.storage.get_user_log(guild_id, user_id, period, type)
+            return results if results is not None else False
         except Exception as e:
             logging.exception(f'Could not get page logs for user {user_id} - {e}')
+            return False
 
 async def setup(bot):
     await bot.add_cog(Log_Commands(bot))
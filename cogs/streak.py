@@ -1,71 +1,96 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import discord
 from discord.ext import commands
+from discord import app_commands
 import logging
-import aiomysql
 import asyncio
 import sys
+import typing
+from views import LeaderboardView
+from reminders import ReminderScheduler
+from storage import EVENT_CLAIM
 
 logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s',
                     stream=sys.stderr, level=logging.INFO)
 
+# Boards the rank index covers, by the name used with the rank command
+RANK_BOARDS = {'overall': ('overall',), 'current': ('current',), 'pb': ('pb', 0)}
+
 
 class Streak_Commands(commands.Cog, name='Streak Commands'):
     def __init__(self, bot):
         self.bot = bot
-        self.reminders = {}
+        self.reminders = ReminderScheduler(bot)
+        self.rollover_year = None
+        self.rollover_job = None
+        self.rollover_task = None
+        self.sweep_task = None
+        self.rank_task = None
+
+    async def cog_load(self):
+        await self.bot.storage_ready.wait()
+        await self.reminders.start()
+        self.rollover_task = asyncio.create_task(self.rollover_scheduler())
+        if self.bot.SWEEP_INTERVAL > 0:
+            self.sweep_task = asyncio.create_task(self.sweep_scheduler())
+        if not self.bot.PER_GUILD:
+            # Per guild boards are loaded on their first rank lookup instead
+            self.rank_task = asyncio.create_task(self.load_ranks(0))
+
+    async def cog_unload(self):
+        self.reminders.stop()
+        for task in (self.rollover_task, self.sweep_task, self.rank_task):
+            if task is not None:
+                task.cancel()
 
     ####################################
     ####      Commands Section      ####
     ####################################
-    @commands.command(help='''Running this command will allow you to add to your
+    @commands.hybrid_command(help='''Running this command will allow you to add to your
     daily streak for drawing each day. This command is on a 23 hour cooldown so
     if your times start to creep, you can slowly bring them back. 48 hours without
     adding to your daily will reset your streak back to 0 (or 1 upon claim)''',
     brief='Add to your drawing streak')
     # Will throw CommandOnCooldown error if on CD
     async def daily(self, ctx):
-        print(ctx.bot.command_prefix)
-        user_exists = await self.check_user_exists(ctx.message.author.id, ctx.message.author)
-        if user_exists:
-            streak_success = await self.set_streak(ctx.message.author.id)
-            if streak_success['status'] == 'success':
-                await ctx.send(f"Daily updated for {ctx.message.author} - your current streak is {streak_success['streak']}")
-            elif streak_success['status'] == 'timeout':
-                await ctx.send(f"More than 48 hours have passed, {ctx.message.author}\'s streak has been set to {streak_success['streak']}")
-            elif streak_success['status'] == 'on_cooldown':
-                raise commands.CommandOnCooldown(ctx.bot.CMD_COOLDOWN, streak_success['cooldown'])
-        else:
+        await ctx.defer()
+        streak_success = await self.set_streak(ctx.bot.guild_key(ctx.guild), ctx.message.author.id, ctx.message.author)
+        if streak_success is None:
             await ctx.send(f'Could not update daily for {ctx.message.author}')
+        elif streak_success['status'] == 'success':
+            await ctx.send(f"Daily updated for {ctx.message.author} - your current streak is {streak_success['streak']}")
+        elif streak_success['status'] == 'timeout':
+            await ctx.send(f"More than 48 hours have passed, {ctx.message.author}\'s streak has been set to {streak_success['streak']}")
+        elif streak_success['status'] == 'on_cooldown':
+            raise commands.CommandOnCooldown(ctx.bot.CMD_COOLDOWN, streak_success['cooldown'], commands.BucketType.user)
 
     @daily.error
     async def daily_error(self, ctx, error):
         if isinstance(error, commands.CommandOnCooldown):
             min, sec = divmod(error.retry_after, 60)
             hour, min = divmod(min, 60)
-            user_id = ctx.message.author.id
+            key = (ctx.bot.guild_key(ctx.guild), ctx.message.author.id)
             await ctx.send(f'Try again in {int(hour)} hours, {int(min)} minutes, and {int(sec)} seconds')
             if error.retry_after <= self.bot.REMINDER_THRESHOLD:
-                if user_id not in self.reminders:
-                    self.reminders[user_id] = error.retry_after
-                    await asyncio.sleep(error.retry_after)
-                    await ctx.send(f"Hey <@!{user_id}>, it\'s time to claim your daily")
-                    self.reminders.pop(user_id)
+                await self.reminders.add(key, ctx.channel.id, error.retry_after)
         else:
             raise error
 
-    @commands.command(help='''Displays the current leaderboard for daily streak. Streaks
-    are timed out when this command is run to ensure all information is up to date. This
+    @commands.hybrid_command(help='''Displays the current leaderboard for daily streak. Streaks
+    past the timeout are left off the board so all information is up to date. This
     command can take the `current` argument to return only this years' leaderboard''',
     brief='Displays current streak leaderboard')
+    @app_commands.rename(arg='board')
+    @app_commands.choices(arg=[app_commands.Choice(name='overall', value='overall'),
+                               app_commands.Choice(name='current', value='current')])
     async def leaderboard(self, ctx, arg = 'overall'):
-        if arg.lower() in ['current', 'overall']:
-            stats = await self.get_leaderboard(arg)
-        else:
+        await ctx.defer()
+        if arg.lower() not in ['current', 'overall']:
             raise commands.errors.BadArgument()
 
-        leaderboard = await ctx.bot.generate_leaderboard(f'{arg.capitalize()} Streak Leaderboard', stats, 0x00bfff, ctx.guild.icon_url, f'Increase your streak by drawing each day and using {ctx.bot.command_prefix}daily!')
-        await ctx.send(embed=leaderboard)
+        leaderboard = LeaderboardView(ctx.bot, (ctx.bot.guild_key(ctx.guild), arg.lower()), f'{arg.capitalize()} Streak Leaderboard', 0x00bfff, ctx.guild.icon, f'Increase your streak by drawing each day and using {ctx.bot.command_prefix}daily!')
+        if not await leaderboard.send(ctx):
+            await ctx.send(f'No valid {arg.lower()} leaderboard yet')
 
     @leaderboard.error
     async def leaderboard_error(self, ctx, error):
@@ -74,34 +99,44 @@ class Streak_Commands(commands.Cog, name='Streak Commands'):
         else:
             raise error
 
-    @commands.command(help=f'''Displays the personal best leaderboard for daily streak.
+    @commands.hybrid_command(help=f'''Displays the personal best leaderboard for daily streak.
     This leaderboard shows the best unbroken streaks of all time when run with the pb command.
     To look up other years, add the <year> argument.
     You can check the personal best of an individual user using both the <year> and <user> arguments''',
     brief='Displays personal best leaderboard')
+    @app_commands.describe(year='Year to look up, or all time', user='Member whose personal best to show')
     async def pb(self, ctx, year: int = 0, user: discord.Member = None):
+        await ctx.defer()
         current_year = datetime.now().year
         if year > current_year:
             await ctx.send(f'Year is in the future, please enter a valid year')
             return False
         if user is None:
-            personal_best = await self.get_pb_leaderboard(year)
-            if personal_best:
-                pb_leaderboard = await ctx.bot.generate_leaderboard(f'{year if year > 0 else "All Time"} Personal Best Leaderboard', personal_best, 0x00bfff, ctx.guild.icon_url, f'Set new records by drawing each day and using {ctx.bot.command_prefix}daily!')
-                await ctx.send(embed=pb_leaderboard)
+            pb_leaderboard = LeaderboardView(ctx.bot, (ctx.bot.guild_key(ctx.guild), 'pb', year), f'{year if year > 0 else "All Time"} Personal Best Leaderboard', 0x00bfff, ctx.guild.icon, f'Set new records by drawing each day and using {ctx.bot.command_prefix}daily!')
+            if await pb_leaderboard.send(ctx):
                 return True
             else:
                 await ctx.send(f'No valid leaderboard for {year}')
                 return False
         else:
-            personal_best = await self.get_user_pb(user.id, year)
+            personal_best = await self.get_user_pb(ctx.bot.guild_key(ctx.guild), user.id, year)
             if personal_best is not None:
-                personal_best = personal_best[0]
                 await ctx.send(f'Personal best of {year if year > 0 else "all time"} for {user} {"was" if year < current_year else "is"} {personal_best}')
                 return True
             else:
                 raise commands.BadArgument
 
+    @pb.autocomplete('year')
+    async def pb_year_autocomplete(self, interaction, current):
+        '''Offers all time, this year and every archived year, from the
+        period index rather than the database'''
+        periods = await self.bot.get_periods(self.bot.guild_key(interaction.guild))
+        years = {datetime.now().year} | (periods.years if periods is not None else set())
+        choices = [app_commands.Choice(name='All time', value=0)]
+        choices.extend(app_commands.Choice(name=str(year), value=year) for year in sorted(years, reverse=True))
+        current = str(current).lower()
+        return [choice for choice in choices if current in choice.name.lower()][:25]
+
     @pb.error
     async def pb_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
@@ -109,247 +144,195 @@ class Streak_Commands(commands.Cog, name='Streak Commands'):
         else:
             raise error
 
+    @commands.command(help='''Shows your position on a streak leaderboard along with
+    the users either side of you. Add a <user> to look someone else up, and `current`
+    or `pb` to use the current year or all time personal best leaderboard instead of
+    the overall one''', brief='Shows your leaderboard position')
+    async def rank(self, ctx, user: typing.Optional[discord.Member] = None, board = 'overall'):
+        board = board.lower()
+        if board not in RANK_BOARDS:
+            raise commands.errors.BadArgument()
+        user = ctx.message.author if user is None else user
+
+        ranks = await self.get_rank(ctx.bot.guild_key(ctx.guild), board, user.id)
+        if ranks is None:
+            await ctx.send(f'Unable to fetch the {board} leaderboard')
+            return False
+        position, neighbours, total = ranks
+        if position is None:
+            await ctx.send(f'{user} is not on the {board} leaderboard')
+            return False
+
+        names = ctx.bot.resolve_names(ctx.bot.guild_key(ctx.guild), (user_id for _, user_id, _ in neighbours))
+        rank_text = ''
+        for place, user_id, value in neighbours:
+            username = names.get(user_id, user_id)
+            line = f'**{place}.** {username}  -  {value}'
+            rank_text += f'__{line}__\n' if user_id == user.id else f'{line}\n'
+        title = 'All Time Personal Best' if board == 'pb' else f'{board.capitalize()} Streak'
+        embed = discord.Embed(color=0x00bfff)
+        embed.set_thumbnail(url=ctx.guild.icon)
+        embed.add_field(name=f'{title} Rank for {user}', value=rank_text, inline=True)
+        embed.set_footer(text=f'{position} of {total}')
+        await ctx.send(embed=embed)
+        return True
+
+    @rank.error
+    async def rank_error(self, ctx, error):
+        if isinstance(error, commands.BadArgument):
+            await ctx.send(f'Invalid arguments \n Usage: `{ctx.bot.command_prefix}rank <user> <overall|current|pb>`')
+        else:
+            raise error
+
 
     ####################################
     #### Logic and Database Section ####
     ####################################
 
-    async def set_streak(self, user_id):
-        '''Update the streak of the calling user. Checks the database for the
-        last claimed date and compares against current time and the cooldown.
-        Also checks if the new year has begun and calls to the rollover logic'''
+    async def set_streak(self, guild_id, user_id, fulluser):
+        '''Claim the daily for the calling user in a single transaction. The
+        user's row is locked and read once, the user is created if they have
+        never claimed before, and the cooldown and timeout checks are made
+        against that row before writing the new counters back. Users the claim
+        cache already knows are on cooldown are answered from memory.'''
         curr_time = datetime.now()
+        response = self.bot.claims.cooldown((guild_id, user_id), curr_time, self.bot.CMD_COOLDOWN)
+        if response is not None:
+            return response
+        if not await self.ensure_rollover():
+            logging.error('Refusing to update streak until year rollover completes')
+            return None
         try:
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    response = {}
-                    query = 'SELECT daily_claimed FROM users WHERE user_id = %s'
-                    await cur.execute(query, (user_id,))
-                    results = await cur.fetchone()
-                    last_claimed = results[0]
-                    if last_claimed is not None:
-                        cd_remaining = curr_time - last_claimed
-                        cd_remaining = cd_remaining.total_seconds()
-                        if cd_remaining < self.bot.CMD_COOLDOWN:
-                            cd_delta = self.bot.CMD_COOLDOWN - cd_remaining
-                            response['cooldown'] = cd_delta
-                            response['status'] = 'on_cooldown'
-                            return response
-                        # Reset if cooldown exceeds timeout
-                        elif cd_remaining >= self.bot.STREAK_TIMEOUT:
-                            query = '''UPDATE users SET daily_claimed = %s, streak = 1
-                                    WHERE user_id = %s'''
-                            await cur.execute(query, (curr_time, user_id,))
-                            await conn.commit()
-                            response['status'] = 'timeout'
-                            response['streak'] = 1
-                            return response
-                    # Update the current year and personal best counters
-                    query = '''UPDATE users SET daily_claimed = %s,
-                            streak = streak + 1, personal_best = CASE WHEN
-                            streak + 1 > personal_best THEN streak
-                            ELSE personal_best END,
-                            current_year_streak = current_year_streak + 1,
-                            current_year_best = CASE WHEN
-                            current_year_streak + 1 > current_year_best THEN current_year_streak
-                            ELSE current_year_best END
-                            WHERE user_id = %s'''
-
-                    # Check for new year and rollover
-                    is_new_year = await self.compare_db_year()
-                    if is_new_year:
-                        await self.rollover_streaks(is_new_year)
-                        await cur.execute(query, (curr_time, user_id,))
-                        await conn.commit()
-                    else:
-                        # Ensure the history table is correctly updated for year
-                        await cur.execute(query, (curr_time, user_id,))
-                        await conn.commit()
-                        await self.rollover_streaks(is_new_year)
-                    response['status'] = 'success'
-
-                    # Grab streak length to return
-                    response['streak'] = await self.get_streak(user_id)
-                    return response
+            response = await self.bot.storage.claim_daily(guild_id, user_id, fulluser.name,
+                                                          int(fulluser.discriminator), curr_time,
+                                                          self.bot.CMD_COOLDOWN, self.bot.STREAK_TIMEOUT)
+            if response['status'] == 'on_cooldown':
+                if 'daily_claimed' in response:
+                    self.bot.claims.set((guild_id, user_id), response['daily_claimed'], response['streak'])
+            else:
+                self.bot.claims.set((guild_id, user_id), curr_time, response['streak'])
+                if self.bot.events is not None:
+                    self.bot.events.add(guild_id, user_id, curr_time, EVENT_CLAIM)
+                if response.get('created'):
+                    logging.info(f'User {fulluser} created')
+                self.update_leaderboards(guild_id, user_id, response, curr_time)
+                await self.reminders.discard((guild_id, user_id))
+            return response
         except Exception as e:
             logging.exception(f'Could not update streak - {e}')
             return None
 
-    async def compare_db_year(self):
-        '''Checks if the current year is greater than DB year'''
-        current_year = datetime.now().year
-        try:
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    query = '''SELECT MAX(daily_claimed) FROM users'''
-                    await cur.execute(query)
-                    results = await cur.fetchone()
-                    results = results[0]
-                    if results is not None:
-                        db_year: datetime = results.year
-                        if current_year > db_year:
-                            return True
-                        else:
-                            return False
-        except Exception as e:
-            logging.exception(f'Database error {e}')
-            return None
+    def update_leaderboards(self, guild_id, user_id, response, curr_time):
+        '''Applies a committed claim to the guild's cached leaderboards'''
+        leaderboards = self.bot.leaderboards
+        expires = (curr_time + timedelta(seconds=self.bot.STREAK_TIMEOUT)).timestamp()
+        leaderboards.update((guild_id, 'overall'), user_id, response['streak'], expires)
+        leaderboards.update((guild_id, 'current'), user_id, response['current_year_streak'])
+        leaderboards.update((guild_id, 'pb', 0), user_id, response['personal_best'])
+        leaderboards.update((guild_id, 'pb', curr_time.year), user_id, response['current_year_best'])
+        ranks = self.bot.ranks
+        ranks.update((guild_id, 'overall'), user_id, response['streak'], expires)
+        ranks.update((guild_id, 'current'), user_id, response['current_year_streak'])
+        ranks.update((guild_id, 'pb', 0), user_id, response['personal_best'])
 
-    async def rollover_streaks(self, is_new_year):
-        '''Updates history table and rolls over if a new year has begun'''
-        try:
-            currdate = datetime.now()
-            curr_year = currdate.year
-
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    if is_new_year:
-                        db_year = curr_year - 1
-                    else:
-                        db_year = curr_year
-
-                    query = f'''INSERT INTO streak_history (user_id, past_pb, year)
-                            SELECT user_id, current_year_best, {db_year} FROM users
-                            ON DUPLICATE KEY UPDATE streak_history.past_pb =
-                            users.current_year_best'''
-                    await cur.execute(query)
-                    await conn.commit()
-
-                    if is_new_year:
-                        query = '''UPDATE users SET current_year_best = 0, current_year_streak = 0'''
-                        await cur.execute(query)
-                        await conn.commit()
-                    return True
-        except Exception as e:
-            logging.exception(f'Unable to rollover streaks - {e}')
-            return False
+    async def ensure_rollover(self):
+        '''Makes sure the year rollover has completed before any claims are
+        made in a new year. Cheap once the current year has been rolled over,
+        otherwise waits on the running rollover or starts it if it was missed'''
+        year = datetime.now().year
+        if self.rollover_year is not None and self.rollover_year >= year:
+            return True
+        if self.rollover_job is None or self.rollover_job.done():
+            self.rollover_job = asyncio.create_task(self.rollover_streaks(year))
+        return await asyncio.shield(self.rollover_job)
 
-    async def get_streak(self, user_id):
-        '''Gets the current streak of the calling user'''
-        try:
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    query = 'SELECT streak FROM users WHERE user_id = %s'
-                    await cur.execute(query, (user_id,))
-                    streak = await cur.fetchone()
-                    return streak[0]
-        except Exception as e:
-            logging.exception(f'Unable to get streak - {e}')
-            return False
+    async def rollover_scheduler(self):
+        '''Background task that runs the year rollover on startup if the last
+        boundary was missed, then sleeps until each new year begins'''
+        while True:
+            if not await self.ensure_rollover():
+                await asyncio.sleep(60)
+                continue
+            now = datetime.now()
+            next_year = datetime(now.year + 1, 1, 1)
+            await asyncio.sleep((next_year - now).total_seconds())
 
-    async def check_user_exists(self, user_id, fulluser):
-        '''Checks if user exists within the database and calls to create_user()
-        if user does not'''
+    async def rollover_streaks(self, year):
+        '''Archives the current year counters of every user who has not
+        claimed since the start of the given year into streak_history and
+        resets them. Users are processed in bounded primary key ranges, each in
+        its own short transaction, and the job is safe to run again after a
+        partial run as archived bests are never lowered'''
+        storage = self.bot.storage
         try:
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    query = 'SELECT * FROM users WHERE user_id = %s'
-                    await cur.execute(query, (user_id,))
-                    results = await cur.fetchall()
-                    if len(results) == 0:
-                        user_created = await self.create_user(user_id, fulluser)
-                        if user_created:
-                            return True
-                        else:
-                            return False
-                    else:
-                        return True
-        except Exception as e:
-            logging.exception(f'Could not check users table - {e}')
+            if await storage.rollover_done(year):
+                self.rollover_year = year
+                return True
 
-    async def create_user(self, user_id, fulluser):
-        '''Creates user the first time they try to run the daily command'''
-        try:
-            fulluser = str(fulluser)
-            username = fulluser.split('#')[0]
-            discriminator = fulluser.split('#')[1]
-
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    query = '''INSERT INTO users (user_id, username, discriminator,
-                            streak, personal_best) VALUES (%s, %s, %s, %s, %s)'''
-                    await cur.execute(query, (user_id, username, discriminator, 0, 0,))
-                    if cur.rowcount > 0:
-                        await conn.commit()
-                        logging.info(f'User {fulluser} created')
-                        return True
-                    else:
-                        raise Exception('No rows to be written')
+            logging.info(f'Rolling over streaks for {year}')
+            last_id = 0
+            while last_id is not None:
+                last_id = await storage.rollover_batch(year, last_id, self.bot.ROLLOVER_BATCH)
+
+            await storage.mark_rollover(year, datetime.now())
+            self.rollover_year = year
+            self.bot.leaderboards.invalidate()
+            self.bot.ranks.invalidate()
+            self.bot.periods.invalidate()
+            logging.info(f'Rollover for {year} complete')
+            return True
         except Exception as e:
-            logging.exception(f'Could not create user - {e}')
+            logging.exception(f'Unable to rollover streaks - {e}')
             return False
 
+    async def sweep_scheduler(self):
+        '''Optional background task that physically zeroes timed out streaks
+        every SWEEP_INTERVAL seconds. Reads never depend on it as the effective
+        streak is worked out from daily_claimed at query time'''
+        while True:
+            await asyncio.sleep(self.bot.SWEEP_INTERVAL)
+            await self.timeout_streaks()
+
     async def timeout_streaks(self):
-        '''Times out any users that are outside configurable STREAK_TIMEOUT,
-        ensuring that leaderboards are always up to date.'''
+        '''Zeroes the stored streak of any users that are outside configurable
+        STREAK_TIMEOUT, in bounded batches so that row locks are only held
+        briefly.'''
+        cutoff = datetime.now() - timedelta(seconds=self.bot.STREAK_TIMEOUT)
         try:
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    query = '''UPDATE users SET streak = 0 WHERE
-                            daily_claimed < NOW() - INTERVAL %s SECOND;'''
-                    await cur.execute(query, (self.bot.STREAK_TIMEOUT,))
-                    return True
+            while await self.bot.storage.timeout_streaks(cutoff, self.bot.ROLLOVER_BATCH) >= self.bot.ROLLOVER_BATCH:
+                pass
+            return True
         except Exception as e:
             logging.exception(f'Could not timeout streaks - {e}')
             return False
 
-    async def get_user_pb(self, user_id, year):
-        '''Get the user's personal best with optional year parameter'''
+    async def get_user_pb(self, guild_id, user_id, year):
+        '''Get the user's personal best with optional year parameter. The
+        current year is read from the users table as history is only written
+        once a year has ended'''
         try:
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    if year == 0:
-                        query = 'SELECT personal_best FROM users WHERE user_id = %s'
-                        await cur.execute(query, (user_id,))
-                    else:
-                        query = 'SELECT past_pb FROM streak_history WHERE user_id = %s AND year = %s'
-                        await cur.execute(query, (user_id, year,))
-            results = await cur.fetchone()
-            return results
+            return await self.bot.storage.get_user_pb(guild_id, user_id, year)
         except Exception as e:
             logging.exception(f'Unable to get personal best - {e}')
-            return False
+            return None
 
-    async def get_pb_leaderboard(self, year):
-        '''Get the personal best leaderboard with optional year parameter'''
-        try:
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    if year == 0:
-                        query = '''SELECT user_id, personal_best FROM users ORDER BY
-                                personal_best DESC'''
-                        await cur.execute(query)
-                    else:
-                        query = '''SELECT user_id, past_pb FROM streak_history WHERE
-                                year = %s ORDER BY past_pb DESC'''
-                        await cur.execute(query, (year,))
-                    results = await cur.fetchall()
-                    return results
-        except Exception as e:
-            logging.exception(f'Unable to get personal best - {e}')
-            return False
+    async def load_ranks(self, guild_id):
+        '''Builds the rank index for each of a guild's rank boards'''
+        for board in RANK_BOARDS.values():
+            await self.bot.get_ranks((guild_id,) + board)
 
-    async def get_leaderboard(self, arg):
-        '''Get the current year or overall streak leaderboard. This is different
-        to the personal best leaderboards as it reflects the ongoing streak'''
-        try:
-            await self.timeout_streaks()
-            async with self.bot.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    if arg is 'overall':
-                        query = '''SELECT user_id, streak FROM users
-                                ORDER BY streak desc'''
-                    elif arg.lower() == 'current':
-                        query = '''SELECT user_id, current_year_streak FROM
-                                users ORDER BY current_year_streak desc'''
-                    else:
-                        return False
-                    await cur.execute(query)
-                    results = await cur.fetchall()
-                    return results
-        except Exception as e:
-            logging.exception(f'Unable to get streak - {e}')
-            return False
+    async def get_rank(self, guild_id, board, user_id):
+        '''Looks a user up in the rank index for a board. Returns their
+        position or None if they are not on it, the (position, user_id, value)
+        rows around them and the number of users on the board, or None if the
+        board could not be loaded'''
+        ranks = await self.bot.get_ranks((guild_id,) + RANK_BOARDS[board])
+        if ranks is None:
+            return None
+        rank = ranks.rank(user_id)
+        if rank is None:
+            return None, [], len(ranks)
+        return rank[0], ranks.around(rank[0], self.bot.RANK_NEIGHBOURS), len(ranks)
 
 async def setup(bot):
     await bot.add_cog(Streak_Commands(bot))
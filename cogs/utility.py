@@ -1,11 +1,33 @@
 import discord
 from discord.ext import commands
+import asyncio
+import io
+import logging
+import signal
 import time
+from datetime import datetime
 
 class Utility_Commands(commands.Cog, name='Utility Commands'):
     def __init__(self, bot):
         self.bot = bot
         self.bot.help_command.cog = self
+        self.signal_task = None
+
+    async def cog_load(self):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.profile_signal)
+        except (NotImplementedError, AttributeError, RuntimeError):
+            # No SIGUSR1 on Windows, and only the main thread can take signals
+            pass
+
+    async def cog_unload(self):
+        try:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+        except (NotImplementedError, AttributeError, RuntimeError):
+            pass
+        if self.signal_task is not None:
+            self.signal_task.cancel()
+
     @commands.command(help='Ping the bot to get the current latency',brief='Ping the bot')
     async def ping(self, ctx):
         #await ctx.send(f'Pong! Latency is {round(ctx.bot.latency*1000)}ms')
@@ -15,5 +37,49 @@ class Utility_Commands(commands.Cog, name='Utility Commands'):
         time_delta = round((t_2-t_1)*1000)  # calculate the time needed to trigger typing
         await ctx.send(f"Pong! Latency is {time_delta}ms")
 
+    @commands.command(help='''Samples what the bot is running for <seconds> and replies
+    with its hottest functions and a collapsed stack file for flamegraph.pl, inferno or
+    speedscope. Sending the process SIGUSR1 does the same, writing the file to the working
+    directory instead''', brief='Profile the running bot', hidden=True)
+    @commands.is_owner()
+    async def profile(self, ctx, seconds: int = 10):
+        if not 0 < seconds <= self.bot.PROFILE_MAX_SECONDS:
+            raise commands.BadArgument()
+        if self.bot.profiler.running:
+            await ctx.send('A profile is already running')
+            return False
+        await ctx.send(f'Profiling for {seconds} seconds')
+        result = await self.bot.profiler.run(seconds)
+        file = discord.File(io.BytesIO(result.collapsed().encode()),
+                            filename=f'profile-{datetime.now():%Y%m%d-%H%M%S}.txt')
+        await ctx.send(f'```\n{result.summary(self.bot.PROFILE_TOP)[:1900]}\n```', file=file)
+        return True
+
+    @profile.error
+    async def profile_error(self, ctx, error):
+        if isinstance(error, commands.BadArgument):
+            await ctx.send(f'Invalid arguments \n Usage: `{ctx.bot.command_prefix}profile <seconds>` up to {self.bot.PROFILE_MAX_SECONDS} seconds')
+        else:
+            raise error
+
+    def profile_signal(self):
+        if self.bot.profiler.running:
+            logging.warning('Ignoring SIGUSR1, a profile is already running')
+            return
+        self.signal_task = asyncio.create_task(self.profile_to_file(self.bot.PROFILE_SIGNAL_SECONDS))
+
+    async def profile_to_file(self, seconds):
+        '''Profiles for seconds and writes the collapsed stacks to the working
+        directory, logging the summary'''
+        logging.info(f'Profiling for {seconds} seconds')
+        try:
+            result = await self.bot.profiler.run(seconds)
+            path = f'profile-{datetime.now():%Y%m%d-%H%M%S}.txt'
+            with open(path, 'w') as f:
+                f.write(result.collapsed())
+            logging.info(f'Wrote profile to {path}\n{result.summary(self.bot.PROFILE_TOP)}')
+        except Exception as e:
+            logging.exception(f'Could not profile - {e}')
+
 async def setup(bot):
     await bot.add_cog(Utility_Commands(bot))
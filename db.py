@@ -1,60 +1,51 @@
 import logging
-import sys
 import aiomysql
 import asyncio
+from migrations import run_migrations
 
 class Database:
-    def __init__(self, host_name, user_name, user_password, db, pool_size):
+    '''Connection settings and pools for MySQL. Writes always use the primary
+    pool. With a replica host set, reads that can tolerate replication lag use
+    a separate replica pool, sized on its own, while the replica is healthy -
+    reachable and no more than max_lag seconds behind - and fall back to the
+    primary otherwise.'''
+    def __init__(self, host_name, user_name, user_password, db, pool_size,
+                 replica_host=None, replica_pool_size=None, max_lag=5, check_interval=10):
         self.conn_pool = None
         self.host_name = host_name
         self.user_name = user_name
         self.user_password = user_password
         self.db = db
         self.pool_size = pool_size
+        self.replica_host = replica_host
+        self.replica_pool_size = pool_size if replica_pool_size is None else replica_pool_size
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.replica_pool = None
+        self.replica_healthy = False
+        self.replica_task = None
 
     async def create_pool(self):
-        try:
-            self.conn_pool = await aiomysql.create_pool(host=self.host_name, user=self.user_name,
-                                                    password=self.user_password, db=self.db,
-                                                    maxsize=self.pool_size)
-            logging.info('Connection to MySQL DB successful')
-            return self.conn_pool
-        except Error as e:
-            logging.exception(f'Error while creating MySQL Connection Pool {e}')
-            sys.exit(1)
+        '''Creates the shared connection pool with every connection opened up
+        front, so the first commands after a restart don't pay for connecting.
+        Connections run in autocommit mode so that plain reads never leave a
+        transaction open, writes that need a transaction call begin() explicitly'''
+        self.conn_pool = await aiomysql.create_pool(host=self.host_name, user=self.user_name,
+                                                password=self.user_password, db=self.db,
+                                                minsize=self.pool_size, maxsize=self.pool_size,
+                                                autocommit=True)
+        logging.info(f'Connection to MySQL DB successful, {self.conn_pool.size} connections open')
+        return self.conn_pool
 
     async def bootstrap_db(self):
+        '''Creates the database if needed and brings the schema up to date on a
+        separate connection'''
+        db_conn = await aiomysql.connect(host=self.host_name, user=self.user_name,
+                                         password=self.user_password)
         try:
-            db_conn = await aiomysql.connect(host=self.host_name, user=self.user_name,
-                                                  password=self.user_password)
             cursor = await db_conn.cursor()
             create_db = 'CREATE DATABASE IF NOT EXISTS {db}'
             use_db = 'USE {db}'
-            create_user_table = '''CREATE TABLE IF NOT EXISTS `users` (
-                            	`user_id` VARCHAR(50) NOT NULL,
-                            	`username` VARCHAR(50) NOT NULL,
-                            	`discriminator` INT NOT NULL,
-                            	`daily_claimed` DATETIME,
-                            	`streak` INT DEFAULT 0,
-                            	`personal_best` INT DEFAULT 0,
-                                `current_year_best` INT DEFAULT 0,
-                                `current_year_streak` INT DEFAULT 0,
-                            	PRIMARY KEY (`user_id`)
-                            );'''
-            create_logs_table = '''CREATE TABLE IF NOT EXISTS `logs` (
-                              `user_id` varchar(50) NOT NULL,
-                              `month` varchar(8) NOT NULL,
-                              `time` int(11) DEFAULT 0,
-                              `pages` int(11) DEFAULT 0,
-                              CONSTRAINT PRIMARY KEY (user_id,month)
-                            );'''
-            create_streak_history = '''CREATE TABLE IF NOT EXISTS `streak_history`
-                                    (
-                                    `user_id` VARCHAR(50) NOT NULL,
-                                    `year` YEAR NOT NULL,
-                                    `past_pb` INT NOT NULL,
-                                    CONSTRAINT PRIMARY KEY (user_id,year)
-                                    )'''
 
             # Create database
             await cursor.execute(create_db.format(db=self.db))
@@ -62,13 +53,80 @@ class Database:
             # Move cursor to database
             await cursor.execute(use_db.format(db=self.db))
 
-            # Create the tables
-            await cursor.execute(create_user_table)
-            await cursor.execute(create_logs_table)
-            await cursor.execute(create_streak_history)
+            # Create or upgrade the tables
+            version = await run_migrations(db_conn)
+            logging.info(f'Database schema is at version {version}')
             return True
-        except:
-            logging.exception('Could not bootstrap database')
-            sys.exit(1)
         finally:
             db_conn.close()
+
+    async def create_replica_pool(self):
+        '''Opens the read replica pool if one is configured and starts
+        checking its health in the background. The bot carries on against the
+        primary alone while the replica is unreachable'''
+        if not self.replica_host:
+            return None
+        await self.check_replica()
+        self.replica_task = asyncio.create_task(self.monitor_replica())
+        return self.replica_pool
+
+    async def connect_replica(self):
+        self.replica_pool = await aiomysql.create_pool(host=self.replica_host, user=self.user_name,
+                                                       password=self.user_password, db=self.db,
+                                                       minsize=self.replica_pool_size,
+                                                       maxsize=self.replica_pool_size, autocommit=True)
+        logging.info(f'Connection to MySQL replica successful, {self.replica_pool.size} connections open')
+
+    async def check_replica(self):
+        '''Marks the replica healthy if it answers and its replication lag
+        is within max_lag. A replica that reports no replication status at
+        all, such as a managed reader endpoint, is trusted as long as it
+        answers. The database user needs the REPLICATION CLIENT privilege'''
+        healthy = False
+        try:
+            if self.replica_pool is None:
+                await self.connect_replica()
+            async with self.replica_pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cur:
+                    try:
+                        await cur.execute('SHOW REPLICA STATUS')
+                    except aiomysql.ProgrammingError:
+                        # Servers before MySQL 8.0.22
+                        await cur.execute('SHOW SLAVE STATUS')
+                    status = await cur.fetchone()
+            if status is None:
+                healthy = True
+            else:
+                lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+                healthy = lag is not None and lag <= self.max_lag
+                if not healthy:
+                    logging.warning(f'MySQL replica is {lag} seconds behind, reading from the primary')
+        except Exception as e:
+            logging.warning(f'MySQL replica health check failed, reading from the primary - {e}')
+        if healthy and not self.replica_healthy:
+            logging.info('Reading from the MySQL replica')
+        self.replica_healthy = healthy
+        return healthy
+
+    async def monitor_replica(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check_replica()
+
+    def read_pool(self):
+        '''Returns the pool for reads that can tolerate replication lag'''
+        if self.replica_healthy and self.replica_pool is not None:
+            return self.replica_pool
+        return self.conn_pool
+
+    def replica_failed(self):
+        '''Stops reading from the replica until the next check passes'''
+        self.replica_healthy = False
+
+    async def close(self):
+        if self.replica_task is not None:
+            self.replica_task.cancel()
+        for pool in (self.conn_pool, self.replica_pool):
+            if pool is not None:
+                pool.close()
+                await pool.wait_closed()
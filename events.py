@@ -0,0 +1,56 @@
+import asyncio
+import logging
+
+
+class EventWriter:
+    '''Batched writer for the append-only events table. Claims and log
+    increments are queued in the order they happen and appended as a single
+    multi-row insert every interval seconds, or sooner once max_size events
+    are waiting. Anything still queued is written when the writer is stopped.'''
+    def __init__(self, bot, interval, max_size):
+        self.bot = bot
+        self.interval = interval
+        self.max_size = max_size
+        self.pending = []
+        self.full = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # Only cancel between flushes so an in-flight write is never lost
+        async with self.lock:
+            if self.task is not None:
+                self.task.cancel()
+        await self.flush()
+
+    def add(self, guild_id, user_id, at, kind, amount=0):
+        self.pending.append((guild_id, user_id, at, kind, amount))
+        if len(self.pending) >= self.max_size:
+            self.full.set()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        '''Appends everything queued so far in one statement. On failure the
+        events are put back ahead of any queued since, keeping their order'''
+        async with self.lock:
+            self.full.clear()
+            if not self.pending:
+                return True
+            rows, self.pending = self.pending, []
+            try:
+                await self.bot.storage.add_events(rows)
+                return True
+            except Exception as e:
+                logging.exception(f'Could not write {len(rows)} events - {e}')
+                self.pending = rows + self.pending
+                return False
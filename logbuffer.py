@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from functools import partial
+from storage import in_period, log_periods
+
+
+class LogBuffer:
+    '''Write-behind buffer for log increments. Increments are summed in memory
+    per (guild_id, user_id) and month and written as a single multi-row upsert
+    every interval seconds, or sooner once max_size users are waiting.
+    Anything still buffered is flushed when the buffer is stopped.'''
+    def __init__(self, bot, interval, max_size):
+        self.bot = bot
+        self.interval = interval
+        self.max_size = max_size
+        self.pending = {}
+        self.flushing = {}
+        # Flushes started, so a read can tell whether one overlapped it
+        self.flushes = 0
+        self.full = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # Only cancel between flushes so an in-flight write is never lost
+        async with self.lock:
+            if self.task is not None:
+                self.task.cancel()
+        await self.flush()
+
+    def add(self, guild_id, user_id, month, type, amount):
+        months = self.pending.setdefault((guild_id, user_id), {})
+        totals = months.setdefault(month, {'pages': 0, 'time': 0})
+        totals[type] += amount
+        if len(self.pending) >= self.max_size:
+            self.full.set()
+
+    def get(self, guild_id, user_id, period, type):
+        '''Returns the buffered amount not yet written for a user in a month or
+        rollup period, including any flush that is still in flight'''
+        amount = 0
+        for buffer in (self.pending, self.flushing):
+            for month, totals in buffer.get((guild_id, user_id), {}).items():
+                if in_period(month, period):
+                    amount += totals[type]
+        return amount
+
+    async def read(self, guild_id, user_id, read):
+        '''Awaits read, a read of the user's stored logs from the primary, and
+        returns a result that agrees with the buffer as it stands. The flush
+        lock is not held, so reads neither queue behind each other nor wait
+        for flushes of other users. Only when a flush holding the user's
+        increments overlaps the read is there no telling whether the read saw
+        them, and then it is repeated once that flush is over'''
+        key = (guild_id, user_id)
+        while True:
+            flushes = self.flushes
+            unclear = key in self.flushing
+            result = await read()
+            if not unclear and self.flushes == flushes:
+                return result
+            async with self.lock:
+                pass
+
+    async def totals(self, guild_id, user_id, month, type):
+        '''Returns a user's log totals for a month and its rollup periods the
+        way get_user_logs does, with the buffered amounts added, so an
+        increment is counted exactly once whether or not it has been written'''
+        totals = await self.read(guild_id, user_id, partial(self.bot.storage.get_user_logs, guild_id,
+                                                            user_id, month, type, primary=True))
+        for period in (month,) + log_periods(month):
+            totals[period] = totals.get(period, 0) + self.get(guild_id, user_id, period, type)
+        return totals
+
+    async def total(self, guild_id, user_id, period, type):
+        '''Returns a user's log total for a period the way get_user_log does,
+        with the buffered amount added'''
+        stored = await self.read(guild_id, user_id, partial(self.bot.storage.get_user_log, guild_id,
+                                                            user_id, period, type, primary=True))
+        buffered = self.get(guild_id, user_id, period, type)
+        if stored is None:
+            return buffered or None
+        return stored + buffered
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        '''Writes everything buffered so far in one statement. On failure the
+        increments are merged back in to be retried on the next flush'''
+        async with self.lock:
+            self.full.clear()
+            if not self.pending:
+                return True
+            pending, self.pending = self.pending, {}
+            self.flushing = pending
+            self.flushes += 1
+            rows = [(*key, month, totals['pages'], totals['time'])
+                    for key, months in pending.items() for month, totals in months.items()]
+            try:
+                await self.bot.storage.add_logs(rows)
+                return True
+            except Exception as e:
+                logging.exception(f'Could not flush {len(rows)} buffered logs - {e}')
+                for key, months in pending.items():
+                    for month, totals in months.items():
+                        merged = self.pending.setdefault(key, {}).setdefault(month, {'pages': 0, 'time': 0})
+                        for type, amount in totals.items():
+                            merged[type] += amount
+                return False
+            finally:
+                self.flushing = {}
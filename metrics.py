@@ -0,0 +1,217 @@
+from bisect import bisect_left
+import asyncio
+import functools
+import logging
+import math
+import time
+
+# Upper bounds in seconds, from a cached leaderboard page up to a stalled query
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=''):
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Metric:
+    '''Base for the metric types. Samples are kept per tuple of label values
+    in plain dicts - everything runs on the event loop, so recording a sample
+    is a dict lookup and an add without any locking.'''
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for labels, value in self.samples():
+            lines.append(f'{self.name}{format_labels(self.labels, labels)} {value}')
+        return lines
+
+    def samples(self):
+        return self.values.items()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    '''Gauge read at scrape time from function, which returns a value for an
+    unlabelled gauge or a dict of label tuples to values, or None to skip'''
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def samples(self):
+        if self.function is None:
+            return []
+        try:
+            values = self.function()
+        except Exception:
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(labels, value) for labels, value in values.items() if math.isfinite(value)]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        counts = self.values.get(labels)
+        if counts is None:
+            # One count per bucket, one for +Inf, then the running sum
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for labels, counts in self.values.items():
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                bucket = format_labels(self.labels, labels, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{bucket} {total}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, labels)} {counts[-1]}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, labels)} {total}')
+        return lines
+
+
+MESSAGE_SECONDS = Histogram('streakbot_message_seconds',
+                            'Time spent processing a message for commands')
+COMMAND_SECONDS = Histogram('streakbot_command_seconds',
+                            'Time spent running a command, including its error handler',
+                            ('command',))
+COMMAND_ERRORS = Counter('streakbot_command_errors_total',
+                         'Commands that raised, including cooldowns and bad arguments',
+                         ('command', 'error'))
+STORAGE_SECONDS = Histogram('streakbot_storage_seconds',
+                            'Time spent in each storage call, labelled by the method issuing the queries',
+                            ('method',))
+STORAGE_ERRORS = Counter('streakbot_storage_errors_total',
+                         'Storage calls that raised', ('method',))
+POOL_WAIT_SECONDS = Histogram('streakbot_pool_wait_seconds',
+                              'Time spent waiting to check out a pooled database connection',
+                              ('pool',))
+POOL_CONNECTIONS = Gauge('streakbot_pool_connections',
+                         'Database pool connections by pool and state', ('pool', 'state'))
+GATEWAY_LATENCY = Gauge('streakbot_gateway_latency_seconds',
+                        'Discord gateway heartbeat latency')
+COALESCED_CALLS = Counter('streakbot_coalesced_calls_total',
+                          'Calls that shared an identical call already in flight', ('call',))
+LOOP_LAG_SECONDS = Histogram('streakbot_loop_lag_seconds',
+                             'How late the event loop woke from a timed sleep')
+LOOP_BLOCKS = Counter('streakbot_loop_blocks_total',
+                      'Times the event loop was blocked past the slow callback threshold, by blocking function',
+                      ('function',))
+OUTBOX_MESSAGES = Counter('streakbot_outbox_messages_total',
+                          'Queued messages sent, merged into another message or failed', ('result',))
+OUTBOX_WAIT_SECONDS = Histogram('streakbot_outbox_wait_seconds',
+                                'Time a message spent queued before it was sent')
+LOGGED_ERRORS = Counter('streakbot_logged_errors_total',
+                        'Records logged at ERROR or above', ('logger',))
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def instrument(storage):
+    '''Wraps every storage call on storage so its duration and failures are
+    recorded against the method name. Each method is one call site in the
+    cogs, so this doubles as per-query timing.'''
+    for name in storage.METHODS:
+        method = getattr(storage, name)
+        setattr(storage, name, timed(method, name))
+    return storage
+
+
+def timed(method, name):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            STORAGE_ERRORS.inc(name)
+            raise
+        finally:
+            STORAGE_SECONDS.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+class ErrorCounter(logging.Handler):
+    '''Counts everything logged at ERROR or above, which covers every failure
+    the bot reports through logging.exception'''
+    def __init__(self):
+        super().__init__(logging.ERROR)
+
+    def emit(self, record):
+        LOGGED_ERRORS.inc(record.name)
+
+
+class MetricsServer:
+    '''Minimal HTTP server answering GET /metrics in the Prometheus text
+    format. Meant to be bound to localhost and scraped by a local agent.'''
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        logging.info(f'Serving metrics on http://{self.host}:{self.port}/metrics')
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while await asyncio.wait_for(reader.readline(), 5) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b'GET' and parts[1].split(b'?')[0] == b'/metrics':
+                status, body = '200 OK', render().encode()
+            else:
+                status, body = '404 Not Found', b'Not found\n'
+            writer.write(f'HTTP/1.1 {status}\r\n'
+                         'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         f'Content-Length: {len(body)}\r\n'
+                         'Connection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except Exception as e:
+            logging.debug(f'Metrics request failed - {e}')
+        finally:
+            writer.close()
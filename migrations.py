@@ -0,0 +1,216 @@
+import logging
+import aiomysql
+
+# Fills log_rollups from logs, used when the table is created and again to
+# rebuild it after logs are imported
+ROLLUP_BACKFILL = [
+    '''INSERT INTO `log_rollups` (`guild_id`, `period`, `user_id`, `time`, `pages`)
+        SELECT `guild_id`, YEAR(`month`), `user_id`, SUM(`time`), SUM(`pages`) FROM `logs`
+        GROUP BY `guild_id`, YEAR(`month`), `user_id`
+        ON DUPLICATE KEY UPDATE `time` = VALUES(`time`), `pages` = VALUES(`pages`)''',
+    '''INSERT INTO `log_rollups` (`guild_id`, `period`, `user_id`, `time`, `pages`)
+        SELECT `guild_id`, CONCAT(YEAR(`month`), '-Q', QUARTER(`month`)), `user_id`,
+        SUM(`time`), SUM(`pages`) FROM `logs`
+        GROUP BY `guild_id`, YEAR(`month`), QUARTER(`month`), `user_id`
+        ON DUPLICATE KEY UPDATE `time` = VALUES(`time`), `pages` = VALUES(`pages`)''',
+    '''INSERT INTO `log_rollups` (`guild_id`, `period`, `user_id`, `time`, `pages`)
+        SELECT `guild_id`, 'all', `user_id`, SUM(`time`), SUM(`pages`) FROM `logs`
+        GROUP BY `guild_id`, `user_id`
+        ON DUPLICATE KEY UPDATE `time` = VALUES(`time`), `pages` = VALUES(`pages`)''',
+]
+
+# Ordered schema migrations as (version, description, statements). Each step
+# runs in its own transaction and is recorded in schema_version once applied.
+# MySQL commits DDL implicitly, so steps are written to be safe to run again
+# after a partial failure - each ALTER is atomic, and one that fails because
+# its column or index change already happened is skipped.
+MIGRATIONS = [
+    (1, 'Create base tables', [
+        '''CREATE TABLE IF NOT EXISTS `users` (
+            `user_id` VARCHAR(50) NOT NULL,
+            `username` VARCHAR(50) NOT NULL,
+            `discriminator` INT NOT NULL,
+            `daily_claimed` DATETIME,
+            `streak` INT DEFAULT 0,
+            `personal_best` INT DEFAULT 0,
+            `current_year_best` INT DEFAULT 0,
+            `current_year_streak` INT DEFAULT 0,
+            PRIMARY KEY (`user_id`)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS `logs` (
+            `user_id` VARCHAR(50) NOT NULL,
+            `month` VARCHAR(8) NOT NULL,
+            `time` INT(11) DEFAULT 0,
+            `pages` INT(11) DEFAULT 0,
+            CONSTRAINT PRIMARY KEY (user_id, month)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS `streak_history` (
+            `user_id` VARCHAR(50) NOT NULL,
+            `year` YEAR NOT NULL,
+            `past_pb` INT NOT NULL,
+            CONSTRAINT PRIMARY KEY (user_id, year)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS `rollover_log` (
+            `year` YEAR NOT NULL,
+            `completed` DATETIME NOT NULL,
+            PRIMARY KEY (`year`)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS `reminders` (
+            `user_id` VARCHAR(50) NOT NULL,
+            `channel_id` BIGINT UNSIGNED NOT NULL,
+            `due` DATETIME NOT NULL,
+            PRIMARY KEY (`user_id`)
+        )''',
+    ]),
+    (2, 'Add leaderboard indexes', [
+        # Each index matches a board's ORDER BY value DESC, user_id so that a
+        # page is read straight off the index instead of a filesort
+        'ALTER TABLE `users` ADD INDEX `idx_users_streak` (`streak` DESC, `user_id`, `daily_claimed`)',
+        'ALTER TABLE `users` ADD INDEX `idx_users_year_streak` (`current_year_streak` DESC, `user_id`)',
+        'ALTER TABLE `users` ADD INDEX `idx_users_personal_best` (`personal_best` DESC, `user_id`)',
+        'ALTER TABLE `users` ADD INDEX `idx_users_year_best` (`current_year_best` DESC, `user_id`, `daily_claimed`)',
+        'ALTER TABLE `users` ADD INDEX `idx_users_daily_claimed` (`daily_claimed`)',
+        'ALTER TABLE `streak_history` ADD INDEX `idx_history_year_pb` (`year`, `past_pb` DESC, `user_id`)',
+        'ALTER TABLE `logs` ADD INDEX `idx_logs_month_pages` (`month`, `pages` DESC, `user_id`)',
+        'ALTER TABLE `logs` ADD INDEX `idx_logs_month_time` (`month`, `time` DESC, `user_id`)',
+        'ALTER TABLE `reminders` ADD INDEX `idx_reminders_due` (`due`)',
+    ]),
+    (3, 'Store user IDs as BIGINT snowflakes', [
+        'ALTER TABLE `users` MODIFY `user_id` BIGINT UNSIGNED NOT NULL',
+        'ALTER TABLE `logs` MODIFY `user_id` BIGINT UNSIGNED NOT NULL',
+        'ALTER TABLE `streak_history` MODIFY `user_id` BIGINT UNSIGNED NOT NULL',
+        'ALTER TABLE `reminders` MODIFY `user_id` BIGINT UNSIGNED NOT NULL',
+    ]),
+    (4, 'Partition streaks, logs and reminders by guild', [
+        # Existing rows become guild 0, the single shared partition used
+        # unless PerGuild is enabled. Each board index leads with guild_id so
+        # a guild's page is read from its own slice of the index.
+        '''ALTER TABLE `users` ADD COLUMN `guild_id` BIGINT UNSIGNED NOT NULL DEFAULT 0 FIRST,
+            DROP PRIMARY KEY, ADD PRIMARY KEY (`guild_id`, `user_id`)''',
+        '''ALTER TABLE `logs` ADD COLUMN `guild_id` BIGINT UNSIGNED NOT NULL DEFAULT 0 FIRST,
+            DROP PRIMARY KEY, ADD PRIMARY KEY (`guild_id`, `user_id`, `month`)''',
+        '''ALTER TABLE `streak_history` ADD COLUMN `guild_id` BIGINT UNSIGNED NOT NULL DEFAULT 0 FIRST,
+            DROP PRIMARY KEY, ADD PRIMARY KEY (`guild_id`, `user_id`, `year`)''',
+        '''ALTER TABLE `reminders` ADD COLUMN `guild_id` BIGINT UNSIGNED NOT NULL DEFAULT 0 FIRST,
+            DROP PRIMARY KEY, ADD PRIMARY KEY (`guild_id`, `user_id`)''',
+        # The rollover still walks users across every guild by user_id
+        'ALTER TABLE `users` ADD INDEX `idx_users_user` (`user_id`)',
+        '''ALTER TABLE `users` DROP INDEX `idx_users_streak`,
+            ADD INDEX `idx_users_guild_streak` (`guild_id`, `streak` DESC, `user_id`, `daily_claimed`)''',
+        '''ALTER TABLE `users` DROP INDEX `idx_users_year_streak`,
+            ADD INDEX `idx_users_guild_year_streak` (`guild_id`, `current_year_streak` DESC, `user_id`)''',
+        '''ALTER TABLE `users` DROP INDEX `idx_users_personal_best`,
+            ADD INDEX `idx_users_guild_personal_best` (`guild_id`, `personal_best` DESC, `user_id`)''',
+        '''ALTER TABLE `users` DROP INDEX `idx_users_year_best`,
+            ADD INDEX `idx_users_guild_year_best` (`guild_id`, `current_year_best` DESC, `user_id`, `daily_claimed`)''',
+        '''ALTER TABLE `streak_history` DROP INDEX `idx_history_year_pb`,
+            ADD INDEX `idx_history_guild_year_pb` (`guild_id`, `year`, `past_pb` DESC, `user_id`)''',
+        '''ALTER TABLE `logs` DROP INDEX `idx_logs_month_pages`,
+            ADD INDEX `idx_logs_guild_month_pages` (`guild_id`, `month`, `pages` DESC, `user_id`)''',
+        '''ALTER TABLE `logs` DROP INDEX `idx_logs_month_time`,
+            ADD INDEX `idx_logs_guild_month_time` (`guild_id`, `month`, `time` DESC, `user_id`)''',
+    ]),
+    (5, 'Store log months as dates and add log rollups', [
+        # MM-YYYY text becomes the first day of the month. Each statement can
+        # safely run again - a DATE reads back as YYYY-MM-DD, which is left
+        # alone by the LIKE and converts straight back to a DATE.
+        'ALTER TABLE `logs` MODIFY `month` VARCHAR(10) NOT NULL',
+        """UPDATE `logs` SET `month` = DATE_FORMAT(STR_TO_DATE(CONCAT('01-', `month`), '%d-%m-%Y'), '%Y-%m-%d')
+            WHERE `month` LIKE '__-____'""",
+        'ALTER TABLE `logs` MODIFY `month` DATE NOT NULL',
+        # Running totals per year (YYYY), quarter (YYYY-Qn) and all time (all)
+        # so that a range is read with the same index lookup as a month
+        '''CREATE TABLE IF NOT EXISTS `log_rollups` (
+            `guild_id` BIGINT UNSIGNED NOT NULL,
+            `period` VARCHAR(8) NOT NULL,
+            `user_id` BIGINT UNSIGNED NOT NULL,
+            `time` INT DEFAULT 0,
+            `pages` INT DEFAULT 0,
+            PRIMARY KEY (`guild_id`, `period`, `user_id`),
+            INDEX `idx_rollups_pages` (`guild_id`, `period`, `pages` DESC, `user_id`),
+            INDEX `idx_rollups_time` (`guild_id`, `period`, `time` DESC, `user_id`)
+        )''',
+        *ROLLUP_BACKFILL,
+    ]),
+    (6, 'Add the claim and log event log', [
+        '''CREATE TABLE IF NOT EXISTS `events` (
+            `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+            `guild_id` BIGINT UNSIGNED NOT NULL,
+            `user_id` BIGINT UNSIGNED NOT NULL,
+            `at` DATETIME,
+            `kind` TINYINT UNSIGNED NOT NULL,
+            `amount` INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (`id`),
+            INDEX `idx_events_user` (`guild_id`, `user_id`, `id`)
+        )''',
+        # Baseline events for everything recorded before the log existed -
+        # kinds 4 to 8 are each user's counters and archived bests, and kinds
+        # 2 and 3 their logged pages and time per month. Each insert is skipped
+        # once its kind is in the table, so a rerun never adds them twice
+        '''INSERT INTO `events` (`guild_id`, `user_id`, `at`, `kind`, `amount`)
+            SELECT `guild_id`, `user_id`, `daily_claimed`, 4, `streak` FROM `users`
+            WHERE NOT EXISTS (SELECT 1 FROM `events` WHERE `kind` = 4)''',
+        '''INSERT INTO `events` (`guild_id`, `user_id`, `at`, `kind`, `amount`)
+            SELECT `guild_id`, `user_id`, `daily_claimed`, 5, `personal_best` FROM `users`
+            WHERE NOT EXISTS (SELECT 1 FROM `events` WHERE `kind` = 5)''',
+        '''INSERT INTO `events` (`guild_id`, `user_id`, `at`, `kind`, `amount`)
+            SELECT `guild_id`, `user_id`, `daily_claimed`, 6, `current_year_streak` FROM `users`
+            WHERE NOT EXISTS (SELECT 1 FROM `events` WHERE `kind` = 6)''',
+        '''INSERT INTO `events` (`guild_id`, `user_id`, `at`, `kind`, `amount`)
+            SELECT `guild_id`, `user_id`, `daily_claimed`, 7, `current_year_best` FROM `users`
+            WHERE NOT EXISTS (SELECT 1 FROM `events` WHERE `kind` = 7)''',
+        '''INSERT INTO `events` (`guild_id`, `user_id`, `at`, `kind`, `amount`)
+            SELECT `guild_id`, `user_id`, MAKEDATE(`year`, 1), 8, `past_pb` FROM `streak_history`
+            WHERE NOT EXISTS (SELECT 1 FROM `events` WHERE `kind` = 8)''',
+        '''INSERT INTO `events` (`guild_id`, `user_id`, `at`, `kind`, `amount`)
+            SELECT `guild_id`, `user_id`, `month`, 2, `pages` FROM `logs` WHERE `pages` != 0
+            AND NOT EXISTS (SELECT 1 FROM `events` WHERE `kind` = 2)''',
+        '''INSERT INTO `events` (`guild_id`, `user_id`, `at`, `kind`, `amount`)
+            SELECT `guild_id`, `user_id`, `month`, 3, `time` FROM `logs` WHERE `time` != 0
+            AND NOT EXISTS (SELECT 1 FROM `events` WHERE `kind` = 3)''',
+    ]),
+]
+
+ER_DUP_FIELDNAME = 1060
+ER_DUP_KEYNAME = 1061
+ER_CANT_DROP_FIELD_OR_KEY = 1091
+# Errors from a statement that already took effect in an earlier partial run
+ALREADY_APPLIED = (ER_DUP_FIELDNAME, ER_DUP_KEYNAME, ER_CANT_DROP_FIELD_OR_KEY)
+
+
+async def run_migrations(conn):
+    '''Brings the schema of the connection's current database up to the
+    latest version. Returns the version the schema ended up at.'''
+    async with conn.cursor() as cur:
+        query = '''CREATE TABLE IF NOT EXISTS `schema_version` (
+                `version` INT NOT NULL,
+                `description` VARCHAR(255) NOT NULL,
+                `applied` DATETIME NOT NULL,
+                PRIMARY KEY (`version`)
+                )'''
+        await cur.execute(query)
+        await cur.execute('SELECT MAX(version) FROM schema_version')
+        current = (await cur.fetchone())[0] or 0
+
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            logging.info(f'Applying schema migration {version} - {description}')
+            await conn.begin()
+            try:
+                for statement in statements:
+                    try:
+                        await cur.execute(statement)
+                    except aiomysql.OperationalError as e:
+                        if e.args[0] not in ALREADY_APPLIED:
+                            raise
+                        logging.info(f'Skipping change that was already applied - {e}')
+                query = '''INSERT INTO schema_version (version, description, applied)
+                        VALUES (%s, %s, NOW())'''
+                await cur.execute(query, (version, description,))
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+            current = version
+    return current
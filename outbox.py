@@ -0,0 +1,160 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from discord.ext import commands
+import metrics
+
+# Queued messages go out lowest priority first, and in order within one
+PRIORITY_REPLY = 0
+PRIORITY_REMINDER = 1
+# Longest message Discord accepts, which caps how many replies are merged
+MESSAGE_LIMIT = 2000
+
+
+class Queued:
+    __slots__ = ('content', 'kwargs', 'future', 'queued')
+
+    def __init__(self, content, kwargs, future):
+        self.content = content
+        self.kwargs = kwargs
+        self.future = future
+        self.queued = time.perf_counter()
+
+    @property
+    def text(self):
+        '''Whether this is plain text that can be merged with others'''
+        return self.content is not None and not self.kwargs
+
+    def done(self, message):
+        if not self.future.done():
+            self.future.set_result(message)
+
+
+class Outbox:
+    '''Central send queue. Every channel gets its own priority queue and a
+    worker task that sends one message at a time, which is all a channel's
+    rate limit allows anyway, so a channel that is being rate limited only
+    holds up its own worker rather than the handlers sending to it. When
+    several plain text messages are waiting for the same channel they are
+    merged into one, up to max_merge at a time. Senders only wait once
+    max_queue messages are queued for a channel. Workers exit as soon as
+    their channel's queue is empty.'''
+    def __init__(self, max_queue, max_merge):
+        self.max_queue = max_queue
+        self.max_merge = max_merge
+        self.queues = {}
+        self.slots = {}
+        self.holders = {}
+        self.workers = {}
+        self.order = itertools.count()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def send(self, channel, content=None, priority=PRIORITY_REPLY, **kwargs):
+        '''Queues a message and returns a future for the sent message, which
+        is None if it could not be sent'''
+        slots = self.slots.get(channel.id)
+        if slots is None:
+            slots = self.slots[channel.id] = asyncio.Semaphore(self.max_queue)
+        self.holders[channel.id] = self.holders.get(channel.id, 0) + 1
+        try:
+            await slots.acquire()
+        except BaseException:
+            self.holders[channel.id] -= 1
+            self.forget(channel.id)
+            raise
+        item = Queued(content, kwargs, asyncio.get_running_loop().create_future())
+        heapq.heappush(self.queues.setdefault(channel.id, []), (priority, next(self.order), item))
+        if channel.id not in self.workers:
+            self.workers[channel.id] = asyncio.create_task(self.run(channel))
+        return item.future
+
+    def release(self, channel_id):
+        '''Frees the slot a sent or dropped message held'''
+        self.slots[channel_id].release()
+        self.holders[channel_id] -= 1
+        self.forget(channel_id)
+
+    def forget(self, channel_id):
+        # A channel's semaphore is only dropped once nobody holds or waits on
+        # one of its slots, so there is never more than one per channel
+        if not self.holders[channel_id]:
+            del self.holders[channel_id]
+            del self.slots[channel_id]
+
+    def take(self, queue):
+        '''Pops the next message, along with any plain text messages waiting
+        behind it that fit into the same message'''
+        items = [heapq.heappop(queue)[2]]
+        if not items[0].text:
+            return items
+        length = len(items[0].content)
+        while queue and len(items) < self.max_merge:
+            item = queue[0][2]
+            if not item.text or length + 1 + len(item.content) > MESSAGE_LIMIT:
+                break
+            items.append(heapq.heappop(queue)[2])
+            length += 1 + len(item.content)
+        return items
+
+    async def run(self, channel):
+        queue = self.queues[channel.id]
+        items = []
+        try:
+            while queue:
+                items = self.take(queue)
+                now = time.perf_counter()
+                for item in items:
+                    metrics.OUTBOX_WAIT_SECONDS.observe(now - item.queued)
+                content = '\n'.join(item.content for item in items) if len(items) > 1 else items[0].content
+                try:
+                    message = await channel.send(content, **items[0].kwargs)
+                    metrics.OUTBOX_MESSAGES.inc('sent')
+                    metrics.OUTBOX_MESSAGES.inc('merged', amount=len(items) - 1)
+                except Exception as e:
+                    logging.exception(f'Could not send {len(items)} messages to channel {channel.id} - {e}')
+                    metrics.OUTBOX_MESSAGES.inc('failed', amount=len(items))
+                    message = None
+                for item in items:
+                    item.done(message)
+                    self.release(channel.id)
+                items = []
+        finally:
+            # Only reached with messages left when the worker is cancelled
+            for item in items + [entry[2] for entry in queue]:
+                item.done(None)
+                self.release(channel.id)
+            del self.queues[channel.id]
+            del self.workers[channel.id]
+
+    async def close(self, timeout):
+        '''Gives queued messages up to timeout seconds to go out, then drops
+        the rest'''
+        workers = list(self.workers.values())
+        if not workers:
+            return
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        if pending:
+            logging.warning(f'Dropped {len(self)} queued messages on shutdown')
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+class OutboxContext(commands.Context):
+    '''Context whose send queues the message on the bot's outbox, where
+    replies are prioritised over reminders and merged with others waiting
+    for the same channel. Send only waits for a free slot in the channel's
+    queue and then returns a future for the sent message, which is None if
+    it could not be sent, so handlers finish without waiting on Discord.
+    Callers that need the message await the future. Interaction replies
+    have to be answered in time and attachments are often cleaned up once
+    send returns, so both are still sent directly.'''
+    async def send(self, content=None, **kwargs):
+        outbox = self.bot.outbox
+        if outbox is None or self.interaction is not None or 'file' in kwargs or 'files' in kwargs:
+            return await super().send(content, **kwargs)
+        return await outbox.send(self.channel, content, **kwargs)
@@ -0,0 +1,44 @@
+class Periods:
+    '''The years with archived personal bests and the months ('YYYY-MM')
+    with logs in one guild partition'''
+    def __init__(self):
+        self.years = set()
+        self.months = set()
+        self.complete = False
+
+    def load(self, years, months):
+        self.years.update(int(year) for year in years)
+        self.months.update(months)
+
+
+class PeriodIndex:
+    '''Index of the periods each guild partition has data for, which is all
+    the slash command autocomplete needs. A partition is read from storage
+    once and then kept current by the log writes that add new months, so no
+    keystroke ever reaches the database. Years only change at the year
+    rollover, which drops the whole index. Months logged while a partition
+    is loading are kept along with the loaded ones.'''
+    def __init__(self):
+        self.partitions = {}
+
+    def get(self, guild_id):
+        '''Returns a fully loaded partition, or None if it still needs loading'''
+        periods = self.partitions.get(guild_id)
+        if periods is None or not periods.complete:
+            return None
+        return periods
+
+    def start(self, guild_id):
+        return self.partitions.setdefault(guild_id, Periods())
+
+    def add_month(self, guild_id, month):
+        periods = self.partitions.get(guild_id)
+        if periods is not None:
+            periods.months.add(month)
+
+    def invalidate(self, guild_id=None):
+        '''Drops one partition, or every partition when no guild is given'''
+        if guild_id is None:
+            self.partitions.clear()
+        else:
+            self.partitions.pop(guild_id, None)
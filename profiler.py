@@ -0,0 +1,82 @@
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+
+
+def frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class Profile:
+    '''Stacks sampled from the event loop thread, kept as collapsed stacks
+    (outermost frame first) with how many samples each was seen in'''
+    def __init__(self, stacks, seconds):
+        self.stacks = stacks
+        self.samples = max(sum(stacks.values()), 1)
+        self.seconds = seconds
+
+    def collapsed(self):
+        '''Returns the profile in the collapsed "a;b;c count" format read by
+        flamegraph.pl, inferno and speedscope'''
+        return ''.join(f'{";".join(stack)} {count}\n' for stack, count in self.stacks.most_common())
+
+    def top(self, count):
+        '''Returns the count hottest functions as (name, self samples, total
+        samples), hottest first by time spent in the function itself'''
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, samples in self.stacks.items():
+            own[stack[-1]] += samples
+            for name in set(stack):
+                total[name] += samples
+        return [(name, samples, total[name]) for name, samples in own.most_common(count)]
+
+    def summary(self, count):
+        lines = [f'{self.samples} samples over {self.seconds:.1f}s',
+                 f'{"self":>6} {"total":>6}  function']
+        for name, own, total in self.top(count):
+            lines.append(f'{own / self.samples:>6.1%} {total / self.samples:>6.1%}  {name}')
+        return '\n'.join(lines)
+
+
+class SamplingProfiler:
+    '''Statistical profiler for the running bot. A background thread samples
+    the event loop thread's stack every interval seconds, so whatever
+    coroutine or callback is running at that moment is recorded without
+    instrumenting anything. Time the loop spends waiting for I/O shows up
+    under the selector. Only one profile can run at a time.'''
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = asyncio.Lock()
+
+    @property
+    def running(self):
+        return self.lock.locked()
+
+    def sample(self, thread_id, stop, stacks):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            stacks[tuple(reversed(stack))] += 1
+
+    async def run(self, seconds):
+        '''Samples the loop thread for seconds and returns the Profile'''
+        async with self.lock:
+            stacks = collections.Counter()
+            stop = threading.Event()
+            thread = threading.Thread(target=self.sample, name='profiler', daemon=True,
+                                      args=(threading.get_ident(), stop, stacks))
+            start = time.perf_counter()
+            thread.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stop.set()
+                await asyncio.to_thread(thread.join)
+            return Profile(stacks, time.perf_counter() - start)
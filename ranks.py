@@ -0,0 +1,96 @@
+import time
+from sortedcontainers import SortedList
+
+
+class RankBoard:
+    '''Every row of one board held in a sorted list keyed by (-value, user_id),
+    the board's own order, so a user's position is a bisect and their
+    neighbours a slice - both O(log n) whatever the size of the board. Rows
+    that carry an expiry (streaks past the timeout) are also kept ordered by
+    expiry and dropped as they lapse.'''
+    def __init__(self):
+        self.order = SortedList()
+        self.expiries = SortedList()
+        self.rows = {}
+        self.complete = False
+
+    def __len__(self):
+        return len(self.order)
+
+    def set(self, user_id, value, expires=None):
+        self.remove(user_id)
+        self.rows[user_id] = (value, expires)
+        self.order.add((-value, user_id))
+        if expires is not None:
+            self.expiries.add((expires, user_id))
+
+    def remove(self, user_id):
+        old = self.rows.pop(user_id, None)
+        if old is None:
+            return
+        value, expires = old
+        self.order.remove((-value, user_id))
+        if expires is not None:
+            self.expiries.remove((expires, user_id))
+
+    def load(self, rows):
+        '''Adds (user_id, value) or (user_id, value, expires) rows read from
+        storage, skipping users already written since the load began'''
+        for row in rows:
+            user_id = int(row[0])
+            if user_id not in self.rows:
+                self.set(user_id, row[1], row[2] if len(row) > 2 else None)
+
+    def expire(self, now):
+        while self.expiries and self.expiries[0][0] <= now:
+            self.remove(self.expiries[0][1])
+
+    def rank(self, user_id):
+        '''Returns the user's 1-based position and value, or None'''
+        row = self.rows.get(user_id)
+        if row is None:
+            return None
+        return self.order.index((-row[0], user_id)) + 1, row[0]
+
+    def around(self, position, radius):
+        '''Returns (position, user_id, value) for the rows within radius
+        places of position'''
+        start = max(position - radius, 1)
+        rows = self.order.islice(start - 1, position + radius)
+        return [(start + i, user_id, -value) for i, (value, user_id) in enumerate(rows)]
+
+
+class RankIndex:
+    '''Order-statistic index over whole boards, keyed like the leaderboard
+    cache. Boards are loaded in full from storage once and then kept current
+    by the same writes that update the leaderboard cache. Writes that land
+    while a board is still loading win over the rows being loaded, which can
+    only be older.'''
+    def __init__(self):
+        self.boards = {}
+
+    def get(self, key, now=None):
+        '''Returns a fully loaded board, or None if it still needs loading'''
+        board = self.boards.get(key)
+        if board is None or not board.complete:
+            return None
+        board.expire(time.time() if now is None else now)
+        return board
+
+    def start(self, key):
+        '''Returns the board to load for key. A board dropped by invalidate
+        while loading is simply never seen again'''
+        return self.boards.setdefault(key, RankBoard())
+
+    def update(self, key, user_id, value, expires=None):
+        '''Applies a single user's new value to a loaded or loading board'''
+        board = self.boards.get(key)
+        if board is not None:
+            board.set(int(user_id), value, expires)
+
+    def invalidate(self, key=None):
+        '''Drops one board, or every board when no key is given'''
+        if key is None:
+            self.boards.clear()
+        else:
+            self.boards.pop(key, None)
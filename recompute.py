@@ -0,0 +1,150 @@
+'''Offline rebuild of the users, streak_history and logs tables from the
+append-only events table. Each user's events are streamed back in the order
+they were written and replayed through the same claim engine the bot uses,
+so memory use stays flat however many users there are. Stop the bot first -
+claims made while a rebuild runs would be overwritten.
+
+Run from the repository root with the bot's config.ini, e.g.
+
+    python recompute.py
+    python recompute.py --config other.ini --batch 5000
+
+Users keep their username and discriminator, and only the streak counters
+are rewritten. Log rollups are rebuilt once logs have been written. Events
+are only appended while [Events] Enabled is on, so a rebuild is only exact
+if it has been on since the events table was created.
+'''
+from datetime import datetime
+import argparse
+import asyncio
+import configparser
+import logging
+import sys
+from storage import create_storage, apply_claim
+from storage.base import (EVENT_CLAIM, EVENT_LOG, EVENT_BASE_STREAK, EVENT_BASE_PB,
+                          EVENT_BASE_YEAR_STREAK, EVENT_BASE_YEAR_BEST, EVENT_BASE_HISTORY)
+
+USER_COLUMNS = ('guild_id', 'user_id', 'daily_claimed', 'streak', 'personal_best',
+                'current_year_best', 'current_year_streak')
+LOG_KINDS = {kind: type for type, kind in EVENT_LOG.items()}
+BASE_COUNTERS = {EVENT_BASE_STREAK: 'streak', EVENT_BASE_PB: 'personal_best',
+                 EVENT_BASE_YEAR_STREAK: 'current_year_streak', EVENT_BASE_YEAR_BEST: 'current_year_best'}
+
+
+def replay(events, cooldown, timeout, year):
+    '''Replays one user's (at, kind, amount) events in order and returns their
+    users row counters, {year: past_pb} history and {month: {'pages', 'time'}}
+    logs. The year rollover is applied whenever a claim lands in a later year
+    than the one before it, and once more at the end if the last claim was
+    before year'''
+    user = None
+    history = {}
+    logs = {}
+
+    def rollover():
+        if user['current_year_best'] > 0:
+            last_year = user['daily_claimed'].year
+            history[last_year] = max(history.get(last_year, 0), user['current_year_best'])
+        user['current_year_best'] = user['current_year_streak'] = 0
+
+    for at, kind, amount in events:
+        if kind == EVENT_CLAIM:
+            row = None
+            if user is not None:
+                if user['daily_claimed'] is not None and user['daily_claimed'].year < at.year:
+                    rollover()
+                row = (user['daily_claimed'], user['streak'], user['personal_best'],
+                       user['current_year_streak'], user['current_year_best'])
+            response = apply_claim(row, at, cooldown, timeout)
+            if response['status'] == 'on_cooldown':
+                continue
+            user = {column: response[column] for column in USER_COLUMNS[3:]}
+            user['daily_claimed'] = at
+        elif kind in BASE_COUNTERS:
+            if user is None:
+                user = dict.fromkeys(USER_COLUMNS[3:], 0)
+            user['daily_claimed'] = at
+            user[BASE_COUNTERS[kind]] = amount
+        elif kind == EVENT_BASE_HISTORY:
+            history[at.year] = max(history.get(at.year, 0), amount)
+        elif kind in LOG_KINDS:
+            totals = logs.setdefault(at.strftime('%Y-%m'), {'pages': 0, 'time': 0})
+            totals[LOG_KINDS[kind]] += amount
+        else:
+            raise ValueError(f'Unknown event kind {kind}')
+    if user is not None and user['daily_claimed'] is not None and user['daily_claimed'].year < year:
+        rollover()
+    return user, history, logs
+
+
+async def recompute(storage, cooldown, timeout, batch_size=1000):
+    '''Rebuilds every user with events and returns how many there were'''
+    year = datetime.now().year
+    buffers = {'users': [], 'streak_history': [], 'logs': []}
+    count = 0
+
+    async def write(table, force=False):
+        rows = buffers[table]
+        if rows and (force or len(rows) >= batch_size):
+            await storage.import_rows(table, rows, USER_COLUMNS if table == 'users' else None)
+            buffers[table] = []
+
+    key, events = None, []
+
+    async def finish():
+        user, history, logs = replay(events, cooldown, timeout, year)
+        if user is not None:
+            buffers['users'].append((*key, *(user[column] for column in USER_COLUMNS[2:])))
+        buffers['streak_history'].extend((*key, past_year, pb) for past_year, pb in sorted(history.items()))
+        buffers['logs'].extend((*key, month, totals['time'], totals['pages'])
+                               for month, totals in sorted(logs.items()))
+        for table in buffers:
+            await write(table)
+
+    async for rows in storage.export_rows('events', batch_size):
+        for guild_id, user_id, _, at, kind, amount in rows:
+            if (guild_id, user_id) != key:
+                if events:
+                    await finish()
+                    count += 1
+                key, events = (guild_id, user_id), []
+            events.append((at, kind, amount))
+    if events:
+        await finish()
+        count += 1
+    for table in buffers:
+        await write(table, force=True)
+    await storage.rebuild_rollups()
+    return count
+
+
+async def run(config, args):
+    storage = create_storage(config)
+    await storage.start()
+    try:
+        streakcfg = config['Streaks']
+        count = await recompute(storage, int(streakcfg['Cooldown']), int(streakcfg['Timeout']), args.batch)
+        logging.info(f'Recomputed {count} users from the event log')
+    finally:
+        await storage.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild streaks, history and logs from the event log')
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--batch', type=int, default=1000, help='rows per query')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', stream=sys.stderr, level=logging.INFO)
+    config = configparser.ConfigParser()
+    if not config.read(args.config):
+        sys.exit(f'Could not load configuration file {args.config}')
+    try:
+        asyncio.run(run(config, args))
+    except Exception as e:
+        logging.exception(f'Could not recompute - {e}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+import asyncio
+import heapq
+import logging
+from outbox import PRIORITY_REMINDER
+
+
+class ReminderScheduler:
+    '''Sends daily reminders from a single task. Pending reminders are kept in
+    a min-heap of due times, backed by the reminders table so that they
+    survive restarts, and every reminder that falls due in the same tick is
+    sent as one message per channel. Reminders are keyed by (guild_id,
+    user_id) as a user can be on cooldown in several guilds at once.'''
+    def __init__(self, bot, tick=1):
+        self.bot = bot
+        self.tick = tick
+        self.heap = []
+        self.pending = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def __contains__(self, key):
+        return key in self.pending
+
+    def __len__(self):
+        return len(self.pending)
+
+    async def start(self):
+        '''Loads pending reminders from the database and starts the scheduler
+        task'''
+        try:
+            for guild_id, user_id, channel_id, due in await self.bot.storage.load_reminders():
+                self.push((int(guild_id), int(user_id)), int(channel_id), due)
+            logging.info(f'Loaded {len(self.pending)} pending reminders')
+        except Exception as e:
+            logging.exception(f'Could not load reminders - {e}')
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def push(self, key, channel_id, due):
+        self.pending[key] = (due, channel_id)
+        heapq.heappush(self.heap, (due, key, channel_id))
+        if self.heap[0][1] == key:
+            self.wakeup.set()
+
+    async def add(self, key, channel_id, delay):
+        '''Schedules a reminder for the (guild_id, user_id) key in channel_id
+        delay seconds from now. Returns False if one is already pending'''
+        if key in self.pending:
+            return False
+        due = datetime.now() + timedelta(seconds=delay)
+        self.push(key, channel_id, due)
+        try:
+            await self.bot.storage.save_reminder(*key, channel_id, due)
+        except Exception as e:
+            logging.exception(f'Could not save reminder for user {key[1]} - {e}')
+        return True
+
+    async def discard(self, key):
+        '''Drops a pending reminder, e.g. once the user has claimed anyway'''
+        if self.pending.pop(key, None) is not None:
+            await self.delete([key])
+
+    async def delete(self, keys):
+        try:
+            await self.bot.storage.delete_reminders(keys)
+        except Exception as e:
+            logging.exception(f'Could not delete reminders - {e}')
+
+    def pop_due(self, now):
+        '''Pops every reminder due by now, grouped by channel. Heap entries
+        left behind by discarded or rescheduled reminders are skipped'''
+        due = {}
+        while self.heap and self.heap[0][0] <= now:
+            when, key, channel_id = heapq.heappop(self.heap)
+            if self.pending.get(key) != (when, channel_id):
+                continue
+            del self.pending[key]
+            due.setdefault(channel_id, []).append(key)
+        return due
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            if self.heap:
+                delay = (self.heap[0][0] - datetime.now()).total_seconds()
+            else:
+                delay = None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            due = self.pop_due(datetime.now() + timedelta(seconds=self.tick))
+            if due:
+                await self.send(due)
+
+    async def send(self, due):
+        for channel_id, keys in due.items():
+            mentions = ' '.join(f'<@!{user_id}>' for _, user_id in keys)
+            try:
+                channel = self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
+                content = f"Hey {mentions}, it\'s time to claim your daily"
+                if self.bot.outbox is not None:
+                    await self.bot.outbox.send(channel, content, priority=PRIORITY_REMINDER)
+                else:
+                    await channel.send(content)
+            except Exception as e:
+                logging.exception(f'Could not send reminders to channel {channel_id} - {e}')
+        await self.delete([key for keys in due.values() for key in keys])
@@ -0,0 +1,109 @@
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import discord
+from profiler import frame_name
+import metrics
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def fast_mode():
+    '''Switches to the faster event loop and gateway JSON codec where they are
+    installed, before the bot's loop is created. discord.py picks orjson up on
+    its own when it can be imported. Returns the (loop, json) in use'''
+    try:
+        import uvloop
+    except ImportError:
+        logging.warning('Fast mode wants uvloop, which is not installed - using the asyncio event loop')
+        loop = 'asyncio'
+    else:
+        uvloop.install()
+        loop = 'uvloop'
+    if not discord.utils.HAS_ORJSON:
+        logging.warning('Fast mode wants orjson, which is not installed - using the json module')
+    return loop, runtime_json()
+
+
+def runtime_json():
+    return 'orjson' if discord.utils.HAS_ORJSON else 'json'
+
+
+def blocking_frames(frame):
+    '''Returns the bot's own frames on a stack, innermost first, or the
+    innermost frame of all when none of them are the bot's'''
+    frames = []
+    innermost = frame
+    while frame is not None:
+        if frame.f_code.co_filename.startswith(ROOT) and frame.f_code.co_filename != __file__:
+            frames.append(frame_name(frame.f_code))
+        frame = frame.f_back
+    if not frames and innermost is not None:
+        frames.append(frame_name(innermost.f_code))
+    return frames
+
+
+class LoopMonitor:
+    '''Measures event loop lag by how late a sleep of interval seconds wakes
+    up. A watchdog thread notices when the loop has not woken for threshold
+    seconds past that and captures the loop thread's stack while it is still
+    blocked, so the stall is reported against the function that caused it
+    once the loop gets going again.'''
+    def __init__(self, interval, threshold):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = collections.deque(maxlen=10000)
+        self.beat = None
+        self.blocked = None
+        self.stopped = threading.Event()
+        self.task = None
+        self.thread = None
+
+    def start(self):
+        self.beat = time.monotonic()
+        self.task = asyncio.create_task(self.run())
+        self.thread = threading.Thread(target=self.watch, name='loop-monitor', daemon=True,
+                                       args=(threading.get_ident(),))
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self.blocked = None
+            self.beat = time.monotonic()
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0)
+            self.lags.append(lag)
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+            if lag >= self.threshold:
+                frames = self.blocked or ['unknown']
+                metrics.LOOP_BLOCKS.inc(frames[0])
+                logging.warning(f'Event loop blocked for {lag:.3f}s in {frames[0]}'
+                                + ''.join(f'\n  called from {name}' for name in frames[1:]))
+
+    def watch(self, thread_id):
+        while not self.stopped.wait(self.threshold / 2):
+            if self.blocked is None and time.monotonic() - self.beat > self.interval + self.threshold:
+                self.blocked = blocking_frames(sys._current_frames().get(thread_id))
+
+    def summary(self):
+        '''Returns p50, p99 and max lag in milliseconds over the samples kept,
+        clearing them'''
+        lags = sorted(self.lags)
+        self.lags.clear()
+        if not lags:
+            return {'samples': 0}
+        return {'samples': len(lags),
+                'p50_ms': round(lags[len(lags) // 2] * 1000, 3),
+                'p99_ms': round(lags[min(len(lags) * 99 // 100, len(lags) - 1)] * 1000, 3),
+                'max_ms': round(lags[-1] * 1000, 3)}
@@ -0,0 +1,31 @@
+from storage.base import (Storage, LOG_TYPES, ALL_TIME, EXPORT_TABLES, TABLE_KEYS, EVENT_CLAIM, EVENT_LOG,
+                          apply_claim, log_periods, in_period, is_month)
+
+BACKENDS = ('mysql', 'sqlite', 'memory')
+
+
+def create_storage(config):
+    '''Builds the storage backend selected by Backend in the [Database] section
+    of config.ini. Each backend's driver is only imported when it is used, so
+    aiosqlite is not needed for MySQL and aiomysql is not needed otherwise.'''
+    db = config['Database']
+    backend = db.get('Backend', 'mysql').lower()
+    if backend == 'mysql':
+        from db import Database
+        from storage.mysql import MySQLStorage
+        creds = config['Credentials']
+        if not db['Name'].isalnum():
+            raise ValueError('Invalid characters in SQL database name')
+        return MySQLStorage(Database(db['Host'], creds['DatabaseUser'], creds['DatabasePass'],
+                                     db['Name'], int(db['PoolSize']),
+                                     replica_host=db.get('ReplicaHost'), # Read replica, unset reads from the primary
+                                     replica_pool_size=db.getint('ReplicaPoolSize', int(db['PoolSize'])),
+                                     max_lag=db.getint('ReplicaMaxLag', 5), # Seconds behind before reads fall back
+                                     check_interval=db.getint('ReplicaCheckInterval', 10)))
+    elif backend == 'sqlite':
+        from storage.sqlite import SQLiteStorage
+        return SQLiteStorage(db.get('Path', 'streakbot.db'))
+    elif backend == 'memory':
+        from storage.memory import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f'Unknown database backend {backend}, expected one of {", ".join(BACKENDS)}')
@@ -0,0 +1,288 @@
+from datetime import datetime, date
+
+LOG_TYPES = ('pages', 'time')
+ALL_TIME = 'all'
+
+# Kinds of row in the append-only events table. Claims and log increments are
+# appended as they happen. The EVENT_BASE kinds hold the counters every user
+# had when the table was created, so that replaying a user's events in order
+# rebuilds them exactly.
+EVENT_CLAIM = 1
+EVENT_LOG = {'pages': 2, 'time': 3}
+EVENT_BASE_STREAK = 4
+EVENT_BASE_PB = 5
+EVENT_BASE_YEAR_STREAK = 6
+EVENT_BASE_YEAR_BEST = 7
+EVENT_BASE_HISTORY = 8
+
+# Columns of each table that can be exported and imported, in the order rows
+# are passed around. daily_claimed and at are datetimes or None and month is
+# 'YYYY-MM' on every backend. log_rollups is rebuilt from logs rather than
+# transferred.
+EXPORT_TABLES = {
+    'users': ('guild_id', 'user_id', 'username', 'discriminator', 'daily_claimed', 'streak',
+              'personal_best', 'current_year_best', 'current_year_streak'),
+    'logs': ('guild_id', 'user_id', 'month', 'time', 'pages'),
+    'streak_history': ('guild_id', 'user_id', 'year', 'past_pb'),
+    'events': ('guild_id', 'user_id', 'id', 'at', 'kind', 'amount'),
+}
+# How many leading columns of each table identify a row, which is also the
+# order tables are exported in
+TABLE_KEYS = {'users': 2, 'logs': 3, 'streak_history': 3, 'events': 3}
+# Values for columns left out of a partial import of new rows
+COLUMN_DEFAULTS = {'username': '', 'daily_claimed': None, 'at': None}
+
+
+def full_rows(table, rows, columns):
+    '''Expands rows holding only some of a table's columns to every column,
+    filling the rest with their defaults'''
+    all_columns = EXPORT_TABLES[table]
+    if columns is None or tuple(columns) == all_columns:
+        return rows
+    positions = {column: i for i, column in enumerate(columns)}
+    return [tuple(row[positions[column]] if column in positions else COLUMN_DEFAULTS.get(column, 0)
+                  for column in all_columns) for row in rows]
+
+
+def log_periods(month):
+    '''Returns the rollup periods a month ('YYYY-MM') counts towards - its
+    year ('YYYY'), its quarter ('YYYY-Qn') and all time'''
+    year, number = month.split('-')
+    return (year, f'{year}-Q{(int(number) + 2) // 3}', ALL_TIME)
+
+
+def is_month(period):
+    return len(period) == 7 and period[5] != 'Q'
+
+
+def month_start(month):
+    '''The first day of a 'YYYY-MM' month, which is how months are stored'''
+    year, number = month.split('-')
+    return date(int(year), int(number), 1)
+
+
+def in_period(month, period):
+    return period == month or period in log_periods(month)
+
+
+def rollup_rows(rows):
+    '''Sums (guild_id, user_id, month, pages, time) log increments into
+    (guild_id, period, user_id, pages, time) increments for log_rollups'''
+    rollups = {}
+    for guild_id, user_id, month, pages, time in rows:
+        for period in log_periods(month):
+            totals = rollups.setdefault((guild_id, period, user_id), [0, 0])
+            totals[0] += pages
+            totals[1] += time
+    return [(*key, pages, time) for key, (pages, time) in rollups.items()]
+
+
+def apply_claim(row, curr_time, cooldown, timeout):
+    '''Claim engine for the daily command, shared by every backend. Works out
+    the outcome of a claim from the user's locked row - a (daily_claimed,
+    streak, personal_best, current_year_streak, current_year_best) tuple, or
+    None if they have never claimed - and returns the response for the cog
+    along with the new counters to be written back. The year rollover job has
+    always reset last year's counters before a claim gets here.'''
+    response = {}
+    if row is None:
+        # First claim - the user is created with their first day counted
+        response['status'] = 'success'
+        streak = personal_best = year_streak = year_best = 1
+    else:
+        last_claimed, streak, personal_best, year_streak, year_best = row
+        if last_claimed is not None:
+            cd_remaining = (curr_time - last_claimed).total_seconds()
+            if cd_remaining < cooldown:
+                response['cooldown'] = cooldown - cd_remaining
+                response['status'] = 'on_cooldown'
+                response['daily_claimed'] = last_claimed
+                response['streak'] = streak
+                return response
+            # Reset if cooldown exceeds timeout
+            if cd_remaining >= timeout:
+                streak = 0
+                response['status'] = 'timeout'
+
+        streak += 1
+        if response.get('status') != 'timeout':
+            # Update the current year and personal best counters
+            personal_best = max(personal_best, streak)
+            year_streak += 1
+            year_best = max(year_best, year_streak)
+            response['status'] = 'success'
+
+    response['streak'] = streak
+    response['personal_best'] = personal_best
+    response['current_year_streak'] = year_streak
+    response['current_year_best'] = year_best
+    return response
+
+
+def board_query(key, after, limit, cutoff):
+    '''Builds the keyset query for a page of a board on the SQL backends, with
+    %s placeholders. Every board is read from its guild's partition of an
+    index. The current year's personal bests live in users until the
+    rollover archives them into streak_history'''
+    guild_id, board = key[0], key[1:]
+    where = ['guild_id = %s']
+    params = [guild_id]
+    extra = ''
+    if board == ('overall',):
+        column, table = 'streak', 'users'
+        where.append('daily_claimed >= %s AND streak > 0')
+        params.append(cutoff)
+        extra = ', daily_claimed'
+    elif board == ('current',):
+        column, table = 'current_year_streak', 'users'
+    elif board == ('pb', 0):
+        column, table = 'personal_best', 'users'
+    elif board[0] == 'pb' and board[1] == datetime.now().year:
+        column, table = 'current_year_best', 'users'
+        where.append('daily_claimed >= %s')
+        params.append(datetime(board[1], 1, 1))
+    elif board[0] == 'pb':
+        column, table = 'past_pb', 'streak_history'
+        where.append('year = %s')
+        params.append(board[1])
+    elif board[0] == 'log' and board[1] in LOG_TYPES and is_month(board[2]):
+        column, table = board[1], 'logs'
+        where.append('month = %s')
+        params.append(month_start(board[2]))
+    elif board[0] == 'log' and board[1] in LOG_TYPES:
+        column, table = board[1], 'log_rollups'
+        where.append('period = %s')
+        params.append(board[2])
+    else:
+        raise ValueError(f'Unknown leaderboard {key}')
+    if after is not None:
+        where.append(f'({column} < %s OR ({column} = %s AND user_id > %s))')
+        params.extend((after[0], after[0], after[1]))
+    params.append(limit)
+    query = f'''SELECT user_id, {column}{extra} FROM {table} WHERE {' AND '.join(where)}
+            ORDER BY {column} DESC, user_id LIMIT %s'''
+    return query, params
+
+
+class Storage:
+    '''Interface for everything the cogs keep in the database. Streaks, logs
+    and reminders are partitioned by guild_id, which is always 0 unless the
+    bot runs with PerGuild. Boards are keyed the same way as the leaderboard
+    cache: the guild_id followed by ('overall',), ('current',), ('pb', year)
+    with year 0 for all time, or ('log', type, period). Log periods are a
+    month ('YYYY-MM'), read from logs, or a year ('YYYY'), quarter ('YYYY-Qn')
+    or all time ('all'), read from the log_rollups table that every log write
+    keeps up to date alongside its month. Board rows are
+    (user_id, value) pairs ordered by value and then user ID, with
+    daily_claimed as a third column on the overall board.'''
+    METHODS = ('claim_daily', 'get_user_pb', 'query_board', 'rollover_done',
+               'rollover_batch', 'mark_rollover', 'timeout_streaks', 'add_log',
+               'add_logs', 'get_user_log', 'get_user_logs', 'load_reminders',
+               'save_reminder', 'delete_reminders', 'import_rows', 'rebuild_rollups',
+               'add_events', 'get_periods')
+
+    async def start(self):
+        '''Creates or upgrades the schema and opens connections'''
+
+    async def close(self):
+        '''Closes any open connections'''
+
+    def pool_stats(self):
+        '''Returns connection counts by state for backends with a pool'''
+        return None
+
+    async def claim_daily(self, guild_id, user_id, username, discriminator, curr_time, cooldown, timeout):
+        '''Claims the daily for a user in a single transaction, creating them
+        if needed, and returns the apply_claim response'''
+        raise NotImplementedError
+
+    async def get_user_pb(self, guild_id, user_id, year):
+        '''Returns a user's personal best for a year, 0 for all time, or None'''
+        raise NotImplementedError
+
+    async def query_board(self, key, after, limit, cutoff, primary=False):
+        '''Returns up to limit rows of a board after the keyset cursor after, a
+        (value, user_id) pair or None for the top. Overall rows claimed before
+        cutoff have timed out and are left off. Backends with a read replica
+        may answer from it unless primary is set, which reads that seed a
+        long-lived cache use so that they never start out behind'''
+        raise NotImplementedError
+
+    async def rollover_done(self, year):
+        '''Returns whether the rollover into year has completed'''
+        raise NotImplementedError
+
+    async def rollover_batch(self, year, after_id, batch_size):
+        '''Archives and resets the year counters of up to batch_size users
+        after after_id, across every guild, who have not claimed since the
+        start of year. Returns the last user ID processed, or None once every
+        user has been seen'''
+        raise NotImplementedError
+
+    async def mark_rollover(self, year, completed):
+        '''Records that the rollover into year has completed'''
+        raise NotImplementedError
+
+    async def timeout_streaks(self, cutoff, batch_size):
+        '''Zeroes up to batch_size stored streaks last claimed before cutoff
+        and returns how many were changed'''
+        raise NotImplementedError
+
+    async def add_log(self, guild_id, user_id, month, type, amount):
+        '''Adds to a user's log for a month and its rollups in one
+        transaction, and returns the new totals as get_user_logs does'''
+        raise NotImplementedError
+
+    async def add_logs(self, rows):
+        '''Adds a batch of (guild_id, user_id, month, pages, time) increments
+        and their rollups at once'''
+        raise NotImplementedError
+
+    async def get_user_log(self, guild_id, user_id, period, type, primary=False):
+        '''Returns a user's log total for a period, or None if nothing is
+        logged. Backends with a read replica may answer from it unless
+        primary is set'''
+        raise NotImplementedError
+
+    async def get_user_logs(self, guild_id, user_id, month, type, primary=False):
+        '''Returns a dict of a user's log totals for a month and each of its
+        rollup periods, leaving out any with nothing logged. Backends with a
+        read replica may answer from it unless primary is set'''
+        raise NotImplementedError
+
+    async def get_periods(self, guild_id):
+        '''Returns the years with archived personal bests and the months
+        ('YYYY-MM') with logs in a guild's partition'''
+        raise NotImplementedError
+
+    async def load_reminders(self):
+        '''Returns every pending (guild_id, user_id, channel_id, due) reminder'''
+        raise NotImplementedError
+
+    async def save_reminder(self, guild_id, user_id, channel_id, due):
+        raise NotImplementedError
+
+    async def delete_reminders(self, keys):
+        '''Deletes the reminders for a list of (guild_id, user_id) pairs'''
+        raise NotImplementedError
+
+    def export_rows(self, table, batch_size):
+        '''Returns an async iterator over every row of an EXPORT_TABLES table
+        in lists of up to batch_size, in primary key order. Rows are streamed
+        from the database rather than read into memory at once'''
+        raise NotImplementedError
+
+    async def import_rows(self, table, rows, columns=None):
+        '''Writes a batch of EXPORT_TABLES rows in one statement, replacing
+        any rows with the same key. With columns, rows only hold those
+        columns, key columns first - only they are changed on existing rows
+        and new rows get COLUMN_DEFAULTS for the rest'''
+        raise NotImplementedError
+
+    async def rebuild_rollups(self):
+        '''Recomputes log_rollups from logs, after logs have been imported'''
+        raise NotImplementedError
+
+    async def add_events(self, rows):
+        '''Appends a batch of (guild_id, user_id, at, kind, amount) events'''
+        raise NotImplementedError
@@ -0,0 +1,225 @@
+from datetime import datetime
+from storage.base import (Storage, EXPORT_TABLES, TABLE_KEYS, apply_claim, log_periods, is_month, rollup_rows,
+                          full_rows)
+
+
+class MemoryStorage(Storage):
+    '''Pure in-memory backend. Nothing survives a restart, so this is meant for
+    trying the bot out, tests and benchmarks rather than real guilds. Every
+    operation runs without awaiting, which makes each one atomic on the event
+    loop without any locking. Users are keyed by (guild_id, user_id).'''
+    def __init__(self):
+        self.users = {}
+        self.logs = {}
+        self.rollups = {}
+        self.history = {}
+        self.rollovers = {}
+        self.reminders = {}
+        self.events = {}
+        self.last_event = 0
+
+    async def claim_daily(self, guild_id, user_id, username, discriminator, curr_time, cooldown, timeout):
+        user = self.users.get((guild_id, user_id))
+        row = None
+        if user is not None:
+            row = (user['daily_claimed'], user['streak'], user['personal_best'],
+                   user['current_year_streak'], user['current_year_best'])
+        response = apply_claim(row, curr_time, cooldown, timeout)
+        if response['status'] == 'on_cooldown':
+            return response
+        if user is None:
+            user = self.users[(guild_id, user_id)] = {'username': username, 'discriminator': discriminator}
+            response['created'] = True
+        user['daily_claimed'] = curr_time
+        for column in ('streak', 'personal_best', 'current_year_streak', 'current_year_best'):
+            user[column] = response[column]
+        return response
+
+    async def get_user_pb(self, guild_id, user_id, year):
+        if year == 0 or year == datetime.now().year:
+            user = self.users.get((guild_id, user_id))
+            if user is None:
+                return None
+            if year == 0:
+                return user['personal_best']
+            if user['daily_claimed'] is not None and user['daily_claimed'] >= datetime(year, 1, 1):
+                return user['current_year_best']
+            return None
+        return self.history.get((guild_id, user_id, year))
+
+    def board_rows(self, key, cutoff):
+        guild_id, board = key[0], key[1:]
+        users = [(user_id, user) for (guild, user_id), user in self.users.items() if guild == guild_id]
+        if board == ('overall',):
+            return [(user_id, user['streak'], user['daily_claimed']) for user_id, user in users
+                    if user['streak'] > 0 and user['daily_claimed'] is not None
+                    and user['daily_claimed'] >= cutoff]
+        if board == ('current',):
+            return [(user_id, user['current_year_streak']) for user_id, user in users]
+        if board == ('pb', 0):
+            return [(user_id, user['personal_best']) for user_id, user in users]
+        if board[0] == 'pb' and board[1] == datetime.now().year:
+            start = datetime(board[1], 1, 1)
+            return [(user_id, user['current_year_best']) for user_id, user in users
+                    if user['daily_claimed'] is not None and user['daily_claimed'] >= start]
+        if board[0] == 'pb':
+            return [(user_id, pb) for (guild, user_id, year), pb in self.history.items()
+                    if guild == guild_id and year == board[1]]
+        if board[0] == 'log' and is_month(board[2]):
+            return [(user_id, totals[board[1]]) for (guild, user_id, month), totals in self.logs.items()
+                    if guild == guild_id and month == board[2]]
+        if board[0] == 'log':
+            return [(user_id, totals[board[1]]) for (guild, period, user_id), totals in self.rollups.items()
+                    if guild == guild_id and period == board[2]]
+        raise ValueError(f'Unknown leaderboard {key}')
+
+    async def query_board(self, key, after, limit, cutoff, primary=False):
+        rows = self.board_rows(key, cutoff)
+        if after is not None:
+            cursor = (-after[0], after[1])
+            rows = [row for row in rows if (-row[1], row[0]) > cursor]
+        rows.sort(key=lambda row: (-row[1], row[0]))
+        return rows[:limit]
+
+    async def rollover_done(self, year):
+        return year in self.rollovers
+
+    async def rollover_batch(self, year, after_id, batch_size):
+        boundary = datetime(year, 1, 1)
+        user_ids = sorted({user_id for _, user_id in self.users if user_id > after_id})[:batch_size]
+        if not user_ids:
+            return None
+        batch = set(user_ids)
+        for (guild_id, user_id), user in self.users.items():
+            if user_id not in batch:
+                continue
+            if user['daily_claimed'] is None or user['daily_claimed'] >= boundary:
+                continue
+            if user['current_year_best'] > 0:
+                key = (guild_id, user_id, user['daily_claimed'].year)
+                self.history[key] = max(self.history.get(key, 0), user['current_year_best'])
+            user['current_year_best'] = 0
+            user['current_year_streak'] = 0
+        return user_ids[-1]
+
+    async def mark_rollover(self, year, completed):
+        self.rollovers[year] = completed
+
+    async def timeout_streaks(self, cutoff, batch_size):
+        changed = 0
+        for user in self.users.values():
+            if changed >= batch_size:
+                break
+            if user['streak'] > 0 and user['daily_claimed'] is not None and user['daily_claimed'] < cutoff:
+                user['streak'] = 0
+                changed += 1
+        return changed
+
+    def log_totals(self, guild_id, user_id, month):
+        yield month, self.logs.setdefault((guild_id, user_id, month), {'pages': 0, 'time': 0})
+        for period in log_periods(month):
+            yield period, self.rollups.setdefault((guild_id, period, user_id), {'pages': 0, 'time': 0})
+
+    async def add_log(self, guild_id, user_id, month, type, amount):
+        for _, totals in self.log_totals(guild_id, user_id, month):
+            totals[type] += amount
+        return await self.get_user_logs(guild_id, user_id, month, type)
+
+    async def add_logs(self, rows):
+        for guild_id, user_id, month, pages, time in rows:
+            for _, totals in self.log_totals(guild_id, user_id, month):
+                totals['pages'] += pages
+                totals['time'] += time
+
+    async def get_user_log(self, guild_id, user_id, period, type, primary=False):
+        if is_month(period):
+            totals = self.logs.get((guild_id, user_id, period))
+        else:
+            totals = self.rollups.get((guild_id, period, user_id))
+        return totals[type] if totals is not None else None
+
+    async def get_user_logs(self, guild_id, user_id, month, type, primary=False):
+        results = {}
+        for period in (month,) + log_periods(month):
+            total = await self.get_user_log(guild_id, user_id, period, type)
+            if total is not None:
+                results[period] = total
+        return results
+
+    async def get_periods(self, guild_id):
+        years = {year for partition, _, year in self.history if partition == guild_id}
+        months = {month for partition, _, month in self.logs if partition == guild_id}
+        return sorted(years), sorted(months)
+
+    async def load_reminders(self):
+        return [(guild_id, user_id, channel_id, due)
+                for (guild_id, user_id), (channel_id, due) in self.reminders.items()]
+
+    async def save_reminder(self, guild_id, user_id, channel_id, due):
+        self.reminders[(guild_id, user_id)] = (channel_id, due)
+
+    async def delete_reminders(self, keys):
+        for key in keys:
+            self.reminders.pop(tuple(key), None)
+
+    async def export_rows(self, table, batch_size):
+        if table == 'users':
+            columns = EXPORT_TABLES['users'][2:]
+            rows = ((*key, *(user[column] for column in columns)) for key, user in sorted(self.users.items()))
+        elif table == 'logs':
+            rows = ((*key, totals['time'], totals['pages']) for key, totals in sorted(self.logs.items()))
+        elif table == 'events':
+            rows = ((*key, *event) for key, event in sorted(self.events.items()))
+        else:
+            rows = ((*key, pb) for key, pb in sorted(self.history.items()))
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def stored_row(self, table, key):
+        '''Returns the full export row kept under a key, or None'''
+        if table == 'users':
+            user = self.users.get(key)
+            return None if user is None else (*key, *(user[column] for column in EXPORT_TABLES['users'][2:]))
+        if table == 'logs':
+            totals = self.logs.get(key)
+            return None if totals is None else (*key, totals['time'], totals['pages'])
+        if table == 'events':
+            event = self.events.get(key)
+            return None if event is None else (*key, *event)
+        pb = self.history.get(key)
+        return None if pb is None else (*key, pb)
+
+    async def import_rows(self, table, rows, columns=None):
+        for row in rows:
+            if columns is not None:
+                old = self.stored_row(table, tuple(row[:TABLE_KEYS[table]]))
+                if old is None:
+                    row = full_rows(table, [row], columns)[0]
+                else:
+                    given = dict(zip(columns, row))
+                    row = tuple(given.get(column, value) for column, value in zip(EXPORT_TABLES[table], old))
+            if table == 'users':
+                self.users[row[:2]] = dict(zip(EXPORT_TABLES['users'][2:], row[2:]))
+            elif table == 'logs':
+                self.logs[row[:3]] = {'time': row[3], 'pages': row[4]}
+            elif table == 'events':
+                self.events[row[:3]] = row[3:]
+                self.last_event = max(self.last_event, row[2])
+            else:
+                self.history[row[:3]] = row[3]
+
+    async def rebuild_rollups(self):
+        rows = [(*key, totals['pages'], totals['time']) for key, totals in self.logs.items()]
+        self.rollups = {(guild_id, period, user_id): {'pages': pages, 'time': time}
+                        for guild_id, period, user_id, pages, time in rollup_rows(rows)}
+
+    async def add_events(self, rows):
+        for guild_id, user_id, at, kind, amount in rows:
+            self.last_event += 1
+            self.events[(guild_id, user_id, self.last_event)] = (at, kind, amount)
@@ -0,0 +1,343 @@
+from contextlib import asynccontextmanager
+from datetime import datetime
+import asyncio
+import logging
+import time
+import aiomysql
+import metrics
+from migrations import ROLLUP_BACKFILL
+from storage.base import (Storage, EXPORT_TABLES, TABLE_KEYS, apply_claim, board_query, log_periods,
+                          is_month, month_start, rollup_rows, full_rows)
+
+ER_BAD_DB_ERROR = 1049
+
+
+class MySQLStorage(Storage):
+    '''MySQL backend on top of an aiomysql pool. The pool runs in autocommit
+    mode so plain reads never hold a transaction open, and writes that need
+    one call begin() explicitly.'''
+    def __init__(self, database):
+        self.database = database
+        self.pool = None
+
+    async def start(self):
+        '''Bootstraps the schema while the pool connects. On a first run the
+        database does not exist yet, so the pool is retried once bootstrap has
+        created it. The replica, if any, is connected once the schema is up
+        to date'''
+        bootstrap = asyncio.create_task(self.database.bootstrap_db())
+        try:
+            self.pool = await self.database.create_pool()
+        except aiomysql.OperationalError as e:
+            if e.args[0] != ER_BAD_DB_ERROR:
+                bootstrap.cancel()
+                raise
+            await bootstrap
+            self.pool = await self.database.create_pool()
+        except Exception:
+            bootstrap.cancel()
+            raise
+        await bootstrap
+        await self.database.create_replica_pool()
+
+    async def close(self):
+        await self.database.close()
+
+    def pool_stats(self):
+        stats = {}
+        for name, pool in (('primary', self.pool), ('replica', self.database.replica_pool)):
+            if pool is not None:
+                stats[(name, 'in_use')] = pool.size - pool.freesize
+                stats[(name, 'idle')] = pool.freesize
+                stats[(name, 'max')] = pool.maxsize
+        return stats or None
+
+    @asynccontextmanager
+    async def acquire(self, read=False):
+        '''Checks a connection out of the pool, recording how long it took.
+        Reads that can tolerate replication lag pass read=True to use the
+        replica while it is healthy. If it cannot hand out a connection the
+        read falls back to the primary'''
+        pool = self.database.read_pool() if read else self.pool
+        name = 'replica' if pool is not self.pool else 'primary'
+        start = time.perf_counter()
+        try:
+            conn = await pool.acquire()
+        except Exception as e:
+            if pool is self.pool:
+                raise
+            logging.warning(f'Could not read from the MySQL replica, falling back to the primary - {e}')
+            self.database.replica_failed()
+            pool, name = self.pool, 'primary'
+            conn = await pool.acquire()
+        metrics.POOL_WAIT_SECONDS.observe(time.perf_counter() - start, name)
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+
+    async def claim_daily(self, guild_id, user_id, username, discriminator, curr_time, cooldown, timeout):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await conn.begin()
+                try:
+                    query = '''SELECT daily_claimed, streak, personal_best,
+                            current_year_streak, current_year_best FROM users
+                            WHERE guild_id = %s AND user_id = %s FOR UPDATE'''
+                    await cur.execute(query, (guild_id, user_id,))
+                    row = await cur.fetchone()
+                    response = apply_claim(row, curr_time, cooldown, timeout)
+                    if response['status'] == 'on_cooldown':
+                        await conn.rollback()
+                        return response
+
+                    if row is None:
+                        query = '''INSERT INTO users (guild_id, user_id, username, discriminator,
+                                daily_claimed, streak, personal_best, current_year_streak,
+                                current_year_best) VALUES (%s, %s, %s, %s, %s, 1, 1, 1, 1)
+                                ON DUPLICATE KEY UPDATE user_id = user_id'''
+                        await cur.execute(query, (guild_id, user_id, username, discriminator, curr_time,))
+                        if cur.rowcount != 1:
+                            # Lost a race against a concurrent first claim by the same user
+                            await conn.rollback()
+                            return {'status': 'on_cooldown', 'cooldown': cooldown}
+                        response['created'] = True
+                    else:
+                        query = '''UPDATE users SET daily_claimed = %s, streak = %s,
+                                personal_best = %s, current_year_streak = %s,
+                                current_year_best = %s WHERE guild_id = %s AND user_id = %s'''
+                        await cur.execute(query, (curr_time, response['streak'],
+                                                  response['personal_best'],
+                                                  response['current_year_streak'],
+                                                  response['current_year_best'], guild_id, user_id,))
+                    await conn.commit()
+                    return response
+                except Exception:
+                    await conn.rollback()
+                    raise
+
+    async def get_user_pb(self, guild_id, user_id, year):
+        async with self.acquire(read=True) as conn:
+            async with conn.cursor() as cur:
+                if year == 0:
+                    query = 'SELECT personal_best FROM users WHERE guild_id = %s AND user_id = %s'
+                    await cur.execute(query, (guild_id, user_id,))
+                elif year == datetime.now().year:
+                    query = '''SELECT current_year_best FROM users WHERE guild_id = %s
+                            AND user_id = %s AND daily_claimed >= %s'''
+                    await cur.execute(query, (guild_id, user_id, datetime(year, 1, 1),))
+                else:
+                    query = '''SELECT past_pb FROM streak_history WHERE guild_id = %s
+                            AND user_id = %s AND year = %s'''
+                    await cur.execute(query, (guild_id, user_id, year,))
+                results = await cur.fetchone()
+                return results[0] if results is not None else None
+
+    async def query_board(self, key, after, limit, cutoff, primary=False):
+        query, params = board_query(key, after, limit, cutoff)
+        async with self.acquire(read=not primary) as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, params)
+                return await cur.fetchall()
+
+    async def rollover_done(self, year):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                query = 'SELECT year FROM rollover_log WHERE year = %s'
+                await cur.execute(query, (year,))
+                return await cur.fetchone() is not None
+
+    async def rollover_batch(self, year, after_id, batch_size):
+        boundary = datetime(year, 1, 1)
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await conn.begin()
+                try:
+                    query = '''SELECT user_id FROM users WHERE user_id > %s
+                            ORDER BY user_id LIMIT %s'''
+                    await cur.execute(query, (after_id, batch_size,))
+                    results = await cur.fetchall()
+                    if not results:
+                        await conn.rollback()
+                        return None
+                    first_id, last_id = results[0][0], results[-1][0]
+
+                    query = '''INSERT INTO streak_history (guild_id, user_id, year, past_pb)
+                            SELECT guild_id, user_id, YEAR(daily_claimed), current_year_best
+                            FROM users WHERE user_id BETWEEN %s AND %s AND
+                            daily_claimed < %s AND current_year_best > 0
+                            ON DUPLICATE KEY UPDATE streak_history.past_pb =
+                            GREATEST(streak_history.past_pb, users.current_year_best)'''
+                    await cur.execute(query, (first_id, last_id, boundary,))
+                    query = '''UPDATE users SET current_year_best = 0,
+                            current_year_streak = 0 WHERE user_id BETWEEN %s AND %s
+                            AND daily_claimed < %s AND (current_year_best > 0
+                            OR current_year_streak > 0)'''
+                    await cur.execute(query, (first_id, last_id, boundary,))
+                    await conn.commit()
+                    return last_id
+                except Exception:
+                    await conn.rollback()
+                    raise
+
+    async def mark_rollover(self, year, completed):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                query = '''INSERT INTO rollover_log (year, completed) VALUES (%s, %s)
+                        ON DUPLICATE KEY UPDATE completed = VALUES(completed)'''
+                await cur.execute(query, (year, completed,))
+
+    async def timeout_streaks(self, cutoff, batch_size):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                query = '''UPDATE users SET streak = 0 WHERE
+                        daily_claimed < %s AND streak > 0 LIMIT %s'''
+                await cur.execute(query, (cutoff, batch_size,))
+                return cur.rowcount
+
+    async def add_log(self, guild_id, user_id, month, type, amount):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await conn.begin()
+                try:
+                    query = f'''INSERT INTO logs (guild_id, user_id, month, {type})
+                            VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE {type} = {type} + %s'''
+                    await cur.execute(query, (guild_id, user_id, month_start(month), amount, amount,))
+                    query = f'''INSERT INTO log_rollups (guild_id, period, user_id, {type}) VALUES
+                            (%s, %s, %s, %s), (%s, %s, %s, %s), (%s, %s, %s, %s)
+                            ON DUPLICATE KEY UPDATE {type} = {type} + VALUES({type})'''
+                    await cur.execute(query, [value for period in log_periods(month)
+                                              for value in (guild_id, period, user_id, amount)])
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+                return await self.fetch_user_logs(cur, guild_id, user_id, month, type)
+
+    async def add_logs(self, rows):
+        rollups = rollup_rows(rows)
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await conn.begin()
+                try:
+                    query = f'''INSERT INTO logs (guild_id, user_id, month, pages, time) VALUES
+                            {", ".join(["(%s, %s, %s, %s, %s)"] * len(rows))}
+                            ON DUPLICATE KEY UPDATE pages = pages + VALUES(pages),
+                            time = time + VALUES(time)'''
+                    await cur.execute(query, [value for guild_id, user_id, month, pages, time in rows
+                                              for value in (guild_id, user_id, month_start(month), pages, time)])
+                    query = f'''INSERT INTO log_rollups (guild_id, period, user_id, pages, time) VALUES
+                            {", ".join(["(%s, %s, %s, %s, %s)"] * len(rollups))}
+                            ON DUPLICATE KEY UPDATE pages = pages + VALUES(pages),
+                            time = time + VALUES(time)'''
+                    await cur.execute(query, [value for row in rollups for value in row])
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+
+    async def get_user_log(self, guild_id, user_id, period, type, primary=False):
+        if is_month(period):
+            query = f'SELECT {type} FROM logs WHERE guild_id = %s AND user_id = %s AND month = %s'
+            params = (guild_id, user_id, month_start(period),)
+        else:
+            query = f'SELECT {type} FROM log_rollups WHERE guild_id = %s AND period = %s AND user_id = %s'
+            params = (guild_id, period, user_id,)
+        async with self.acquire(read=not primary) as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, params)
+                results = await cur.fetchone()
+                return results[0] if results is not None else None
+
+    async def get_user_logs(self, guild_id, user_id, month, type, primary=False):
+        async with self.acquire(read=not primary) as conn:
+            async with conn.cursor() as cur:
+                return await self.fetch_user_logs(cur, guild_id, user_id, month, type)
+
+    async def get_periods(self, guild_id):
+        async with self.acquire(read=True) as conn:
+            async with conn.cursor() as cur:
+                await cur.execute('SELECT DISTINCT year FROM streak_history WHERE guild_id = %s', (guild_id,))
+                years = [row[0] for row in await cur.fetchall()]
+                await cur.execute('SELECT DISTINCT month FROM logs WHERE guild_id = %s', (guild_id,))
+                months = [row[0].strftime('%Y-%m') for row in await cur.fetchall()]
+        return years, months
+
+    async def fetch_user_logs(self, cur, guild_id, user_id, month, type):
+        query = f'''SELECT %s, {type} FROM logs WHERE guild_id = %s AND user_id = %s AND month = %s
+                UNION ALL SELECT period, {type} FROM log_rollups WHERE guild_id = %s
+                AND period IN (%s, %s, %s) AND user_id = %s'''
+        await cur.execute(query, (month, guild_id, user_id, month_start(month), guild_id,
+                                  *log_periods(month), user_id,))
+        return dict(await cur.fetchall())
+
+    async def load_reminders(self):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute('SELECT guild_id, user_id, channel_id, due FROM reminders')
+                return await cur.fetchall()
+
+    async def save_reminder(self, guild_id, user_id, channel_id, due):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                query = '''INSERT INTO reminders (guild_id, user_id, channel_id, due)
+                        VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE
+                        channel_id = VALUES(channel_id), due = VALUES(due)'''
+                await cur.execute(query, (guild_id, user_id, channel_id, due,))
+
+    async def delete_reminders(self, keys):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                query = f'''DELETE FROM reminders WHERE (guild_id, user_id) IN
+                        ({", ".join(["(%s, %s)"] * len(keys))})'''
+                await cur.execute(query, [value for key in keys for value in key])
+
+    async def export_rows(self, table, batch_size):
+        '''Reads the table through an unbuffered server-side cursor, so only
+        one batch at a time is ever held in memory'''
+        columns = EXPORT_TABLES[table]
+        query = f'''SELECT {", ".join(columns)} FROM {table}
+                ORDER BY {", ".join(columns[:TABLE_KEYS[table]])}'''
+        month = columns.index('month') if 'month' in columns else None
+        async with self.acquire(read=True) as conn:
+            async with conn.cursor(aiomysql.SSCursor) as cur:
+                await cur.execute(query)
+                while rows := await cur.fetchmany(batch_size):
+                    if month is not None:
+                        rows = [row[:month] + (row[month].strftime('%Y-%m'),) + row[month + 1:]
+                                for row in rows]
+                    yield list(rows)
+
+    async def import_rows(self, table, rows, columns=None):
+        update = (columns or EXPORT_TABLES[table])[TABLE_KEYS[table]:]
+        rows = full_rows(table, rows, columns)
+        columns = EXPORT_TABLES[table]
+        if 'month' in columns:
+            month = columns.index('month')
+            rows = [row[:month] + (month_start(row[month]),) + row[month + 1:] for row in rows]
+        query = f'''INSERT INTO {table} ({", ".join(columns)}) VALUES
+                {", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * len(rows))}
+                ON DUPLICATE KEY UPDATE {", ".join(f"{column} = VALUES({column})" for column in update)}'''
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, [value for row in rows for value in row])
+
+    async def rebuild_rollups(self):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await conn.begin()
+                try:
+                    await cur.execute('DELETE FROM log_rollups')
+                    for statement in ROLLUP_BACKFILL:
+                        await cur.execute(statement)
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+
+    async def add_events(self, rows):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                query = f'''INSERT INTO events (guild_id, user_id, at, kind, amount) VALUES
+                        {", ".join(["(%s, %s, %s, %s, %s)"] * len(rows))}'''
+                await cur.execute(query, [value for row in rows for value in row])
@@ -0,0 +1,512 @@
+from datetime import datetime, date
+import asyncio
+import logging
+import aiosqlite
+from storage.base import (Storage, EXPORT_TABLES, TABLE_KEYS, apply_claim, board_query, log_periods,
+                          is_month, month_start, rollup_rows, full_rows)
+
+# Fills log_rollups from logs, used when the table is created and again to
+# rebuild it after logs are imported
+ROLLUP_BACKFILL = [
+    '''INSERT INTO log_rollups (guild_id, period, user_id, time, pages)
+        SELECT guild_id, substr(month, 1, 4), user_id, SUM(time), SUM(pages) FROM logs
+        GROUP BY guild_id, substr(month, 1, 4), user_id''',
+    '''INSERT INTO log_rollups (guild_id, period, user_id, time, pages)
+        SELECT guild_id, substr(month, 1, 4) || '-Q' || ((CAST(substr(month, 6, 2) AS INTEGER) + 2) / 3),
+        user_id, SUM(time), SUM(pages) FROM logs
+        GROUP BY guild_id, substr(month, 1, 4), (CAST(substr(month, 6, 2) AS INTEGER) + 2) / 3, user_id''',
+    '''INSERT INTO log_rollups (guild_id, period, user_id, time, pages)
+        SELECT guild_id, 'all', user_id, SUM(time), SUM(pages) FROM logs
+        GROUP BY guild_id, user_id''',
+]
+
+# Ordered (version, statements) schema steps, tracked in PRAGMA user_version.
+# Each step runs in one transaction, SQLite DDL being transactional.
+MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER NOT NULL PRIMARY KEY,
+            username TEXT NOT NULL,
+            discriminator INTEGER NOT NULL,
+            daily_claimed TEXT,
+            streak INTEGER DEFAULT 0,
+            personal_best INTEGER DEFAULT 0,
+            current_year_best INTEGER DEFAULT 0,
+            current_year_streak INTEGER DEFAULT 0
+        )''',
+        '''CREATE TABLE IF NOT EXISTS logs (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            time INTEGER DEFAULT 0,
+            pages INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, month)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS streak_history (
+            user_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            past_pb INTEGER NOT NULL,
+            PRIMARY KEY (user_id, year)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS rollover_log (
+            year INTEGER NOT NULL PRIMARY KEY,
+            completed TEXT NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS reminders (
+            user_id INTEGER NOT NULL PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            due TEXT NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_users_daily_claimed ON users (daily_claimed)',
+    ]),
+    (2, [
+        # SQLite cannot change a primary key in place, so each table is
+        # rebuilt with guild_id leading and existing rows moved to guild 0
+        'DROP INDEX IF EXISTS idx_users_streak',
+        'DROP INDEX IF EXISTS idx_users_year_streak',
+        'DROP INDEX IF EXISTS idx_users_personal_best',
+        'DROP INDEX IF EXISTS idx_users_year_best',
+        'DROP INDEX IF EXISTS idx_users_daily_claimed',
+        'DROP INDEX IF EXISTS idx_history_year_pb',
+        'DROP INDEX IF EXISTS idx_logs_month_pages',
+        'DROP INDEX IF EXISTS idx_logs_month_time',
+        'ALTER TABLE users RENAME TO users_old',
+        '''CREATE TABLE users (
+            guild_id INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            discriminator INTEGER NOT NULL,
+            daily_claimed TEXT,
+            streak INTEGER DEFAULT 0,
+            personal_best INTEGER DEFAULT 0,
+            current_year_best INTEGER DEFAULT 0,
+            current_year_streak INTEGER DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id)
+        )''',
+        '''INSERT INTO users (guild_id, user_id, username, discriminator, daily_claimed,
+            streak, personal_best, current_year_best, current_year_streak)
+            SELECT 0, user_id, username, discriminator, daily_claimed, streak,
+            personal_best, current_year_best, current_year_streak FROM users_old''',
+        'DROP TABLE users_old',
+        'ALTER TABLE logs RENAME TO logs_old',
+        '''CREATE TABLE logs (
+            guild_id INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            time INTEGER DEFAULT 0,
+            pages INTEGER DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id, month)
+        )''',
+        '''INSERT INTO logs (guild_id, user_id, month, time, pages)
+            SELECT 0, user_id, month, time, pages FROM logs_old''',
+        'DROP TABLE logs_old',
+        'ALTER TABLE streak_history RENAME TO streak_history_old',
+        '''CREATE TABLE streak_history (
+            guild_id INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            past_pb INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id, year)
+        )''',
+        '''INSERT INTO streak_history (guild_id, user_id, year, past_pb)
+            SELECT 0, user_id, year, past_pb FROM streak_history_old''',
+        'DROP TABLE streak_history_old',
+        'ALTER TABLE reminders RENAME TO reminders_old',
+        '''CREATE TABLE reminders (
+            guild_id INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            due TEXT NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        )''',
+        '''INSERT INTO reminders (guild_id, user_id, channel_id, due)
+            SELECT 0, user_id, channel_id, due FROM reminders_old''',
+        'DROP TABLE reminders_old',
+        'CREATE INDEX idx_users_user ON users (user_id)',
+        'CREATE INDEX idx_users_daily_claimed ON users (daily_claimed)',
+        'CREATE INDEX idx_users_guild_streak ON users (guild_id, streak DESC, user_id, daily_claimed)',
+        'CREATE INDEX idx_users_guild_year_streak ON users (guild_id, current_year_streak DESC, user_id)',
+        'CREATE INDEX idx_users_guild_personal_best ON users (guild_id, personal_best DESC, user_id)',
+        'CREATE INDEX idx_users_guild_year_best ON users (guild_id, current_year_best DESC, user_id, daily_claimed)',
+        'CREATE INDEX idx_history_guild_year_pb ON streak_history (guild_id, year, past_pb DESC, user_id)',
+        'CREATE INDEX idx_logs_guild_month_pages ON logs (guild_id, month, pages DESC, user_id)',
+        'CREATE INDEX idx_logs_guild_month_time ON logs (guild_id, month, time DESC, user_id)',
+    ]),
+    (3, [
+        # MM-YYYY months become the ISO date of the first day of the month
+        """UPDATE logs SET month = substr(month, 4, 4) || '-' || substr(month, 1, 2) || '-01'
+            WHERE month LIKE '__-____'""",
+        '''CREATE TABLE log_rollups (
+            guild_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            time INTEGER DEFAULT 0,
+            pages INTEGER DEFAULT 0,
+            PRIMARY KEY (guild_id, period, user_id)
+        )''',
+        'CREATE INDEX idx_rollups_pages ON log_rollups (guild_id, period, pages DESC, user_id)',
+        'CREATE INDEX idx_rollups_time ON log_rollups (guild_id, period, time DESC, user_id)',
+        *ROLLUP_BACKFILL,
+    ]),
+    (4, [
+        '''CREATE TABLE events (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            at TEXT,
+            kind INTEGER NOT NULL,
+            amount INTEGER NOT NULL DEFAULT 0
+        )''',
+        'CREATE INDEX idx_events_user ON events (guild_id, user_id, id)',
+        # Baseline events for everything recorded before the log existed,
+        # as in the MySQL migration
+        '''INSERT INTO events (guild_id, user_id, at, kind, amount)
+            SELECT guild_id, user_id, daily_claimed, 4, streak FROM users''',
+        '''INSERT INTO events (guild_id, user_id, at, kind, amount)
+            SELECT guild_id, user_id, daily_claimed, 5, personal_best FROM users''',
+        '''INSERT INTO events (guild_id, user_id, at, kind, amount)
+            SELECT guild_id, user_id, daily_claimed, 6, current_year_streak FROM users''',
+        '''INSERT INTO events (guild_id, user_id, at, kind, amount)
+            SELECT guild_id, user_id, daily_claimed, 7, current_year_best FROM users''',
+        '''INSERT INTO events (guild_id, user_id, at, kind, amount)
+            SELECT guild_id, user_id, year || '-01-01 00:00:00', 8, past_pb FROM streak_history''',
+        '''INSERT INTO events (guild_id, user_id, at, kind, amount)
+            SELECT guild_id, user_id, month || ' 00:00:00', 2, pages FROM logs WHERE pages != 0''',
+        '''INSERT INTO events (guild_id, user_id, at, kind, amount)
+            SELECT guild_id, user_id, month || ' 00:00:00', 3, time FROM logs WHERE time != 0''',
+    ]),
+]
+
+
+def to_db(value):
+    '''Datetimes and dates are stored as sortable ISO text'''
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def from_db(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def from_export(column, value):
+    '''Converts a stored value to the form export_rows hands out'''
+    if column in ('daily_claimed', 'at'):
+        return from_db(value)
+    if column == 'month':
+        return value[:7]
+    return value
+
+
+def to_export(column, value):
+    if column == 'month':
+        return to_db(month_start(value))
+    return to_db(value)
+
+
+class SQLiteStorage(Storage):
+    '''Embedded SQLite backend for small guilds and local benchmarking. A
+    single connection is shared, so write transactions are serialised with a
+    lock to keep them from interleaving. Reads take the same lock, as on a
+    shared connection they would otherwise see the rows of a transaction
+    that has not committed yet and may still roll back.'''
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.lock = asyncio.Lock()
+
+    async def start(self):
+        self.conn = await aiosqlite.connect(self.path, isolation_level=None)
+        await self.conn.execute('PRAGMA journal_mode=WAL')
+        await self.conn.execute('PRAGMA synchronous=NORMAL')
+        await self.migrate()
+
+    async def migrate(self):
+        '''Brings the schema up to the latest version'''
+        current = (await self.fetchone('PRAGMA user_version'))[0]
+        for version, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            await self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for statement in statements:
+                    await self.conn.execute(statement)
+                await self.conn.execute(f'PRAGMA user_version = {version}')
+                await self.conn.commit()
+            except Exception:
+                await self.conn.rollback()
+                raise
+            logging.info(f'SQLite schema is at version {version}')
+
+    async def close(self):
+        if self.conn is not None:
+            await self.conn.close()
+
+    async def fetchone(self, query, params=()):
+        async with self.conn.execute(query, [to_db(param) for param in params]) as cur:
+            return await cur.fetchone()
+
+    async def fetchall(self, query, params=()):
+        async with self.conn.execute(query, [to_db(param) for param in params]) as cur:
+            return await cur.fetchall()
+
+    async def execute(self, query, params=()):
+        async with self.conn.execute(query, [to_db(param) for param in params]) as cur:
+            return cur.rowcount
+
+    async def read_one(self, query, params=()):
+        '''fetchone for reads outside a transaction'''
+        async with self.lock:
+            return await self.fetchone(query, params)
+
+    async def read_all(self, query, params=()):
+        '''fetchall for reads outside a transaction'''
+        async with self.lock:
+            return await self.fetchall(query, params)
+
+    async def claim_daily(self, guild_id, user_id, username, discriminator, curr_time, cooldown, timeout):
+        async with self.lock:
+            await self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                query = '''SELECT daily_claimed, streak, personal_best,
+                        current_year_streak, current_year_best FROM users
+                        WHERE guild_id = ? AND user_id = ?'''
+                row = await self.fetchone(query, (guild_id, user_id,))
+                if row is not None:
+                    row = (from_db(row[0]),) + tuple(row[1:])
+                response = apply_claim(row, curr_time, cooldown, timeout)
+                if response['status'] == 'on_cooldown':
+                    await self.conn.rollback()
+                    return response
+
+                if row is None:
+                    query = '''INSERT INTO users (guild_id, user_id, username, discriminator,
+                            daily_claimed, streak, personal_best, current_year_streak,
+                            current_year_best) VALUES (?, ?, ?, ?, ?, 1, 1, 1, 1)'''
+                    await self.execute(query, (guild_id, user_id, username, discriminator, curr_time,))
+                    response['created'] = True
+                else:
+                    query = '''UPDATE users SET daily_claimed = ?, streak = ?,
+                            personal_best = ?, current_year_streak = ?,
+                            current_year_best = ? WHERE guild_id = ? AND user_id = ?'''
+                    await self.execute(query, (curr_time, response['streak'],
+                                               response['personal_best'],
+                                               response['current_year_streak'],
+                                               response['current_year_best'], guild_id, user_id,))
+                await self.conn.commit()
+                return response
+            except Exception:
+                await self.conn.rollback()
+                raise
+
+    async def get_user_pb(self, guild_id, user_id, year):
+        if year == 0:
+            query = 'SELECT personal_best FROM users WHERE guild_id = ? AND user_id = ?'
+            results = await self.read_one(query, (guild_id, user_id,))
+        elif year == datetime.now().year:
+            query = '''SELECT current_year_best FROM users WHERE guild_id = ?
+                    AND user_id = ? AND daily_claimed >= ?'''
+            results = await self.read_one(query, (guild_id, user_id, datetime(year, 1, 1),))
+        else:
+            query = '''SELECT past_pb FROM streak_history WHERE guild_id = ?
+                    AND user_id = ? AND year = ?'''
+            results = await self.read_one(query, (guild_id, user_id, year,))
+        return results[0] if results is not None else None
+
+    async def query_board(self, key, after, limit, cutoff, primary=False):
+        query, params = board_query(key, after, limit, cutoff)
+        results = await self.read_all(query.replace('%s', '?'), params)
+        if key[1:] == ('overall',):
+            return [(user_id, streak, from_db(claimed)) for user_id, streak, claimed in results]
+        return [tuple(row) for row in results]
+
+    async def rollover_done(self, year):
+        query = 'SELECT year FROM rollover_log WHERE year = ?'
+        return await self.read_one(query, (year,)) is not None
+
+    async def rollover_batch(self, year, after_id, batch_size):
+        boundary = datetime(year, 1, 1)
+        async with self.lock:
+            await self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                query = 'SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?'
+                results = await self.fetchall(query, (after_id, batch_size,))
+                if not results:
+                    await self.conn.rollback()
+                    return None
+                first_id, last_id = results[0][0], results[-1][0]
+
+                query = '''INSERT INTO streak_history (guild_id, user_id, year, past_pb)
+                        SELECT guild_id, user_id, CAST(substr(daily_claimed, 1, 4) AS INTEGER),
+                        current_year_best FROM users WHERE user_id BETWEEN ? AND ?
+                        AND daily_claimed < ? AND current_year_best > 0
+                        ON CONFLICT (guild_id, user_id, year) DO UPDATE SET
+                        past_pb = MAX(past_pb, excluded.past_pb)'''
+                await self.execute(query, (first_id, last_id, boundary,))
+                query = '''UPDATE users SET current_year_best = 0,
+                        current_year_streak = 0 WHERE user_id BETWEEN ? AND ?
+                        AND daily_claimed < ? AND (current_year_best > 0
+                        OR current_year_streak > 0)'''
+                await self.execute(query, (first_id, last_id, boundary,))
+                await self.conn.commit()
+                return last_id
+            except Exception:
+                await self.conn.rollback()
+                raise
+
+    async def mark_rollover(self, year, completed):
+        query = '''INSERT INTO rollover_log (year, completed) VALUES (?, ?)
+                ON CONFLICT (year) DO UPDATE SET completed = excluded.completed'''
+        async with self.lock:
+            await self.execute(query, (year, completed,))
+
+    async def timeout_streaks(self, cutoff, batch_size):
+        # rowid rather than user_id, which is shared by a user's rows in
+        # every guild partition
+        query = '''UPDATE users SET streak = 0 WHERE rowid IN
+                (SELECT rowid FROM users WHERE daily_claimed < ? AND streak > 0 LIMIT ?)'''
+        async with self.lock:
+            return await self.execute(query, (cutoff, batch_size,))
+
+    async def add_log(self, guild_id, user_id, month, type, amount):
+        async with self.lock:
+            await self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                query = f'''INSERT INTO logs (guild_id, user_id, month, {type}) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (guild_id, user_id, month) DO UPDATE SET {type} = {type} + excluded.{type}'''
+                await self.execute(query, (guild_id, user_id, month_start(month), amount,))
+                query = f'''INSERT INTO log_rollups (guild_id, period, user_id, {type}) VALUES
+                        (?, ?, ?, ?), (?, ?, ?, ?), (?, ?, ?, ?)
+                        ON CONFLICT (guild_id, period, user_id) DO UPDATE SET {type} = {type} + excluded.{type}'''
+                await self.execute(query, [value for period in log_periods(month)
+                                           for value in (guild_id, period, user_id, amount)])
+                totals = await self.fetch_user_logs(guild_id, user_id, month, type)
+                await self.conn.commit()
+                return totals
+            except Exception:
+                await self.conn.rollback()
+                raise
+
+    async def add_logs(self, rows):
+        query = '''INSERT INTO logs (guild_id, user_id, month, pages, time) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (guild_id, user_id, month) DO UPDATE SET
+                pages = pages + excluded.pages, time = time + excluded.time'''
+        rollup_query = '''INSERT INTO log_rollups (guild_id, period, user_id, pages, time)
+                VALUES (?, ?, ?, ?, ?) ON CONFLICT (guild_id, period, user_id) DO UPDATE SET
+                pages = pages + excluded.pages, time = time + excluded.time'''
+        async with self.lock:
+            await self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                await self.conn.executemany(query, [(guild_id, user_id, to_db(month_start(month)), pages, time)
+                                                    for guild_id, user_id, month, pages, time in rows])
+                await self.conn.executemany(rollup_query, rollup_rows(rows))
+                await self.conn.commit()
+            except Exception:
+                await self.conn.rollback()
+                raise
+
+    async def get_user_log(self, guild_id, user_id, period, type, primary=False):
+        if is_month(period):
+            query = f'SELECT {type} FROM logs WHERE guild_id = ? AND user_id = ? AND month = ?'
+            results = await self.read_one(query, (guild_id, user_id, month_start(period),))
+        else:
+            query = f'SELECT {type} FROM log_rollups WHERE guild_id = ? AND period = ? AND user_id = ?'
+            results = await self.read_one(query, (guild_id, period, user_id,))
+        return results[0] if results is not None else None
+
+    async def get_user_logs(self, guild_id, user_id, month, type, primary=False):
+        async with self.lock:
+            return await self.fetch_user_logs(guild_id, user_id, month, type)
+
+    async def fetch_user_logs(self, guild_id, user_id, month, type):
+        query = f'''SELECT ?, {type} FROM logs WHERE guild_id = ? AND user_id = ? AND month = ?
+                UNION ALL SELECT period, {type} FROM log_rollups WHERE guild_id = ?
+                AND period IN (?, ?, ?) AND user_id = ?'''
+        results = await self.fetchall(query, (month, guild_id, user_id, month_start(month), guild_id,
+                                              *log_periods(month), user_id,))
+        return dict(results)
+
+    async def get_periods(self, guild_id):
+        years = await self.read_all('SELECT DISTINCT year FROM streak_history WHERE guild_id = ?', (guild_id,))
+        months = await self.read_all('SELECT DISTINCT substr(month, 1, 7) FROM logs WHERE guild_id = ?', (guild_id,))
+        return [row[0] for row in years], [row[0] for row in months]
+
+    async def load_reminders(self):
+        results = await self.read_all('SELECT guild_id, user_id, channel_id, due FROM reminders')
+        return [(guild_id, user_id, channel_id, from_db(due))
+                for guild_id, user_id, channel_id, due in results]
+
+    async def save_reminder(self, guild_id, user_id, channel_id, due):
+        query = '''INSERT INTO reminders (guild_id, user_id, channel_id, due) VALUES (?, ?, ?, ?)
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET channel_id = excluded.channel_id,
+                due = excluded.due'''
+        async with self.lock:
+            await self.execute(query, (guild_id, user_id, channel_id, due,))
+
+    async def delete_reminders(self, keys):
+        query = f'DELETE FROM reminders WHERE (guild_id, user_id) IN ({", ".join(["(?, ?)"] * len(keys))})'
+        async with self.lock:
+            await self.execute(query, [value for key in keys for value in key])
+
+    async def export_rows(self, table, batch_size):
+        columns = EXPORT_TABLES[table]
+        query = f'''SELECT {", ".join(columns)} FROM {table}
+                ORDER BY {", ".join(columns[:TABLE_KEYS[table]])}'''
+        # The lock is only held while a batch is fetched, never while the
+        # caller has it, which may well be writing
+        async with self.lock:
+            cur = await self.conn.execute(query)
+        try:
+            while True:
+                async with self.lock:
+                    rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [tuple(from_export(column, value) for column, value in zip(columns, row))
+                       for row in rows]
+        finally:
+            await cur.close()
+
+    async def import_rows(self, table, rows, columns=None):
+        query = f'''INSERT OR REPLACE INTO {table} ({", ".join(EXPORT_TABLES[table])})
+                VALUES ({", ".join(["?"] * len(EXPORT_TABLES[table]))})'''
+        if columns is not None:
+            keys = EXPORT_TABLES[table][:TABLE_KEYS[table]]
+            query = query.replace('INSERT OR REPLACE', 'INSERT') + f'''
+                    ON CONFLICT ({", ".join(keys)}) DO UPDATE SET
+                    {", ".join(f"{column} = excluded.{column}" for column in columns[len(keys):])}'''
+        rows = full_rows(table, rows, columns)
+        columns = EXPORT_TABLES[table]
+        async with self.lock:
+            await self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                await self.conn.executemany(query, [[to_export(column, value) for column, value in zip(columns, row)]
+                                                    for row in rows])
+                await self.conn.commit()
+            except Exception:
+                await self.conn.rollback()
+                raise
+
+    async def rebuild_rollups(self):
+        async with self.lock:
+            await self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                await self.conn.execute('DELETE FROM log_rollups')
+                for statement in ROLLUP_BACKFILL:
+                    await self.conn.execute(statement)
+                await self.conn.commit()
+            except Exception:
+                await self.conn.rollback()
+                raise
+
+    async def add_events(self, rows):
+        query = 'INSERT INTO events (guild_id, user_id, at, kind, amount) VALUES (?, ?, ?, ?, ?)'
+        async with self.lock:
+            await self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                await self.conn.executemany(query, [[to_db(value) for value in row] for row in rows])
+                await self.conn.commit()
+            except Exception:
+                await self.conn.rollback()
+                raise
@@ -0,0 +1,317 @@
+import discord
+from discord.ext import commands
+import logging
+import sys
+import asyncio
+import time
+from datetime import datetime, timedelta
+from storage import create_storage
+from cache import LeaderboardCache, ClaimCache, EmbedCache, SingleFlight
+from ranks import RankIndex
+from periods import PeriodIndex
+from events import EventWriter
+from profiler import SamplingProfiler
+from runtime import LoopMonitor
+from outbox import Outbox, OutboxContext
+import metrics
+
+class Streakbot(commands.Bot):
+    def __init__(self, config, extensions=(), **kwargs):
+        super(Streakbot, self).__init__(**kwargs)
+        self.initial_extensions = extensions
+        streakcfg = config['Streaks']
+        self.CMD_COOLDOWN = int(streakcfg['Cooldown']) # Cooldown is 23 hours (82800)
+        self.STREAK_TIMEOUT = int(streakcfg['Timeout']) # Timeout after 48 hours (172800)
+        self.REMINDER_THRESHOLD = int(streakcfg['Reminder']) # Threshold for reminders
+        self.PER_GUILD = streakcfg.getboolean('PerGuild', False) # Separate streaks and boards for each guild
+        self.ROLLOVER_BATCH = streakcfg.getint('RolloverBatch', 1000) # Users per rollover transaction
+        self.SWEEP_INTERVAL = streakcfg.getint('SweepInterval', 0) # Seconds between timeout sweeps, 0 disables
+        self.LOG_FLUSH_INTERVAL = config.getint('Logs', 'FlushInterval', fallback=0) # Seconds between log writes, 0 writes immediately
+        self.LOG_BUFFER_SIZE = config.getint('Logs', 'BufferSize', fallback=500) # Buffered users that force an early write
+        self.leaderboards = LeaderboardCache(streakcfg.getint('LeaderboardSize', 25)) # Rows kept per leaderboard
+        self.claims = ClaimCache(streakcfg.getint('ClaimCacheSize', 10000)) # Users whose last claim is kept in memory
+        self.RANK_NEIGHBOURS = streakcfg.getint('RankNeighbours', 2) # Places shown either side of a user's rank
+        self.RANK_LOAD_BATCH = streakcfg.getint('RankLoadBatch', 5000) # Rows per query while loading the rank index
+        self.ranks = RankIndex()
+        self.embeds = EmbedCache(streakcfg.getint('EmbedCacheSize', 256), # Rendered leaderboard pages kept
+                                 streakcfg.getint('EmbedCacheTTL', 300)) # Seconds before a page picks up renamed users
+        self.members_versions = {} # Bumped per partition as members join and leave
+        self.rank_loads = SingleFlight('rank_load')
+        self.board_queries = SingleFlight('query_board')
+        self.periods = PeriodIndex()
+        self.period_loads = SingleFlight('period_load')
+        try:
+            self.storage = metrics.instrument(create_storage(config))
+        except Exception as e:
+            logging.exception(f'Invalid database configuration - {e}')
+            sys.exit(1)
+        self.storage_ready = asyncio.Event()
+        self.events = None
+        if config.getboolean('Events', 'Enabled', fallback=True): # Append claims and logs to the event log
+            self.events = EventWriter(self, config.getint('Events', 'FlushInterval', fallback=5), # Seconds between event writes
+                                      config.getint('Events', 'BufferSize', fallback=1000)) # Queued events that force an early write
+
+        self.outbox = None
+        if config.getboolean('Outbox', 'Enabled', fallback=True): # Queue replies and reminders per channel
+            self.outbox = Outbox(config.getint('Outbox', 'MaxQueue', fallback=50), # Queued messages per channel before senders wait
+                                 config.getint('Outbox', 'MaxMerge', fallback=10)) # Text replies merged into one message
+        self.profiler = SamplingProfiler(config.getfloat('Profiling', 'Interval', fallback=0.005)) # Seconds between stack samples
+        self.PROFILE_MAX_SECONDS = config.getint('Profiling', 'MaxSeconds', fallback=300) # Longest window the profile command takes
+        self.PROFILE_SIGNAL_SECONDS = config.getint('Profiling', 'SignalSeconds', fallback=30) # Window profiled on SIGUSR1
+        self.PROFILE_TOP = config.getint('Profiling', 'Top', fallback=15) # Functions listed in a profile summary
+        self.loop_monitor = None
+        loop_interval = config.getfloat('Runtime', 'LoopCheckInterval', fallback=0.25) # Seconds between loop lag checks, 0 disables
+        if loop_interval > 0:
+            self.loop_monitor = LoopMonitor(loop_interval,
+                                            config.getfloat('Runtime', 'SlowCallback', fallback=0.1)) # Lag in seconds logged as a blocked loop
+
+        metrics_port = config.getint('Metrics', 'Port', fallback=0) # Port for the /metrics endpoint, 0 disables
+        self.metrics_server = None
+        if metrics_port:
+            self.metrics_server = metrics.MetricsServer(config.get('Metrics', 'Host', fallback='127.0.0.1'),
+                                                        metrics_port)
+        metrics.POOL_CONNECTIONS.function = self.storage.pool_stats
+        metrics.GATEWAY_LATENCY.function = lambda: self.latency
+        self.add_listener(self.count_command_error, 'on_command_error')
+        self.add_listener(self.members_changed, 'on_member_join')
+        self.add_listener(self.members_changed, 'on_member_remove')
+
+    async def setup_hook(self):
+        '''Runs once before connecting to the gateway, so reconnects never
+        repeat it. Storage bootstrap and pool warm-up run alongside extension
+        loading, and cogs that touch storage while loading wait on
+        storage_ready'''
+        start = time.perf_counter()
+        if self.loop_monitor is not None:
+            self.loop_monitor.start()
+        await asyncio.gather(self.start_storage(), self.start_metrics(),
+                             *(self.timed_load(extension) for extension in self.initial_extensions))
+        logging.info(f'Startup finished in {time.perf_counter() - start:.2f}s')
+
+    async def start_storage(self):
+        start = time.perf_counter()
+        try:
+            await self.storage.start()
+        except Exception as e:
+            logging.exception(f'Could not start database - {e}')
+            sys.exit(1)
+        self.storage_ready.set()
+        if self.events is not None:
+            self.events.start()
+        logging.info(f'Database ready in {time.perf_counter() - start:.2f}s')
+
+    async def start_metrics(self):
+        if self.metrics_server is not None:
+            try:
+                await self.metrics_server.start()
+            except Exception as e:
+                logging.exception(f'Could not start metrics endpoint - {e}')
+
+    async def timed_load(self, extension):
+        start = time.perf_counter()
+        try:
+            await self.load_extension(extension)
+            logging.info(f'Loaded {extension} in {time.perf_counter() - start:.2f}s')
+        except Exception as e:
+            logging.exception(f'Could not load {extension} - {e}')
+
+    async def close(self):
+        if self.outbox is not None:
+            await self.outbox.close(5)
+        await super().close()
+        if self.loop_monitor is not None:
+            self.loop_monitor.stop()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        if self.events is not None:
+            await self.events.stop()
+        await self.storage.close()
+
+    async def get_context(self, origin, /, *, cls=OutboxContext):
+        return await super().get_context(origin, cls=cls)
+
+    async def process_commands(self, message):
+        start = time.perf_counter()
+        await super().process_commands(message)
+        metrics.MESSAGE_SECONDS.observe(time.perf_counter() - start)
+
+    async def invoke(self, ctx):
+        start = time.perf_counter()
+        await super().invoke(ctx)
+        if ctx.command is not None:
+            metrics.COMMAND_SECONDS.observe(time.perf_counter() - start, ctx.command.qualified_name)
+
+    async def count_command_error(self, ctx, error):
+        command = ctx.command.qualified_name if ctx.command is not None else ''
+        metrics.COMMAND_ERRORS.inc(command, type(error).__name__)
+
+    def guild_key(self, guild):
+        '''Returns the storage partition for a guild. Everything shares
+        partition 0 unless PerGuild is enabled, and DMs always use it'''
+        if self.PER_GUILD and guild is not None:
+            return guild.id
+        return 0
+
+    async def members_changed(self, member):
+        '''Someone joining or leaving changes who is shown on the boards of
+        their guild's partition'''
+        guild_id = self.guild_key(member.guild)
+        self.members_versions[guild_id] = self.members_versions.get(guild_id, 0) + 1
+
+    def board_version(self, key):
+        '''Version of everything a rendered page of a board depends on - the
+        board's own writes and the members shown on it'''
+        return (self.leaderboards.version(key), self.members_versions.get(key[0], 0))
+
+    def resolve_names(self, guild_id, user_ids):
+        '''Looks up a batch of user IDs in the member cache in one pass,
+        returning the users found by ID. With PerGuild a partition only shows
+        the guild's own members, otherwise anyone the bot no longer shares a
+        server with is left out'''
+        if guild_id == 0:
+            lookup = self.get_user
+        else:
+            guild = self.get_guild(guild_id)
+            if guild is None:
+                return {}
+            lookup = guild.get_member
+        names = {}
+        for user_id in user_ids:
+            user = lookup(int(user_id))
+            if user is not None:
+                names[int(user_id)] = user
+        return names
+
+    async def get_board(self, key, after=None, count=None):
+        '''Helper function to get count (user_id, value, expires) rows of a
+        leaderboard after the keyset cursor after, a (value, user_id) pair or
+        None for the top. Users who have left are filtered out here, reading
+        on down the board until the page is full, so pages and rank numbers
+        only ever count members. Membership only lives in Discord's member
+        cache, not the database, so it cannot be part of the query.'''
+        count = self.leaderboards.size if count is None else count
+        results = []
+        while len(results) < count:
+            wanted = count - len(results)
+            rows = await self.fetch_board(key, after, wanted)
+            if rows is False:
+                return False
+            names = self.resolve_names(key[0], (row[0] for row in rows))
+            results.extend(row for row in rows if row[0] in names)
+            if len(rows) < wanted:
+                break
+            after = (rows[-1][1], rows[-1][0])
+        return results
+
+    async def fetch_board(self, key, after, count):
+        '''Gets count rows of a board, served from the leaderboard cache where
+        possible, filling it with the top of the board on a miss, and
+        otherwise fetched with a keyset query.'''
+        results = self.leaderboards.page(key, after, count)
+        if results is not None:
+            return results
+        try:
+            if self.leaderboards.get(key) is None:
+                version = self.leaderboards.version(key)
+                self.leaderboards.fill(key, await self.query_board(key, None, self.leaderboards.size, primary=True), version)
+                results = self.leaderboards.page(key, after, count)
+                if results is not None:
+                    return results
+            results = await self.query_board(key, after, count)
+            return [(int(row[0]), row[1], row[2] if len(row) > 2 else None) for row in results]
+        except Exception as e:
+            logging.exception(f'Unable to get leaderboard {key} - {e}')
+            return False
+
+    async def get_ranks(self, key):
+        '''Returns the rank index for a whole board, loading it from storage
+        the first time it is asked for. Concurrent callers share one load.'''
+        board = self.ranks.get(key)
+        if board is not None:
+            return board
+        return await self.rank_loads.run(key, self.load_ranks, key)
+
+    async def load_ranks(self, key):
+        '''Reads every row of a board into the rank index in keyset pages,
+        the one time the whole board is read'''
+        start = time.perf_counter()
+        board = self.ranks.start(key)
+        try:
+            after = None
+            while True:
+                rows = await self.query_board(key, after, self.RANK_LOAD_BATCH, primary=True)
+                board.load(rows)
+                if len(rows) < self.RANK_LOAD_BATCH:
+                    break
+                after = (rows[-1][1], rows[-1][0])
+            board.complete = True
+            logging.info(f'Loaded {len(board)} rows of {key} into the rank index in {time.perf_counter() - start:.2f}s')
+            board.expire(time.time())
+            return board
+        except Exception as e:
+            logging.exception(f'Unable to load rank index for {key} - {e}')
+            self.ranks.invalidate(key)
+            return None
+
+    async def get_periods(self, guild_id):
+        '''Returns the periods a guild partition has data for, loading them
+        from storage the first time they are asked for. Concurrent callers
+        share one load.'''
+        periods = self.periods.get(guild_id)
+        if periods is not None:
+            return periods
+        return await self.period_loads.run(guild_id, self.load_periods, guild_id)
+
+    async def load_periods(self, guild_id):
+        periods = self.periods.start(guild_id)
+        try:
+            periods.load(*await self.storage.get_periods(guild_id))
+            periods.complete = True
+            return periods
+        except Exception as e:
+            logging.exception(f'Unable to load periods for guild {guild_id} - {e}')
+            self.periods.invalidate(guild_id)
+            return None
+
+    async def query_board(self, key, after, limit, primary=False):
+        '''Fetches board rows from storage. Identical queries that arrive
+        while one is in flight share its result, so a burst of people asking
+        for the same board costs one query. Queries are matched on the
+        board's write version as well, so nobody is handed rows read before a
+        write they have already seen.'''
+        return await self.board_queries.run((key, after, limit, primary, self.leaderboards.version(key)),
+                                            self.read_board, key, after, limit, primary)
+
+    async def read_board(self, key, after, limit, primary):
+        '''Overall rows carry the time their streak times out so the cache
+        can drop them when it lapses. Rows that seed the leaderboard cache or
+        rank index are read with primary, as anything missed there would
+        stay missing until the next write'''
+        timeout = timedelta(seconds=self.STREAK_TIMEOUT)
+        results = await self.storage.query_board(key, after, limit, datetime.now() - timeout, primary)
+        if key[1:] == ('overall',):
+            results = [(user_id, streak, (claimed + timeout).timestamp())
+                       for user_id, streak, claimed in results]
+        return results
+
+    async def generate_leaderboard(self, guild_id, title, stats, colour, thumbnail, footer, start=1):
+        '''Helper function to generate embeds for leaderboards - gracefully handles
+        users no longer being on the server. Numbering begins at start so that
+        later pages carry on from the page before.'''
+        names = self.resolve_names(guild_id, (row[0] for row in stats))
+        lines = []
+        for user, stat, *_ in stats:
+            username = names.get(int(user))
+            if username is not None:
+                lines.append(f'**{start + len(lines)}.** {username}  -  {stat}')
+        embed = discord.Embed(color=colour)
+        embed.set_thumbnail(url=thumbnail)
+        embed.add_field(name=title, value='\n'.join(lines) or 'Nobody on this page', inline=True)
+        embed.set_footer(text=footer)
+        return embed
+
+
+class ShardedStreakbot(Streakbot, commands.AutoShardedBot):
+    '''Streakbot on an auto-sharded gateway connection, used with PerGuild so
+    that one instance can serve many large guilds. Every guild's data lives
+    in its own partition, so a shard only ever reads its own guilds' rows'''
@@ -0,0 +1,26 @@
+import asyncio
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage.memory import MemoryStorage
+from storage.sqlite import SQLiteStorage
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def with_storage(request):
+    '''Runs an async test body against a fresh MemoryStorage and then a fresh
+    in-memory SQLiteStorage. The storage is opened and closed inside the same
+    event loop as the body, which aiosqlite needs'''
+    def run(body):
+        async def main():
+            storage = MemoryStorage() if request.param == 'memory' else SQLiteStorage(':memory:')
+            await storage.start()
+            try:
+                return await body(storage)
+            finally:
+                await storage.close()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,70 @@
+from cache import LeaderboardCache
+
+KEY = ('overall',)
+
+
+def test_fill_and_get_in_board_order():
+    cache = LeaderboardCache(10)
+    cache.fill(KEY, [('2', 5), (3, 9), (1, 5)], cache.version(KEY))
+    # Ties are broken by user ID, as in the board queries
+    assert cache.get(KEY) == [(3, 9), (1, 5), (2, 5)]
+
+
+def test_fill_racing_a_write_is_dropped():
+    cache = LeaderboardCache(10)
+    version = cache.version(KEY)
+    cache.update(KEY, 1, 4)
+    cache.fill(KEY, [(1, 3)], version)
+    assert cache.get(KEY) is None
+
+    version = cache.version(KEY)
+    cache.invalidate()
+    cache.fill(KEY, [(1, 3)], version)
+    assert cache.get(KEY) is None
+
+
+def test_update_complete_board():
+    cache = LeaderboardCache(3)
+    cache.fill(KEY, [(1, 9), (2, 5)], cache.version(KEY))
+    cache.update(KEY, 3, 7)
+    assert cache.get(KEY) == [(1, 9), (3, 7), (2, 5)]
+    # Past size the last place is dropped and the board is no longer complete
+    cache.update(KEY, 4, 8)
+    assert cache.get(KEY) == [(1, 9), (4, 8), (3, 7)]
+    cache.update(KEY, 5, 1)
+    assert cache.get(KEY) == [(1, 9), (4, 8), (3, 7)]
+    assert cache.page(KEY, (7, 3), 1) is None
+
+
+def test_update_truncated_board():
+    cache = LeaderboardCache(2)
+    cache.fill(KEY, [(1, 9), (2, 5)], cache.version(KEY))
+    # Below the last cached place of a truncated board - unknown rows may
+    # come between, so the user is left off
+    cache.update(KEY, 3, 4)
+    assert cache.get(KEY) == [(1, 9), (2, 5)]
+    cache.update(KEY, 3, 6)
+    assert cache.get(KEY) == [(1, 9), (3, 6)]
+    # A cached user falling off the end invalidates the board
+    cache.update(KEY, 1, 1)
+    assert cache.get(KEY) is None
+
+
+def test_expired_rows():
+    cache = LeaderboardCache(3)
+    cache.fill(KEY, [(1, 9, 100.0), (2, 5, 200.0)], cache.version(KEY))
+    assert cache.get(KEY, now=50) == [(1, 9), (2, 5)]
+    # A complete board just drops the lapsed rows
+    assert cache.get(KEY, now=150) == [(2, 5)]
+
+    cache.fill(KEY, [(1, 9, 100.0), (2, 5, None), (3, 4, None)], cache.version(KEY))
+    # A full board cannot vouch for its last places once a row lapses
+    assert cache.get(KEY, now=150) is None
+
+
+def test_page_after_cursor():
+    cache = LeaderboardCache(10)
+    cache.fill(KEY, [(1, 9), (2, 7), (3, 7), (4, 1)], cache.version(KEY))
+    assert [row[0] for row in cache.page(KEY, None, 2)] == [1, 2]
+    assert [row[0] for row in cache.page(KEY, (7, 2), 2)] == [3, 4]
+    assert cache.page(KEY, (1, 4), 2) == []
@@ -0,0 +1,36 @@
+from datetime import datetime
+from types import SimpleNamespace
+import pytest
+from cogs.log import Log_Commands
+
+
+@pytest.fixture
+def cog():
+    return Log_Commands(SimpleNamespace(LOG_FLUSH_INTERVAL=0))
+
+
+@pytest.mark.parametrize('period, expected', [
+    ('03-2024', '2024-03'),
+    ('12-2024', '2024-12'),
+    ('2024', '2024'),
+    ('Q2-2024', '2024-Q2'),
+    ('2024-q4', '2024-Q4'),
+    ('all', 'all'),
+    ('AllTime', 'all'),
+    ('13-2024', None),
+    ('00-2024', None),
+    ('Q5-2024', None),
+    ('2024-03', None),
+    ('march', None),
+])
+def test_parse_period(cog, period, expected):
+    assert cog.parse_period(period) == expected
+
+
+def test_parse_period_defaults_to_this_month(cog):
+    assert cog.parse_period(None) == datetime.now().strftime('%Y-%m')
+
+
+def test_describe_period_round_trips(cog):
+    for period in ('2024-03', '2024', 'all'):
+        assert cog.parse_period(cog.describe_period(period).replace('All Time', 'all')) == period
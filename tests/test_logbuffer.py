@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+from logbuffer import LogBuffer
+
+MONTH = '2026-03'
+
+
+def test_flush(with_storage):
+    async def body(storage):
+        buffer = LogBuffer(SimpleNamespace(storage=storage), 60, 100)
+        buffer.add(0, 1, MONTH, 'pages', 10)
+        buffer.add(0, 1, MONTH, 'pages', 5)
+        buffer.add(0, 1, MONTH, 'time', 30)
+        buffer.add(0, 2, MONTH, 'pages', 7)
+        buffer.add(1, 1, MONTH, 'pages', 2)
+        buffer.add(0, 2, '2026-01', 'pages', 1)
+        assert buffer.get(0, 1, MONTH, 'pages') == 15
+        assert buffer.get(0, 2, '2026-Q1', 'pages') == 8
+        assert await buffer.flush()
+        assert buffer.get(0, 1, MONTH, 'pages') == 0
+        assert await storage.get_user_logs(0, 1, MONTH, 'pages') == {
+            MONTH: 15, '2026': 15, '2026-Q1': 15, 'all': 15}
+        assert await storage.get_user_log(0, 1, MONTH, 'time') == 30
+        assert await storage.get_user_log(0, 2, MONTH, 'pages') == 7
+        assert await storage.get_user_log(0, 2, '2026', 'pages') == 8
+        assert await storage.get_user_log(1, 1, MONTH, 'pages') == 2
+    with_storage(body)
+
+
+def test_failed_flush_is_retried(with_storage):
+    async def body(storage):
+        buffer = LogBuffer(SimpleNamespace(storage=storage), 60, 100)
+        add_logs = storage.add_logs
+
+        async def fail(rows):
+            raise RuntimeError('database is down')
+        storage.add_logs = fail
+        buffer.add(0, 1, MONTH, 'pages', 10)
+        assert not await buffer.flush()
+        # The failed increments are merged with anything added since
+        buffer.add(0, 1, MONTH, 'pages', 4)
+        assert buffer.get(0, 1, MONTH, 'pages') == 14
+
+        storage.add_logs = add_logs
+        assert await buffer.flush()
+        assert buffer.get(0, 1, MONTH, 'pages') == 0
+        assert await storage.get_user_log(0, 1, MONTH, 'pages') == 14
+    with_storage(body)
+
+
+def test_totals_count_buffered_and_stored(with_storage):
+    async def body(storage):
+        buffer = LogBuffer(SimpleNamespace(storage=storage), 60, 100)
+        buffer.add(0, 1, MONTH, 'pages', 10)
+        await buffer.flush()
+        buffer.add(0, 1, MONTH, 'pages', 3)
+        assert await buffer.totals(0, 1, MONTH, 'pages') == {
+            MONTH: 13, '2026': 13, '2026-Q1': 13, 'all': 13}
+    with_storage(body)
+
+
+def test_reads_only_wait_for_a_flush_holding_the_user(with_storage):
+    async def body(storage):
+        buffer = LogBuffer(SimpleNamespace(storage=storage), 60, 100)
+        add_logs = storage.add_logs
+        written = asyncio.Event()
+
+        async def slow(rows):
+            await written.wait()
+            await add_logs(rows)
+        storage.add_logs = slow
+        buffer.add(0, 1, MONTH, 'pages', 10)
+        flush = asyncio.create_task(buffer.flush())
+        await asyncio.sleep(0)
+        assert buffer.flushing
+
+        # Users outside the flush are read straight away while it runs
+        buffer.add(0, 2, MONTH, 'pages', 3)
+        assert (await asyncio.wait_for(buffer.totals(0, 2, MONTH, 'pages'), 1))[MONTH] == 3
+        assert await asyncio.wait_for(buffer.total(0, 2, '2026', 'pages'), 1) == 3
+
+        # The flushed user cannot tell whether the read saw the flush, so
+        # waits for it and is counted once
+        buffer.add(0, 1, MONTH, 'pages', 4)
+        totals = asyncio.create_task(buffer.totals(0, 1, MONTH, 'pages'))
+        total = asyncio.create_task(buffer.total(0, 1, 'all', 'pages'))
+        await asyncio.sleep(0.01)
+        assert not totals.done() and not total.done()
+        written.set()
+        assert await flush
+        assert (await totals)[MONTH] == 14
+        assert await total == 14
+        assert await buffer.total(0, 3, MONTH, 'pages') is None
+    with_storage(body)
@@ -0,0 +1,100 @@
+from outbox import Outbox, OutboxContext, Queued, MESSAGE_LIMIT, PRIORITY_REPLY, PRIORITY_REMINDER
+from types import SimpleNamespace
+import asyncio
+import heapq
+import itertools
+
+
+class Channel:
+    id = 1
+
+    def __init__(self, delivered=None):
+        self.sent = []
+        self.delivered = delivered
+
+    async def send(self, content, **kwargs):
+        await asyncio.sleep(0.001)
+        if self.delivered is not None:
+            # Held up by Discord until the test lets it through
+            await self.delivered.wait()
+        self.sent.append(content)
+        return content
+
+
+def queue_of(*entries):
+    order = itertools.count()
+    queue = []
+    for priority, content, kwargs in entries:
+        heapq.heappush(queue, (priority, next(order), Queued(content, kwargs, None)))
+    return queue
+
+
+def test_take_merges_plain_text():
+    queue = queue_of((PRIORITY_REPLY, 'a', {}), (PRIORITY_REPLY, 'b', {}), (PRIORITY_REPLY, 'c', {}))
+    outbox = Outbox(10, 2)
+    assert [item.content for item in outbox.take(queue)] == ['a', 'b']
+    assert [item.content for item in outbox.take(queue)] == ['c']
+    assert not queue
+
+
+def test_take_replies_before_reminders():
+    queue = queue_of((PRIORITY_REMINDER, 'reminder', {}), (PRIORITY_REPLY, 'reply', {}))
+    outbox = Outbox(10, 5)
+    assert [item.content for item in outbox.take(queue)] == ['reply', 'reminder']
+
+
+def test_take_stops_at_embeds_and_the_length_limit():
+    embed = object()
+    queue = queue_of((PRIORITY_REPLY, 'a', {}), (PRIORITY_REPLY, None, {'embed': embed}),
+                     (PRIORITY_REPLY, 'b', {}))
+    outbox = Outbox(10, 5)
+    assert [item.content for item in outbox.take(queue)] == ['a']
+    # Messages with an embed or other options are sent on their own
+    assert [item.kwargs for item in outbox.take(queue)] == [{'embed': embed}]
+
+    queue = queue_of((PRIORITY_REPLY, 'x' * (MESSAGE_LIMIT - 2), {}), (PRIORITY_REPLY, 'yy', {}),
+                     (PRIORITY_REPLY, 'z', {}))
+    assert len(outbox.take(queue)) == 1
+    assert [item.content for item in outbox.take(queue)] == ['yy', 'z']
+
+
+def test_send_never_queues_more_than_max_queue():
+    async def main():
+        outbox = Outbox(2, 1)
+        channel = Channel()
+        peak = 0
+
+        async def reply(number):
+            nonlocal peak
+            future = await outbox.send(channel, str(number))
+            peak = max(peak, len(outbox))
+            return await future
+        # Workers come and go as the queue drains, and the limit must hold
+        # across them
+        for _ in range(3):
+            assert await asyncio.gather(*(reply(number) for number in range(10))) == [str(n) for n in range(10)]
+        assert peak <= 2
+        assert not outbox.slots and not outbox.workers
+    asyncio.run(main())
+
+
+def test_handler_returns_before_delivery():
+    async def main():
+        delivered = asyncio.Event()
+        channel = Channel(delivered)
+        outbox = Outbox(1, 5)
+        ctx = OutboxContext(message=SimpleNamespace(channel=channel, _state=None),
+                            bot=SimpleNamespace(outbox=outbox), view=None)
+
+        future = await asyncio.wait_for(ctx.send('first'), 1)
+        assert not future.done() and channel.sent == []
+        # The channel's only slot is taken, so the next handler waits for it
+        second = asyncio.create_task(ctx.send('second'))
+        await asyncio.sleep(0.01)
+        assert not second.done()
+
+        delivered.set()
+        assert await future == 'first'
+        assert await (await second) == 'second'
+        assert channel.sent == ['first', 'second']
+    asyncio.run(main())
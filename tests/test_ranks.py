@@ -0,0 +1,34 @@
+from ranks import RankBoard, RankIndex
+
+KEY = (0, 'overall')
+
+
+def test_rank_board_order():
+    board = RankBoard()
+    board.load([(1, 5), ('2', 9), (3, 5), (4, 1)])
+    assert board.rank(2) == (1, 9)
+    # Ties are broken by user ID, as on the leaderboard
+    assert board.rank(1) == (2, 5)
+    assert board.rank(3) == (3, 5)
+    assert board.rank(5) is None
+    assert board.around(3, 1) == [(2, 1, 5), (3, 3, 5), (4, 4, 1)]
+    assert board.around(1, 1) == [(1, 2, 9), (2, 1, 5)]
+
+    board.set(4, 10)
+    assert board.rank(4) == (1, 10)
+    assert len(board) == 4
+    board.remove(2)
+    assert board.around(1, 5) == [(1, 4, 10), (2, 1, 5), (3, 3, 5)]
+
+
+def test_rank_board_expiry_and_load_race():
+    index = RankIndex()
+    board = index.start(KEY)
+    # A write landing while the board loads wins over the older loaded row
+    index.update(KEY, 1, 8, expires=100.0)
+    board.load([(1, 3, None), (2, 6, 300.0)])
+    assert index.get(KEY) is None
+    board.complete = True
+    assert index.get(KEY, now=50).rank(1) == (1, 8)
+    assert index.get(KEY, now=150).rank(1) is None
+    assert index.get(KEY, now=150).rank(2) == (1, 6)
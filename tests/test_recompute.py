@@ -0,0 +1,66 @@
+import random
+from datetime import datetime, timedelta
+from storage import EVENT_CLAIM, EVENT_LOG
+import recompute
+
+COOLDOWN = 23 * 3600
+TIMEOUT = 48 * 3600
+
+
+async def export(storage, table):
+    rows = []
+    async for batch in storage.export_rows(table, 100):
+        rows.extend(batch)
+    return rows
+
+
+async def snapshot(storage, keys, months):
+    users = [row[:2] + row[4:] for row in await export(storage, 'users')]
+    rollups = {(*key, month, type): await storage.get_user_logs(*key, month, type)
+               for key in keys for month in months for type in ('pages', 'time')}
+    return users, await export(storage, 'streak_history'), await export(storage, 'logs'), rollups
+
+
+def test_replay_matches_live_tables(with_storage):
+    async def body(storage):
+        rnd = random.Random(1)
+        now = datetime(datetime.now().year, 1, 1, 8, 0)
+        keys = [(guild_id, user_id) for guild_id in (0, 1) for user_id in range(1, 11)]
+        months = set()
+        # Claims and logs the way the cogs write them, with an event for each
+        for _ in range(600):
+            now += timedelta(minutes=rnd.randint(1, 120))
+            guild_id, user_id = rnd.choice(keys)
+            response = await storage.claim_daily(guild_id, user_id, f'user{user_id}', '0001',
+                                                 now, COOLDOWN, TIMEOUT)
+            if response['status'] != 'on_cooldown':
+                await storage.add_events([(guild_id, user_id, now, EVENT_CLAIM, 0)])
+            type = rnd.choice(('pages', 'time'))
+            amount = rnd.randint(1, 50)
+            await storage.add_log(guild_id, user_id, now.strftime('%Y-%m'), type, amount)
+            await storage.add_events([(guild_id, user_id, now, EVENT_LOG[type], amount)])
+            months.add(now.strftime('%Y-%m'))
+        live = await snapshot(storage, keys, sorted(months))
+        assert live[0] and live[2]
+
+        # Damage every derived table, then rebuild it from the events
+        await storage.import_rows('users', [(*key, None, 999, 0, 0, 999) for key in keys],
+                                  recompute.USER_COLUMNS)
+        await storage.import_rows('logs', [(*row[:3], 0, 0) for row in live[2]])
+        assert await snapshot(storage, keys, sorted(months)) != live
+
+        assert await recompute.recompute(storage, COOLDOWN, TIMEOUT, batch_size=7) == len(keys)
+        assert await snapshot(storage, keys, sorted(months)) == live
+    with_storage(body)
+
+
+def test_replay_rolls_over_years():
+    events = [(datetime(2024, 12, 30, 9), EVENT_CLAIM, 0),
+              (datetime(2024, 12, 31, 9), EVENT_CLAIM, 0),
+              (datetime(2025, 1, 1, 9), EVENT_CLAIM, 0),
+              (datetime(2025, 1, 1, 10), EVENT_LOG['pages'], 12)]
+    user, history, logs = recompute.replay(events, COOLDOWN, TIMEOUT, 2026)
+    assert history == {2024: 2, 2025: 1}
+    assert user['streak'] == 3 and user['personal_best'] == 3
+    assert user['current_year_best'] == user['current_year_streak'] == 0
+    assert logs == {'2025-01': {'pages': 12, 'time': 0}}
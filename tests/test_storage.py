@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timedelta
+from storage import apply_claim
+from storage.sqlite import SQLiteStorage
+
+COOLDOWN = 23 * 3600
+TIMEOUT = 48 * 3600
+NOW = datetime(2026, 3, 10, 20, 0)
+
+
+def test_apply_claim_first_claim():
+    response = apply_claim(None, NOW, COOLDOWN, TIMEOUT)
+    assert response == {'status': 'success', 'streak': 1, 'personal_best': 1,
+                        'current_year_streak': 1, 'current_year_best': 1}
+
+
+def test_apply_claim_on_cooldown():
+    response = apply_claim((NOW - timedelta(hours=20), 5, 9, 5, 5), NOW, COOLDOWN, TIMEOUT)
+    assert response['status'] == 'on_cooldown'
+    assert response['cooldown'] == 3 * 3600
+
+
+def test_apply_claim_success():
+    response = apply_claim((NOW - timedelta(hours=30), 9, 9, 4, 6), NOW, COOLDOWN, TIMEOUT)
+    assert response == {'status': 'success', 'streak': 10, 'personal_best': 10,
+                        'current_year_streak': 5, 'current_year_best': 6}
+
+
+def test_apply_claim_timeout():
+    response = apply_claim((NOW - timedelta(hours=50), 7, 9, 7, 7), NOW, COOLDOWN, TIMEOUT)
+    # The streak restarts and the best counters are left alone
+    assert response == {'status': 'timeout', 'streak': 1, 'personal_best': 9,
+                        'current_year_streak': 7, 'current_year_best': 7}
+
+
+def test_claim_daily(with_storage):
+    async def body(storage):
+        first = await storage.claim_daily(0, 1, 'user', '0001', NOW, COOLDOWN, TIMEOUT)
+        assert first['status'] == 'success' and first['streak'] == 1
+
+        again = await storage.claim_daily(0, 1, 'user', '0001', NOW + timedelta(hours=1), COOLDOWN, TIMEOUT)
+        assert again['status'] == 'on_cooldown'
+        assert again['cooldown'] == COOLDOWN - 3600
+
+        next_day = NOW + timedelta(days=1)
+        second = await storage.claim_daily(0, 1, 'user', '0001', next_day, COOLDOWN, TIMEOUT)
+        assert second['status'] == 'success' and second['streak'] == 2
+
+        late = await storage.claim_daily(0, 1, 'user', '0001', next_day + timedelta(days=3), COOLDOWN, TIMEOUT)
+        assert late['status'] == 'timeout' and late['streak'] == 1
+        assert late['personal_best'] == 2
+    with_storage(body)
+
+
+def test_rollover_batch_is_idempotent(with_storage):
+    async def body(storage):
+        for day in (29, 30):
+            await storage.claim_daily(0, 1, 'one', '0001', datetime(2025, 12, day, 12), COOLDOWN, TIMEOUT)
+        await storage.claim_daily(1, 1, 'one', '0001', datetime(2025, 12, 30, 12), COOLDOWN, TIMEOUT)
+        await storage.claim_daily(0, 2, 'two', '0002', datetime(2026, 1, 2, 12), COOLDOWN, TIMEOUT)
+        for _ in range(2):
+            after = 0
+            while (after := await storage.rollover_batch(2026, after, 1)) is not None:
+                pass
+        # Each guild's year is archived separately
+        assert await storage.get_user_pb(0, 1, 2025) == 2
+        assert await storage.get_user_pb(1, 1, 2025) == 1
+        assert await storage.get_user_pb(0, 2, 2025) is None
+        current = dict(row[:2] for row in await storage.query_board((0, 'current'), None, 10, NOW))
+        assert current.get(1, 0) == 0 and current[2] == 1
+    with_storage(body)
+
+
+def test_timeout_streaks(with_storage):
+    async def body(storage):
+        await storage.claim_daily(0, 1, 'one', '0001', NOW - timedelta(days=3), COOLDOWN, TIMEOUT)
+        await storage.claim_daily(0, 2, 'two', '0002', NOW - timedelta(hours=1), COOLDOWN, TIMEOUT)
+        cutoff = NOW - timedelta(seconds=TIMEOUT)
+        assert await storage.timeout_streaks(cutoff, 100) == 1
+        assert await storage.timeout_streaks(cutoff, 100) == 0
+    with_storage(body)
+
+
+def test_timeout_streaks_per_guild(with_storage):
+    async def body(storage):
+        # One user with an expired streak in guild 0 and a live one in guild 1
+        await storage.claim_daily(0, 1, 'one', '0001', NOW - timedelta(days=3), COOLDOWN, TIMEOUT)
+        await storage.claim_daily(1, 1, 'one', '0001', NOW - timedelta(hours=1), COOLDOWN, TIMEOUT)
+        cutoff = NOW - timedelta(seconds=TIMEOUT)
+        assert await storage.timeout_streaks(cutoff, 100) == 1
+        assert await storage.timeout_streaks(cutoff, 100) == 0
+        streaks = [(row[0], row[5]) async for batch in storage.export_rows('users', 100) for row in batch]
+        assert streaks == [(0, 0), (1, 1)]
+    with_storage(body)
+
+
+def test_sqlite_reads_wait_for_open_transactions():
+    async def main():
+        storage = SQLiteStorage(':memory:')
+        await storage.start()
+        try:
+            await storage.claim_daily(0, 1, 'one', '0001', NOW, COOLDOWN, TIMEOUT)
+            # Hold a write transaction open the way claims and the rollover do
+            async with storage.lock:
+                await storage.conn.execute('BEGIN IMMEDIATE')
+                await storage.execute('UPDATE users SET personal_best = 50')
+                read = asyncio.create_task(storage.get_user_pb(0, 1, 0))
+                board = asyncio.create_task(storage.query_board((0, 'pb', 0), None, 10, NOW))
+                await asyncio.sleep(0.01)
+                assert not read.done() and not board.done()
+                await storage.conn.rollback()
+            # Neither read saw the rolled back row
+            assert await read == 1
+            assert await board == [(1, 1)]
+        finally:
+            await storage.close()
+    asyncio.run(main())
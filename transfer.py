@@ -0,0 +1,149 @@
+'''Streaming export and import of the users, logs, streak_history and events
+tables as JSONL or CSV, for backups, moving between backends and seeding large
+synthetic populations. Rows are read and written in batches, so memory use
+stays flat however big a table is.
+
+Run from the repository root with the bot's config.ini, e.g.
+
+    python transfer.py export users users.jsonl
+    python transfer.py export all backup/ --format csv
+    python transfer.py import logs logs.csv
+
+Imports replace rows with the same primary key, and log rollups are rebuilt
+once logs have been imported. Each batch is committed as it goes, so an
+import that fails part way leaves the batches before it in place.
+'''
+from datetime import datetime
+import argparse
+import asyncio
+import configparser
+import csv
+import json
+import logging
+import os
+import sys
+from storage import create_storage, EXPORT_TABLES
+
+FORMATS = ('jsonl', 'csv')
+
+
+def format_of(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    return value
+
+
+def decode(column, value):
+    '''Parses a value read back from a file into the form import_rows takes'''
+    if value is None or value == '':
+        if column in ('daily_claimed', 'at'):
+            return None
+        raise ValueError(f'Missing {column}')
+    if column in ('daily_claimed', 'at'):
+        return datetime.fromisoformat(value)
+    if column == 'username':
+        return str(value)
+    if column == 'month':
+        datetime.strptime(value, '%Y-%m')
+        return value
+    return int(value)
+
+
+async def export_table(storage, table, file, format, batch_size=1000):
+    '''Streams every row of a table to an open text file and returns how many
+    rows were written'''
+    columns = EXPORT_TABLES[table]
+    writer = csv.writer(file) if format == 'csv' else None
+    if writer is not None:
+        writer.writerow(columns)
+    count = 0
+    async for rows in storage.export_rows(table, batch_size):
+        if writer is not None:
+            writer.writerows(['' if value is None else encode(value) for value in row] for row in rows)
+        else:
+            file.writelines(json.dumps(dict(zip(columns, map(encode, row)))) + '\n' for row in rows)
+        count += len(rows)
+    return count
+
+
+def read_records(file, format):
+    if format == 'csv':
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+async def import_table(storage, table, file, format, batch_size=1000):
+    '''Streams rows from an open text file into a table in batches and
+    returns how many rows were read. Unknown columns are ignored and every
+    column the table has must be present'''
+    columns = EXPORT_TABLES[table]
+    batch = []
+    count = 0
+    for number, record in enumerate(read_records(file, format), 1):
+        try:
+            batch.append(tuple(decode(column, record.get(column)) for column in columns))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f'Invalid {table} row {number} - {e}') from e
+        if len(batch) >= batch_size:
+            await storage.import_rows(table, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        await storage.import_rows(table, batch)
+        count += len(batch)
+    if table == 'logs':
+        await storage.rebuild_rollups()
+    return count
+
+
+async def run(config, args):
+    storage = create_storage(config)
+    await storage.start()
+    try:
+        tables = list(EXPORT_TABLES) if args.table == 'all' else [args.table]
+        for table in tables:
+            path = os.path.join(args.path, f'{table}.{args.format or "jsonl"}') if args.table == 'all' else args.path
+            format = args.format or format_of(path)
+            if args.action == 'export':
+                with open(path, 'w', newline='') as f:
+                    count = await export_table(storage, table, f, format, args.batch)
+            else:
+                with open(path, newline='') as f:
+                    count = await import_table(storage, table, f, format, args.batch)
+            logging.info(f'{args.action.capitalize()}ed {count} {table} rows {"to" if args.action == "export" else "from"} {path}')
+    finally:
+        await storage.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export or import the streak and log tables')
+    parser.add_argument('action', choices=['export', 'import'])
+    parser.add_argument('table', choices=list(EXPORT_TABLES) + ['all'])
+    parser.add_argument('path', help='file to read or write, or a directory of <table>.<format> files for all')
+    parser.add_argument('--format', choices=FORMATS, help='defaults to csv for .csv files and jsonl otherwise')
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--batch', type=int, default=1000, help='rows per query')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', stream=sys.stderr, level=logging.INFO)
+    config = configparser.ConfigParser()
+    if not config.read(args.config):
+        sys.exit(f'Could not load configuration file {args.config}')
+    if args.table == 'all' and args.action == 'export':
+        os.makedirs(args.path, exist_ok=True)
+    try:
+        asyncio.run(run(config, args))
+    except Exception as e:
+        logging.exception(f'Could not {args.action} - {e}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import asyncio
+import discord
+
+PAGE_SIZE = 10
+
+
+class LeaderboardView(discord.ui.View):
+    '''Previous and next buttons for a paged leaderboard embed. Pages of the
+    board key are fetched on demand after the (value, user_id) keyset cursor
+    of the last row on the page before, so every page costs the same however
+    far down the board it is.'''
+    def __init__(self, bot, key, title, colour, thumbnail, footer):
+        super().__init__(timeout=300)
+        self.bot = bot
+        self.key = key
+        self.title = title
+        self.colour = colour
+        self.thumbnail = thumbnail
+        self.footer = footer
+        self.cursors = [None]
+        self.ranks = [1]
+        self.rows = []
+        self.message = None
+
+    async def render(self):
+        '''Fetches the current page and builds its embed, or returns None if
+        the page could not be fetched. Rendered pages are shared through the
+        bot's embed cache, keyed by the page and checked against the version
+        of the board taken before the fetch, so an unchanged page is reused
+        as it is'''
+        cache_key = (self.key, self.cursors[-1], self.ranks[-1], self.title, str(self.thumbnail))
+        version = self.bot.board_version(self.key)
+        page = self.bot.embeds.get(cache_key, version)
+        if page is None:
+            rows = await self.bot.get_board(self.key, self.cursors[-1], PAGE_SIZE + 1)
+            if rows is False:
+                return None
+            embed = await self.bot.generate_leaderboard(self.key[0], self.title, rows[:PAGE_SIZE], self.colour,
+                                                        self.thumbnail, self.footer,
+                                                        start=self.ranks[-1])
+            page = ([(user_id, value) for user_id, value, _ in rows], embed)
+            # The page changes as soon as a streak on it, or the one after it, times out
+            expires = min((row[2] for row in rows if row[2] is not None), default=None)
+            self.bot.embeds.set(cache_key, version, page, expires)
+        rows, embed = page
+        self.rows = rows[:PAGE_SIZE]
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = len(rows) <= PAGE_SIZE
+        return embed
+
+    async def send(self, ctx):
+        '''Sends the first page. Returns False if there was nothing to show.
+        The message is kept for on_timeout, as a future while it is still
+        queued on the outbox'''
+        embed = await self.render()
+        if embed is None or not self.rows:
+            return False
+        if self.next_page.disabled:
+            self.message = await ctx.send(embed=embed)
+        else:
+            self.message = await ctx.send(embed=embed, view=self)
+        return True
+
+    @discord.ui.button(label='Previous', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        self.cursors.pop()
+        self.ranks.pop()
+        await self.show(interaction)
+
+    @discord.ui.button(label='Next', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        user_id, value = self.rows[-1]
+        self.cursors.append((value, user_id))
+        self.ranks.append(self.ranks[-1] + len(self.rows))
+        await self.show(interaction)
+
+    async def show(self, interaction):
+        embed = await self.render()
+        if embed is None:
+            await interaction.response.send_message('Unable to fetch this page', ephemeral=True)
+        else:
+            await interaction.response.edit_message(embed=embed, view=self)
+
+    async def on_timeout(self):
+        message = self.message
+        if asyncio.isfuture(message):
+            # Queued on the outbox - None if it never went out
+            message = await message
+        if message is not None:
+            try:
+                await message.edit(view=None)
+            except discord.HTTPException:
+                pass